@@ -0,0 +1,141 @@
+import asyncio
+import hashlib
+import os
+import random
+
+from governor import UpstreamError
+
+LLM_BACKEND = os.getenv("LLM_BACKEND", "groq")  # "groq" or "fake"
+
+FAKE_MODEL = os.getenv("FAKE_LLM_MODEL", "fake-llm")
+FAKE_LATENCY_MS = os.getenv("FAKE_LLM_LATENCY_MS", "normal:300,80")
+FAKE_COMPLETION_TOKENS = os.getenv("FAKE_LLM_COMPLETION_TOKENS", "uniform:40,160")
+FAKE_ERROR_RATE = float(os.getenv("FAKE_LLM_ERROR_RATE", 0.0))
+FAKE_ERROR_STATUS = int(os.getenv("FAKE_LLM_ERROR_STATUS", 503))
+FAKE_RETRY_AFTER = os.getenv("FAKE_LLM_RETRY_AFTER")  # seconds, sent with injected errors
+FAKE_SEED = int(os.getenv("FAKE_LLM_SEED", 1234))
+
+
+class LLMBackend:
+    """Interface for chat completion providers.
+
+    `complete()` returns an OpenAI-shaped completion dict; `stream()` yields
+    content deltas. Retryable provider failures are raised as UpstreamError
+    so the governor can back off the same way for every backend."""
+
+    name = "base"
+    model = ""
+
+    @property
+    def configured(self) -> bool:
+        return True
+
+    async def complete(self, messages, model=None) -> dict:
+        raise NotImplementedError
+
+    async def stream(self, messages, model=None):
+        raise NotImplementedError
+        yield  # pragma: no cover
+
+
+def parse_distribution(spec: str):
+    """Turn 'fixed:50', 'uniform:20,200', 'normal:300,80' or 'lognormal:250,0.5'
+    (median, sigma) into a sampler `f(rng) -> float` clamped at zero.
+    A bare number means fixed."""
+    kind, _, args = spec.partition(":")
+    if not args:
+        kind, args = "fixed", kind
+    params = [float(p) for p in args.split(",")]
+    samplers = {
+        "fixed": lambda rng: params[0],
+        "uniform": lambda rng: rng.uniform(params[0], params[1]),
+        "normal": lambda rng: rng.gauss(params[0], params[1]),
+        "lognormal": lambda rng: params[0] * rng.lognormvariate(0.0, params[1]),
+    }
+    if kind not in samplers:
+        raise ValueError(f"Unknown distribution '{kind}' in '{spec}'")
+    sample = samplers[kind]
+    return lambda rng: max(0.0, sample(rng))
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough LLM token count (~4 characters per token) — good enough for budgeting."""
+    return max(1, len(text) // 4)
+
+
+class FakeBackend(LLMBackend):
+    """Deterministic offline stand-in for load tests and CI.
+
+    Latency, completion length and error injection are drawn from a seeded
+    RNG, and the reply text is derived from the prompt, so the same run is
+    reproducible. No network, no API key."""
+
+    name = "fake"
+
+    def __init__(self, model: str = FAKE_MODEL, latency_ms: str = FAKE_LATENCY_MS,
+                 completion_tokens: str = FAKE_COMPLETION_TOKENS, error_rate: float = FAKE_ERROR_RATE,
+                 error_status: int = FAKE_ERROR_STATUS, retry_after: str | None = FAKE_RETRY_AFTER,
+                 seed: int = FAKE_SEED):
+        self.model = model
+        self._latency = parse_distribution(latency_ms)
+        self._completion_tokens = parse_distribution(completion_tokens)
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = float(retry_after) if retry_after else None
+        self._rng = random.Random(seed)
+        self.calls = 0
+
+    def _plan(self, messages, model):
+        """Draw everything random about one call up front."""
+        self.calls += 1
+        latency = self._latency(self._rng) / 1000
+        n_tokens = max(1, int(self._completion_tokens(self._rng)))
+        fail = self._rng.random() < self.error_rate
+        prompt = messages[-1]["content"] if messages else ""
+        digest = hashlib.sha256(f"{model}\0{prompt}".encode()).hexdigest()
+        words = [digest[i % len(digest):][:6] for i in range(n_tokens)]
+        words[0] = f"[{model}]"
+        prompt_tokens = sum(estimate_tokens(m["content"]) for m in messages)
+        return latency, words, fail, prompt_tokens
+
+    def _error(self) -> UpstreamError:
+        return UpstreamError(self.error_status, "injected by FakeBackend", retry_after=self.retry_after)
+
+    async def complete(self, messages, model=None) -> dict:
+        model = model or self.model
+        latency, words, fail, prompt_tokens = self._plan(messages, model)
+        await asyncio.sleep(latency)
+        if fail:
+            raise self._error()
+        return {
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": " ".join(words)},
+                         "finish_reason": "stop"}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": len(words),
+                "total_tokens": prompt_tokens + len(words),
+            },
+        }
+
+    async def stream(self, messages, model=None):
+        model = model or self.model
+        latency, words, fail, _ = self._plan(messages, model)
+        # Spend a third of the latency before the first token, spread the rest
+        await asyncio.sleep(latency / 3)
+        if fail:
+            raise self._error()
+        per_token = (latency * 2 / 3) / len(words)
+        for i, word in enumerate(words):
+            yield word if i == 0 else f" {word}"
+            await asyncio.sleep(per_token)
+
+
+def get_backend(name: str = LLM_BACKEND, observer=None) -> LLMBackend:
+    if name == "fake":
+        return FakeBackend()
+    if name == "groq":
+        from groq_client import GroqBackend
+        return GroqBackend(observer=observer)
+    raise ValueError(f"Unknown LLM_BACKEND '{name}' (expected 'groq' or 'fake')")
+
@@ -0,0 +1,109 @@
+"""
+Offline chat throughput benchmark.
+
+Runs the real /chat handler in-process against the deterministic fake LLM
+backend, so it needs no network and no Groq key:
+
+    python bench_chat.py --requests 500 --concurrency 50
+    FAKE_LLM_LATENCY_MS=lognormal:250,0.6 FAKE_LLM_ERROR_RATE=0.02 python bench_chat.py
+
+Use --repeat to send the same question every time (exercises the response
+cache and single-flight coalescing) and --stream to measure time-to-first-
+token on the backend directly.
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+# Configure before the service modules read their environment
+os.environ.setdefault("LLM_BACKEND", "fake")
+os.environ.setdefault("CHAT_DB_PATH", os.path.join(tempfile.mkdtemp(), "bench_chat.db"))
+os.environ.setdefault("CONTENT_SERVICE_URL", "http://127.0.0.1:9")  # no content service needed
+
+import httpx  # noqa: E402
+import jwt  # noqa: E402
+
+import main  # noqa: E402
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+def _report(label: str, latencies: list[float], elapsed: float, errors: int):
+    print(f"{label}: {len(latencies)} ok, {errors} errors in {elapsed:.2f}s "
+          f"-> {len(latencies) / elapsed:.1f} req/s")
+    if latencies:
+        print(f"  latency ms  p50={_percentile(latencies, 0.50):.1f}  p95={_percentile(latencies, 0.95):.1f}  "
+              f"p99={_percentile(latencies, 0.99):.1f}  mean={statistics.mean(latencies):.1f}")
+
+
+async def bench_chat(requests: int, concurrency: int, repeat: bool):
+    token = jwt.encode({"user_id": "bench", "username": "bench", "exp": time.time() + 3600},
+                       main.SECRET_KEY, algorithm="HS256")
+    headers = {"Authorization": f"Bearer {token}"}
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://bench",
+                                 timeout=120.0) as client:
+        async def one(i: int):
+            nonlocal errors
+            message = "What topics does the AISE program cover?" if repeat else f"Benchmark question {i}"
+            async with semaphore:
+                started = time.perf_counter()
+                resp = await client.post("/chat", json={"message": message}, headers=headers)
+                if resp.status_code == 200:
+                    latencies.append((time.perf_counter() - started) * 1000)
+                else:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*[one(i) for i in range(requests)])
+        elapsed = time.perf_counter() - started
+        metrics = (await client.get("/metrics")).json()
+
+    _report("/chat", latencies, elapsed, errors)
+    print(f"  governor: {metrics['governor']}")
+    print(f"  cache: hits={metrics['cache']['hits']}  coalesced={metrics['singleflight']['coalesced_calls']}")
+
+
+async def bench_stream(requests: int, concurrency: int):
+    backend = main._backend
+    semaphore = asyncio.Semaphore(concurrency)
+    first_token, errors = [], 0
+
+    async def one(i: int):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                async for _ in backend.stream([{"role": "user", "content": f"Stream question {i}"}]):
+                    first_token.append((time.perf_counter() - started) * 1000)
+                    break
+            except Exception:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[one(i) for i in range(requests)])
+    _report("stream time-to-first-token", first_token, time.perf_counter() - started, errors)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--repeat", action="store_true", help="send the same question every time")
+    parser.add_argument("--stream", action="store_true", help="measure backend streaming instead of /chat")
+    args = parser.parse_args()
+
+    print(f"backend={main._backend.name} model={main._backend.model}")
+    if args.stream:
+        asyncio.run(bench_stream(args.requests, args.concurrency))
+    else:
+        asyncio.run(bench_chat(args.requests, args.concurrency, args.repeat))
@@ -0,0 +1,147 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+from collections import OrderedDict
+
+CACHE_ENABLED = os.getenv("CHAT_CACHE_ENABLED", "true").lower() == "true"
+CACHE_TTL_SECONDS = float(os.getenv("CHAT_CACHE_TTL_SECONDS", 3600))
+CACHE_MAX_ENTRIES = int(os.getenv("CHAT_CACHE_MAX_ENTRIES", 1000))
+CACHE_DB_PATH = os.getenv("CHAT_CACHE_DB_PATH")  # unset = memory only
+# Multi-turn prompts almost never repeat, so by default only first turns are cached
+CACHE_FIRST_TURN_ONLY = os.getenv("CHAT_CACHE_FIRST_TURN_ONLY", "true").lower() == "true"
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def _normalize(text: str) -> str:
+    return _WHITESPACE.sub(" ", text).strip().casefold()
+
+
+def prompt_fingerprint(messages: list) -> str:
+    """Stable hash of the full prompt (system prompt, trimmed history, user message).
+    Case and whitespace differences do not change the fingerprint."""
+    normalized = [[m["role"], _normalize(m["content"])] for m in messages]
+    payload = json.dumps(normalized, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ResponseCache:
+    """LRU + TTL cache of LLM completions, optionally backed by SQLite so
+    entries survive restarts. Memory is the hot tier; SQLite is consulted on
+    a memory miss and its hits are promoted back into memory."""
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, ttl_seconds: float = CACHE_TTL_SECONDS,
+                 db_path: str | None = CACHE_DB_PATH):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.db_path = db_path
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if db_path:
+            self._init_store()
+
+    # ---- SQLite backing store ----
+    def _connect(self):
+        return sqlite3.connect(self.db_path)
+
+    def _init_store(self):
+        conn = self._connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        conn.execute("DELETE FROM llm_cache WHERE expires_at < ?", (time.time(),))
+        conn.commit()
+        conn.close()
+
+    def _load(self, key: str):
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT value, expires_at FROM llm_cache WHERE key = ? AND expires_at >= ?",
+                (key, time.time()),
+            ).fetchone()
+            if row:
+                conn.execute("UPDATE llm_cache SET last_used = ? WHERE key = ?", (time.time(), key))
+                conn.commit()
+        finally:
+            conn.close()
+        if not row:
+            return None
+        return row[1], json.loads(row[0])
+
+    def _store(self, key: str, value: dict, expires_at: float):
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, expires_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), expires_at, time.time()),
+            )
+            # Same bound as memory: keep only the most recently used rows
+            conn.execute(
+                "DELETE FROM llm_cache WHERE key NOT IN "
+                "(SELECT key FROM llm_cache ORDER BY last_used DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    # ---- Public API ----
+    def get(self, key: str) -> dict | None:
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] < time.time():
+            del self._entries[key]
+            entry = None
+        if entry is None and self.db_path:
+            entry = self._load(key)
+            if entry is not None:
+                self._put_memory(key, entry)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: str, value: dict):
+        expires_at = time.time() + self.ttl_seconds
+        self._put_memory(key, (expires_at, value))
+        if self.db_path:
+            self._store(key, value, expires_at)
+
+    def _put_memory(self, key: str, entry: tuple):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        if self.db_path:
+            conn = self._connect()
+            conn.execute("DELETE FROM llm_cache")
+            conn.commit()
+            conn.close()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": CACHE_ENABLED,
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "persistent": bool(self.db_path),
+        }
@@ -0,0 +1,140 @@
+import asyncio
+import os
+import time
+
+from db import get_connection
+
+COMPACTION_ENABLED = os.getenv("COMPACTION_ENABLED", "true").lower() == "true"
+# Summarize once a session has this many turns not yet covered by its summary...
+COMPACT_AFTER_TURNS = int(os.getenv("COMPACT_AFTER_TURNS", 8))
+# ...keeping this many of the newest turns verbatim.
+COMPACT_KEEP_RECENT = int(os.getenv("COMPACT_KEEP_RECENT", 4))
+COMPACTION_CONCURRENCY = int(os.getenv("COMPACTION_CONCURRENCY", 2))
+COMPACTION_IDLE_POLL_SECONDS = float(os.getenv("COMPACTION_IDLE_POLL_SECONDS", 0.5))
+
+SUMMARY_INSTRUCTIONS = (
+    "You maintain a running summary of a tutoring conversation between an AISE fellow and an AI "
+    "assistant. Merge the existing summary with the new turns into one concise summary (at most "
+    "200 words) that keeps the user's goals, facts they shared, questions asked and conclusions reached."
+)
+
+
+def load_summary(conn, user_id: str, session_id: str) -> tuple[str | None, int]:
+    """Returns (summary, covered_rowid); turns with rowid <= covered_rowid are in the summary."""
+    row = conn.execute(
+        "SELECT summary, covered_rowid FROM chat_summaries WHERE user_id = ? AND session_id = ?",
+        (user_id, session_id),
+    ).fetchone()
+    return (row[0], row[1]) if row else (None, 0)
+
+
+class Compactor:
+    """Background worker that folds old turns of long sessions into a stored
+    rolling summary.
+
+    /chat only calls `enqueue()`, which is a set insert. The workers pick
+    sessions up later, wait until the LLM governor is idle, and summarize at
+    background priority, so compaction never adds latency to a chat turn."""
+
+    def __init__(self, summarize, is_idle=lambda: True, concurrency: int = COMPACTION_CONCURRENCY,
+                 after_turns: int = COMPACT_AFTER_TURNS, keep_recent: int = COMPACT_KEEP_RECENT):
+        self._summarize = summarize  # async (messages) -> summary text
+        self._is_idle = is_idle
+        self.concurrency = concurrency
+        self.after_turns = after_turns
+        self.keep_recent = keep_recent
+        self._pending = set()
+        self._queue = None
+        self._workers = []
+        self.compactions = 0
+        self.turns_compacted = 0
+        self.failures = 0
+
+    def enqueue(self, user_id: str, session_id: str):
+        key = (user_id, session_id)
+        if self._queue is None or key in self._pending:
+            return
+        self._pending.add(key)
+        self._queue.put_nowait(key)
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+        self._pending.clear()
+
+    async def _worker(self):
+        while True:
+            key = await self._queue.get()
+            try:
+                while not self._is_idle():
+                    await asyncio.sleep(COMPACTION_IDLE_POLL_SECONDS)
+                await self.compact(*key)
+            except Exception as e:
+                self.failures += 1
+                print(f"[chat-service] Compaction failed for session {key[1]}: {e}")
+            finally:
+                self._pending.discard(key)
+
+    # ---- DB work (runs in a thread so the event loop stays free) ----
+    def _load_candidates(self, user_id: str, session_id: str):
+        conn = get_connection()
+        try:
+            summary, covered_rowid = load_summary(conn, user_id, session_id)
+            rows = conn.execute(
+                "SELECT rowid, message, response FROM chat_history "
+                "WHERE user_id = ? AND session_id = ? AND rowid > ? ORDER BY timestamp, rowid",
+                (user_id, session_id, covered_rowid),
+            ).fetchall()
+        finally:
+            conn.close()
+        return summary, rows
+
+    def _save(self, user_id: str, session_id: str, summary: str, covered_rowid: int, turns: int):
+        conn = get_connection()
+        try:
+            conn.execute(
+                "INSERT INTO chat_summaries (user_id, session_id, summary, covered_rowid, turns_summarized, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(user_id, session_id) DO UPDATE SET summary = excluded.summary, "
+                "covered_rowid = excluded.covered_rowid, "
+                "turns_summarized = chat_summaries.turns_summarized + excluded.turns_summarized, "
+                "updated_at = excluded.updated_at",
+                (user_id, session_id, summary, covered_rowid, turns, time.time()),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    async def compact(self, user_id: str, session_id: str) -> bool:
+        """Summarize everything but the newest turns once the session is long enough."""
+        summary, rows = await asyncio.to_thread(self._load_candidates, user_id, session_id)
+        if len(rows) < self.after_turns:
+            return False
+        old_turns = rows[: len(rows) - self.keep_recent]
+        transcript = "\n".join(f"User: {msg}\nAssistant: {resp}" for _, msg, resp in old_turns)
+        prompt = f"Existing summary:\n{summary or '(none)'}\n\nNew turns:\n{transcript}"
+        new_summary = await self._summarize([
+            {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+            {"role": "user", "content": prompt},
+        ])
+        await asyncio.to_thread(self._save, user_id, session_id, new_summary, old_turns[-1][0], len(old_turns))
+        self.compactions += 1
+        self.turns_compacted += len(old_turns)
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "enabled": COMPACTION_ENABLED,
+            "running": bool(self._workers),
+            "pending": len(self._pending),
+            "compactions": self.compactions,
+            "turns_compacted": self.turns_compacted,
+            "failures": self.failures,
+        }
@@ -1,13 +1,14 @@
+import os
 import sqlite3
 
-DATABASE_PATH = "chat.db"
+DATABASE_PATH = os.getenv("CHAT_DB_PATH", "chat.db")
 
 def get_connection():
     """Returns a sqlite3 connection."""
     return sqlite3.connect(DATABASE_PATH)
 
 def init_db():
-    """Create chat_history table if it doesn't exist."""
+    """Create the chat service tables if they don't exist."""
     conn = get_connection()
     c = conn.cursor()
     c.execute("""
@@ -21,5 +22,37 @@ def init_db():
             timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
         )
     """)
+    c.execute("""
+        CREATE INDEX IF NOT EXISTS idx_chat_history_session
+        ON chat_history (user_id, session_id, timestamp)
+    """)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS chat_summaries (
+            user_id TEXT NOT NULL,
+            session_id TEXT NOT NULL,
+            summary TEXT NOT NULL,
+            covered_rowid INTEGER NOT NULL,
+            turns_summarized INTEGER DEFAULT 0,
+            updated_at REAL,
+            PRIMARY KEY (user_id, session_id)
+        )
+    """)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS usage_totals (
+            user_id TEXT PRIMARY KEY,
+            requests INTEGER NOT NULL DEFAULT 0,
+            tokens INTEGER NOT NULL DEFAULT 0,
+            updated_at REAL
+        )
+    """)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS usage_daily (
+            user_id TEXT NOT NULL,
+            day TEXT NOT NULL,
+            requests INTEGER NOT NULL DEFAULT 0,
+            tokens INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, day)
+        )
+    """)
     conn.commit()
     conn.close()
\ No newline at end of file
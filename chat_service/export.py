@@ -0,0 +1,79 @@
+import json
+import os
+import zlib
+
+from db import get_connection
+
+EXPORT_BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", 1000))
+
+_COLUMNS = ("cursor", "id", "user_id", "session_id", "message", "response", "tokens_used", "timestamp")
+
+
+def _normalize_time(value: str | None) -> str | None:
+    """Accept ISO-8601 ('2026-02-21T10:00:00') as well as SQLite's 'YYYY-MM-DD HH:MM:SS'."""
+    if not value:
+        return None
+    return value.replace("T", " ").rstrip("Z")
+
+
+def build_export_query(since=None, until=None, user_id=None, session_id=None, after: int = 0,
+                       limit: int | None = None):
+    """Keyset query over chat_history in rowid order; `after` resumes from a previous cursor."""
+    clauses, params = ["rowid > ?"], [after]
+    if since:
+        clauses.append("timestamp >= ?")
+        params.append(_normalize_time(since))
+    if until:
+        clauses.append("timestamp < ?")
+        params.append(_normalize_time(until))
+    if user_id:
+        clauses.append("user_id = ?")
+        params.append(user_id)
+    if session_id:
+        clauses.append("session_id = ?")
+        params.append(session_id)
+    sql = (
+        "SELECT rowid, id, user_id, session_id, message, response, tokens_used, timestamp "
+        f"FROM chat_history WHERE {' AND '.join(clauses)} ORDER BY rowid"
+    )
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return sql, params
+
+
+def iter_ndjson(since=None, until=None, user_id=None, session_id=None, after: int = 0,
+                batch_rows: int = EXPORT_BATCH_ROWS):
+    """Yield NDJSON bytes one batch at a time.
+
+    Only `batch_rows` rows are ever held in memory. Each batch is its own
+    short keyset query on a fresh connection, so no read lock is held while
+    a slow client consumes a chunk (the chat DB is not in WAL mode, and a
+    lingering SHARED lock would make every other writer fail). Every line
+    carries its `cursor`; pass the last one seen as `after` to resume an
+    interrupted export."""
+    while True:
+        sql, params = build_export_query(since, until, user_id, session_id, after, limit=batch_rows)
+        conn = get_connection()
+        try:
+            rows = conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+        if not rows:
+            break
+        after = rows[-1][0]
+        yield "".join(
+            json.dumps(dict(zip(_COLUMNS, row)), ensure_ascii=False) + "\n" for row in rows
+        ).encode()
+        if len(rows) < batch_rows:
+            break
+
+
+def gzip_stream(chunks):
+    """Incrementally gzip an iterable of byte chunks."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 -> gzip container
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
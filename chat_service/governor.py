@@ -0,0 +1,228 @@
+import asyncio
+import heapq
+import itertools
+import os
+import random
+import re
+import time
+from email.utils import parsedate_to_datetime
+
+MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 8))
+MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", 200))
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 3))
+BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", 0.5))
+BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", 20))
+# A retry-after longer than this is not worth holding the user for
+MAX_RETRY_AFTER_SECONDS = float(os.getenv("LLM_MAX_RETRY_AFTER_SECONDS", 30))
+
+# Lower value = served first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class UpstreamError(Exception):
+    """Non-2xx answer from the LLM provider."""
+
+    def __init__(self, status_code: int, detail: str = "", retry_after: float | None = None):
+        super().__init__(f"LLM upstream returned {status_code}: {detail}")
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self) -> bool:
+        return self.status_code in RETRYABLE_STATUS
+
+
+class GovernorOverloaded(Exception):
+    """The wait queue is full; shed load instead of queueing forever."""
+
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_UNIT_SECONDS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_duration(value: str | None) -> float | None:
+    """Parse Groq/OpenAI reset durations such as '7.66s', '2m59.56s' or '250ms'."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(n) * _UNIT_SECONDS[unit] for n, unit in parts)
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """`retry-after` is either delay-seconds or an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def _header_int(headers, name: str) -> int | None:
+    try:
+        return int(headers.get(name))
+    except (TypeError, ValueError):
+        return None
+
+
+class LLMGovernor:
+    """Bounds concurrent LLM calls, queues the rest by priority, paces sends
+    from the provider's rate-limit headers and retries retryable failures
+    with jittered exponential backoff (honouring retry-after)."""
+
+    def __init__(self, max_concurrency: int = MAX_CONCURRENCY, max_queue: int = MAX_QUEUE,
+                 max_retries: int = MAX_RETRIES, backoff_base: float = BACKOFF_BASE_SECONDS,
+                 backoff_max: float = BACKOFF_MAX_SECONDS):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self._active = 0
+        self._waiters = []  # heap of (priority, seq, future)
+        self._seq = itertools.count()
+        self._paused_until = 0.0  # monotonic; set by retry-after / exhausted quota
+        self._next_send_at = 0.0  # monotonic; pacing when quota runs low
+        self._min_interval = 0.0
+
+        self.calls = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.rejected = 0
+        self.total_queue_ms = 0.0
+        self.total_llm_ms = 0.0
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    # ---- Slot management ----
+    async def _acquire(self, priority: int):
+        if self._active < self.max_concurrency and not self._waiters:
+            self._active += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            self.rejected += 1
+            raise GovernorOverloaded("LLM wait queue is full")
+        fut = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._seq), fut)
+        heapq.heappush(self._waiters, entry)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self._release()  # we were handed a slot but won't use it
+            else:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+            raise
+
+    def _release(self):
+        while self._waiters:
+            _, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                fut.set_result(None)  # hand the slot straight to the next waiter
+                return
+        self._active -= 1
+
+    async def _pace(self):
+        now = time.monotonic()
+        start = max(now, self._paused_until, self._next_send_at)
+        self._next_send_at = start + self._min_interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    # ---- Rate-limit feedback ----
+    def observe(self, headers):
+        """Adapt the send rate from x-ratelimit-* response headers."""
+        now = time.monotonic()
+        for kind in ("requests", "tokens"):
+            remaining = _header_int(headers, f"x-ratelimit-remaining-{kind}")
+            reset = parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+            if remaining is None or reset is None:
+                continue
+            if remaining <= 0:
+                self._paused_until = max(self._paused_until, now + reset)
+            elif kind == "requests":
+                # Spread what is left of the window evenly once we run low
+                self._min_interval = reset / remaining if remaining < 2 * self.max_concurrency else 0.0
+
+    def _backoff(self, attempt: int) -> float:
+        return min(self.backoff_max, self.backoff_base * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+    # ---- Public API ----
+    async def submit(self, fn, priority: int = PRIORITY_INTERACTIVE):
+        """Run `fn()` (a coroutine factory) under the governor.
+        Returns (result, timing) with queue wait, backoff and LLM time kept apart."""
+        timing = {"queue_ms": 0.0, "backoff_ms": 0.0, "llm_ms": 0.0, "attempts": 0}
+        attempt = 0
+        while True:
+            queued_at = time.monotonic()
+            await self._acquire(priority)
+            try:
+                await self._pace()
+                started_at = time.monotonic()
+                timing["queue_ms"] += (started_at - queued_at) * 1000
+                timing["attempts"] += 1
+                try:
+                    result = await fn()
+                finally:
+                    timing["llm_ms"] += (time.monotonic() - started_at) * 1000
+                break
+            except UpstreamError as e:
+                if e.status_code == 429:
+                    self.rate_limited += 1
+                if not e.retryable or attempt >= self.max_retries:
+                    raise
+                if e.retry_after is not None and e.retry_after > MAX_RETRY_AFTER_SECONDS:
+                    raise
+                delay = e.retry_after if e.retry_after is not None else self._backoff(attempt)
+                if e.status_code == 429:
+                    # The limit is account-wide: hold back every sender, not just this one
+                    self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            finally:
+                self._release()
+
+            attempt += 1
+            self.retries += 1
+            await asyncio.sleep(delay)
+            timing["backoff_ms"] += delay * 1000
+
+        self.calls += 1
+        self.total_queue_ms += timing["queue_ms"]
+        self.total_llm_ms += timing["llm_ms"]
+        return result, {k: round(v, 2) if isinstance(v, float) else v for k, v in timing.items()}
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "active": self.active,
+            "queued": self.queued,
+            "calls": self.calls,
+            "retries": self.retries,
+            "rate_limited": self.rate_limited,
+            "rejected": self.rejected,
+            "avg_queue_ms": round(self.total_queue_ms / self.calls, 2) if self.calls else 0.0,
+            "avg_llm_ms": round(self.total_llm_ms / self.calls, 2) if self.calls else 0.0,
+            "paused_for_s": round(max(self._paused_until - time.monotonic(), 0.0), 3),
+            "min_send_interval_s": round(self._min_interval, 3),
+        }
@@ -1,28 +1,100 @@
+import json
 import os
 import httpx
 
+from backends import LLMBackend
+from governor import UpstreamError, parse_retry_after
+
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-GROQ_API_URL = "https://api.groq.com/openai/v1/chat/completions"
-GROQ_MODEL = "llama3-8b-8192"
-
-async def send_to_groq(messages):
-    """Call Groq API and return the JSON result."""
-    if not GROQ_API_KEY:
-        raise Exception("GROQ_API_KEY not configured")
-
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        response = await client.post(
-            GROQ_API_URL,
-            headers={
-                "Authorization": f"Bearer {GROQ_API_KEY}",
-                "Content-Type": "application/json",
-            },
-            json={
-                "model": GROQ_MODEL,
-                "messages": messages,
-                "temperature": 0.7,
-                "max_tokens": 1024,
-            },
-        )
-        response.raise_for_status()
-        return response.json()
\ No newline at end of file
+GROQ_API_URL = os.getenv("GROQ_API_URL", "https://api.groq.com/openai/v1/chat/completions")
+GROQ_MODEL = os.getenv("GROQ_MODEL", "llama3-8b-8192")
+
+
+class GroqBackend(LLMBackend):
+    """Groq's OpenAI-compatible chat completions API."""
+
+    name = "groq"
+
+    def __init__(self, api_key: str | None = GROQ_API_KEY, api_url: str = GROQ_API_URL,
+                 model: str = GROQ_MODEL, observer=None, transport: httpx.AsyncBaseTransport | None = None):
+        self.api_key = api_key
+        self.api_url = api_url
+        self.model = model
+        self._observer = observer  # receives response headers (rate-limit feedback)
+        self._transport = transport
+        self._client = None
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.api_key)
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """One pooled client per backend instead of a new TLS handshake per call."""
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=30.0, transport=self._transport)
+        return self._client
+
+    def _payload(self, messages, model, stream=False) -> dict:
+        return {
+            "model": model or self.model,
+            "messages": messages,
+            "temperature": 0.7,
+            "max_tokens": 1024,
+            "stream": stream,
+        }
+
+    @property
+    def _headers(self) -> dict:
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+        }
+
+    def _check(self, response: httpx.Response, body: str = ""):
+        if self._observer:
+            self._observer(response.headers)
+        if response.is_error:
+            raise UpstreamError(
+                response.status_code,
+                body[:200],
+                retry_after=parse_retry_after(response.headers.get("retry-after")),
+            )
+
+    async def complete(self, messages, model=None) -> dict:
+        if not self.configured:
+            raise Exception("GROQ_API_KEY not configured")
+        try:
+            response = await self._get_client().post(
+                self.api_url, headers=self._headers, json=self._payload(messages, model)
+            )
+        except httpx.TimeoutException as e:
+            raise UpstreamError(504, f"timeout: {e}")
+        except httpx.TransportError as e:
+            raise UpstreamError(503, f"connection failed: {e}")
+        self._check(response, response.text)
+        return response.json()
+
+    async def stream(self, messages, model=None):
+        if not self.configured:
+            raise Exception("GROQ_API_KEY not configured")
+        try:
+            async with self._get_client().stream(
+                "POST", self.api_url, headers=self._headers, json=self._payload(messages, model, stream=True)
+            ) as response:
+                if response.is_error:
+                    await response.aread()
+                self._check(response, response.text if response.is_error else "")
+                # Server-sent events: `data: {...}` lines terminated by `data: [DONE]`
+                async for line in response.aiter_lines():
+                    if not line.startswith("data: "):
+                        continue
+                    data = line[len("data: "):]
+                    if data == "[DONE]":
+                        break
+                    delta = json.loads(data)["choices"][0].get("delta", {}).get("content")
+                    if delta:
+                        yield delta
+        except httpx.TimeoutException as e:
+            raise UpstreamError(504, f"timeout: {e}")
+        except httpx.TransportError as e:
+            raise UpstreamError(503, f"connection failed: {e}")
@@ -1,4 +1,7 @@
-from fastapi import FastAPI, Header, HTTPException
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Header, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 import os
 import uuid
@@ -8,7 +11,15 @@ import time
 import jwt
 
 from db import get_connection, init_db
-from groq_client import send_to_groq, GROQ_API_KEY, GROQ_MODEL, GROQ_API_URL
+from backends import get_backend, LLM_BACKEND
+from governor import LLMGovernor, UpstreamError, GovernorOverloaded, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+from cache import ResponseCache, prompt_fingerprint, CACHE_ENABLED, CACHE_FIRST_TURN_ONLY
+from singleflight import SingleFlight
+from retrieval import ContentRetriever
+from router import ModelRouter
+from compaction import Compactor, load_summary, COMPACTION_ENABLED
+from usage import UsageTracker, QuotaExceeded, seconds_until_tomorrow
+from export import iter_ndjson, gzip_stream
 
 # ------------------------------------------------------------
 # Models and helpers
@@ -17,39 +28,56 @@ class ChatMessage(BaseModel):
     message: str
     session_id: str | None = None
 
-def get_system_prompt():
-    return "You are a helpful AI assistant."
+def get_system_prompt(context: list[dict] | None = None):
+    """Base persona plus only the lesson chunks retrieved for this turn."""
+    prompt = "You are a helpful AI assistant."
+    if not context:
+        return prompt
+    material = "\n\n".join(f"[{chunk['title']}]\n{chunk['text']}" for chunk in context)
+    return f"{prompt} Use the AISE course material below when it is relevant.\n\n{material}"
 
 def chaos_log(msg: str):
     print(msg)
 
-_request_count = 0
 _last_error = ""
-_user_sessions = {}
+_usage = UsageTracker()
+_response_cache = ResponseCache()
+_inflight = SingleFlight()
+_retriever = ContentRetriever()
+_governor = LLMGovernor()
+_backend = get_backend(LLM_BACKEND, observer=_governor.observe)
 
-SECRET_KEY = os.getenv("SECRET_KEY", "secret")  # for JWT decoding
 
-# ------------------------------------------------------------
-# Initialize DB
-# ------------------------------------------------------------
-init_db()
+async def send_to_llm(messages, priority=PRIORITY_INTERACTIVE, model=None):
+    """One completion on the configured backend, run through the governor.
+    Returns (result_json, timing)."""
+    return await _governor.submit(lambda: _backend.complete(messages, model), priority)
 
-app = FastAPI(title="Chat Service")
 
-# ============================================================
-# CHAT ENDPOINT - The main event
-# ============================================================
+# Late-bound so the router always goes through the current send_to_llm/_governor
+_router = ModelRouter(
+    lambda messages, model, priority: send_to_llm(messages, priority, model),
+    default_model=_backend.model,
+    is_busy=lambda: _governor.queued > 0,
+)
+
+
+async def summarize_turns(messages) -> str:
+    result, _ = await send_to_llm(messages, PRIORITY_BACKGROUND)
+    return result["choices"][0]["message"]["content"]
 
-@app.post("/chat")
-async def chat(message: ChatMessage, authorization: str = Header(None)):
-    """Chat endpoint. Does authentication, history, API calls, and caching all in one function.
-    Single Responsibility Principle? Never heard of it."""
-    global _request_count, _last_error
 
-    _request_count += 1
-    chaos_log(f"Chat request #{_request_count}. The monolith grows stronger.")
+# Idle = nothing waiting and at least half the LLM slots free for real users
+_compactor = Compactor(
+    summarize_turns,
+    is_idle=lambda: _governor.queued == 0 and _governor.active <= _governor.max_concurrency // 2,
+)
 
-    # ---- Auth check (copy-pasted, not middleware) ----
+SECRET_KEY = os.getenv("SECRET_KEY", "secret")  # for JWT decoding
+
+
+def authenticate(authorization: str | None) -> dict:
+    """Decode the bearer token and return its payload (user_id, username, role)."""
     if not authorization:
         raise HTTPException(status_code=401, detail="Authorization header required")
     try:
@@ -60,25 +88,60 @@ async def chat(message: ChatMessage, authorization: str = Header(None)):
         payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
         if payload.get("exp", 0) < time.time():
             raise HTTPException(status_code=401, detail="Token expired")
-        user_id = payload.get("user_id")
-        username = payload.get("username")
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
     except Exception:
         raise HTTPException(status_code=401, detail="Authentication failed")
 
-    if not user_id:
+    if not payload.get("user_id"):
         raise HTTPException(status_code=401, detail="Invalid token payload")
+    return payload
+
 
-    # ---- Track in global state ----
-    if user_id in _user_sessions:
-        _user_sessions[user_id]["request_count"] = _user_sessions[user_id].get("request_count", 0) + 1
+# ------------------------------------------------------------
+# Initialize DB
+# ------------------------------------------------------------
+init_db()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await _usage.start()
+    if COMPACTION_ENABLED:
+        await _compactor.start()
+    yield
+    await _compactor.stop()
+    await _usage.stop()
+
+app = FastAPI(title="Chat Service", lifespan=lifespan)
+
+# ============================================================
+# CHAT ENDPOINT - The main event
+# ============================================================
 
-    # ---- Check for Groq API key ----
-    if not GROQ_API_KEY:
+@app.post("/chat")
+async def chat(message: ChatMessage, authorization: str = Header(None)):
+    """Chat endpoint. Does authentication, history, API calls, and caching all in one function.
+    Single Responsibility Principle? Never heard of it."""
+    global _last_error
+
+    payload = authenticate(authorization)
+    user_id = payload["user_id"]
+    username = payload.get("username")
+    chaos_log(f"Chat request from {username}. The monolith grows stronger.")
+
+    # ---- Quota check (materialized counters, before any LLM work) ----
+    try:
+        _usage.check_quota(user_id)
+    except QuotaExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e),
+                            headers={"Retry-After": str(seconds_until_tomorrow())})
+
+    # ---- Check the LLM backend is usable (Groq needs an API key, the fake does not) ----
+    if not _backend.configured:
         raise HTTPException(
             status_code=500,
-            detail="GROQ_API_KEY not configured. Set it as an environment variable.",
+            detail="GROQ_API_KEY not configured. Set it as an environment variable or use LLM_BACKEND=fake.",
         )
 
     # ---- Build session and history ----
@@ -87,15 +150,23 @@ async def chat(message: ChatMessage, authorization: str = Header(None)):
     # Load chat history from DB (raw SQL in the route handler, naturally)
     conn = get_connection()
     c = conn.cursor()
+    # Older turns live in the rolling summary; only load what it doesn't cover
+    summary, covered_rowid = load_summary(conn, user_id, session_id)
     c.execute(
-        "SELECT message, response FROM chat_history WHERE user_id = ? AND session_id = ? ORDER BY timestamp DESC LIMIT ?",
-        (user_id, session_id, 10),
+        "SELECT message, response FROM chat_history WHERE user_id = ? AND session_id = ? AND rowid > ? "
+        "ORDER BY timestamp DESC, rowid DESC LIMIT ?",
+        (user_id, session_id, covered_rowid, 10),
     )
     history_rows = c.fetchall()
     conn.close()
 
-    # Build messages array for Groq
-    messages = [{"role": "system", "content": get_system_prompt()}]
+    # Ground the answer in the few lesson chunks relevant to this message
+    context = await _retriever.context_for(message.message)
+
+    # Build messages array for the LLM
+    messages = [{"role": "system", "content": get_system_prompt(context)}]
+    if summary:
+        messages.append({"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"})
 
     # Add history in reverse (we fetched DESC, need ASC)
     for row in reversed(history_rows):
@@ -104,17 +175,46 @@ async def chat(message: ChatMessage, authorization: str = Header(None)):
 
     messages.append({"role": "user", "content": message.message})
 
-    # ---- Call Groq API ----
-    chaos_log(f"Calling Groq API. Fingers crossed. Message from {username}: '{message.message[:50]}...'")
+    # ---- Response cache (repeated FAQ-style questions) ----
+    cacheable = CACHE_ENABLED and (not (history_rows or summary) or not CACHE_FIRST_TURN_ONLY)
+    fingerprint = prompt_fingerprint(messages)
+    cached = _response_cache.get(fingerprint) if cacheable else None
+    coalesced = False
+    timing = {"queue_ms": 0.0, "backoff_ms": 0.0, "llm_ms": 0.0, "attempts": 0, "model": None, "hedged": False}
 
-    try:
-        result = await send_to_groq(messages)
-        assistant_message = result["choices"][0]["message"]["content"]
-        tokens_used = result.get("usage", {}).get("total_tokens", 0)
-    except Exception as e:
-        _last_error = str(e)
-        chaos_log(f"Something went wrong with Groq: {str(e)}")
-        raise HTTPException(status_code=500, detail="Chat processing failed")
+    if cached is not None:
+        chaos_log(f"Cache hit for {username}. Groq gets a day off.")
+        assistant_message = cached["response"]
+        tokens_used = 0
+    else:
+        # ---- Call the LLM backend ----
+        chaos_log(f"Calling {_backend.name}. Fingers crossed. Message from {username}: '{message.message[:50]}...'")
+
+        try:
+            # Identical prompts already in flight share one upstream completion
+            (result, timing), coalesced = await _inflight.do(fingerprint, lambda: _router.complete(messages))
+            assistant_message = result["choices"][0]["message"]["content"]
+            # Only the caller that actually hit the LLM is charged the tokens
+            tokens_used = 0 if coalesced else result.get("usage", {}).get("total_tokens", 0)
+        except GovernorOverloaded as e:
+            _last_error = str(e)
+            raise HTTPException(status_code=503, detail="Chat is overloaded, try again shortly",
+                                headers={"Retry-After": "5"})
+        except UpstreamError as e:
+            _last_error = str(e)
+            chaos_log(f"Groq said no: {str(e)}")
+            if e.status_code == 429:
+                headers = {"Retry-After": str(int(e.retry_after or 1))}
+                raise HTTPException(status_code=429, detail="LLM rate limit reached, try again shortly",
+                                    headers=headers)
+            raise HTTPException(status_code=502, detail="LLM provider error")
+        except Exception as e:
+            _last_error = str(e)
+            chaos_log(f"Something went wrong with Groq: {str(e)}")
+            raise HTTPException(status_code=500, detail="Chat processing failed")
+
+        if cacheable and not coalesced:
+            _response_cache.set(fingerprint, {"response": assistant_message, "tokens_used": tokens_used})
 
     # ---- Save to DB (more inline SQL) ----
     chat_id = str(uuid.uuid4())
@@ -130,11 +230,75 @@ async def chat(message: ChatMessage, authorization: str = Header(None)):
         pass
     conn.close()
 
+    # Long sessions get folded into a summary later, off the request path
+    _compactor.enqueue(user_id, session_id)
+    _usage.record(user_id, tokens_used)
+
     return {
         "response": assistant_message,
         "session_id": session_id,
         "chat_id": chat_id,
         "tokens_used": tokens_used,
+        "cached": cached is not None,
+        "coalesced": coalesced,
+        "timing": timing,
+        "sources": list({chunk["doc_id"]: chunk["title"] for chunk in context}.values()),
+    }
+
+# ============================================================
+# USAGE ENDPOINT
+# ============================================================
+
+@app.get("/usage")
+async def usage(authorization: str = Header(None)):
+    """Today's and all-time request/token counters for the caller."""
+    user_id = authenticate(authorization)["user_id"]
+    return _usage.get(user_id)
+
+# ============================================================
+# ADMIN EXPORT ENDPOINT
+# ============================================================
+
+@app.get("/admin/export")
+async def export_history(
+    authorization: str = Header(None),
+    format: str = Query("ndjson", pattern="^(ndjson|ndjson.gz)$"),
+    since: str | None = None,
+    until: str | None = None,
+    user_id: str | None = None,
+    session_id: str | None = None,
+    after: int = Query(0, ge=0, description="Resume after this cursor"),
+):
+    """Stream chat_history as NDJSON (optionally gzip-compressed) for evaluation
+    and red-teaming review. Memory use is constant regardless of row count."""
+    if authenticate(authorization).get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin role required")
+
+    chunks = iter_ndjson(since=since, until=until, user_id=user_id, session_id=session_id, after=after)
+    if format == "ndjson.gz":
+        return StreamingResponse(
+            gzip_stream(chunks),
+            media_type="application/gzip",
+            headers={"Content-Disposition": 'attachment; filename="chat_history.ndjson.gz"'},
+        )
+    return StreamingResponse(chunks, media_type="application/x-ndjson")
+
+# ============================================================
+# METRICS ENDPOINT
+# ============================================================
+
+@app.get("/metrics")
+async def metrics():
+    """Operational counters for the chat pipeline."""
+    return {
+        "cache": _response_cache.stats(),
+        "singleflight": _inflight.stats(),
+        "backend": {"name": _backend.name, "model": _backend.model},
+        "governor": _governor.stats(),
+        "router": _router.stats(),
+        "retrieval": _retriever.stats(),
+        "compaction": _compactor.stats(),
+        "usage": _usage.stats(),
     }
 
 # ============================================================
@@ -0,0 +1,235 @@
+import asyncio
+import hashlib
+import math
+import os
+import re
+import time
+from collections import Counter, defaultdict
+
+import httpx
+
+from backends import estimate_tokens
+
+CONTENT_SERVICE_URL = os.getenv("CONTENT_SERVICE_URL", "http://localhost:8003")
+CONTENT_REFRESH_SECONDS = float(os.getenv("CONTENT_REFRESH_SECONDS", 60))
+CONTENT_FETCH_LIMIT = int(os.getenv("CONTENT_FETCH_LIMIT", 200))
+CHUNK_WORDS = int(os.getenv("RAG_CHUNK_WORDS", 120))
+CHUNK_OVERLAP_WORDS = int(os.getenv("RAG_CHUNK_OVERLAP_WORDS", 20))
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", 3))
+RAG_TOKEN_BUDGET = int(os.getenv("RAG_TOKEN_BUDGET", 600))
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i in is it of on or that the this to "
+    "was what when where which who why will with you your".split()
+)
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def tokenize(text: str) -> list[str]:
+    return [t for t in _TOKEN.findall(text.lower()) if t not in _STOPWORDS]
+
+
+def chunk_text(body: str, size: int = CHUNK_WORDS, overlap: int = CHUNK_OVERLAP_WORDS) -> list[str]:
+    """Split a lesson body into overlapping word windows."""
+    words = body.split()
+    if not words:
+        return []
+    step = max(1, size - overlap)
+    chunks = []
+    for start in range(0, len(words), step):
+        chunks.append(" ".join(words[start:start + size]))
+        if start + size >= len(words):
+            break
+    return chunks
+
+
+class ChunkIndex:
+    """BM25 inverted index over lesson chunks. Documents are added and removed
+    individually so a refresh only touches lessons that actually changed."""
+
+    def __init__(self):
+        self._chunks = {}  # chunk_id -> {"doc_id", "title", "text", "length"}
+        self._postings = defaultdict(dict)  # term -> {chunk_id: tf}
+        self._doc_chunks = {}  # doc_id -> [chunk_id]
+        self._doc_hashes = {}  # doc_id -> body hash
+        self._total_length = 0
+
+    def __len__(self):
+        return len(self._chunks)
+
+    @property
+    def doc_count(self) -> int:
+        return len(self._doc_chunks)
+
+    def doc_hash(self, doc_id: str) -> str | None:
+        return self._doc_hashes.get(doc_id)
+
+    def doc_ids(self) -> set:
+        return set(self._doc_chunks)
+
+    def add_document(self, doc_id: str, title: str, body: str, body_hash: str):
+        self.remove_document(doc_id)
+        chunk_ids = []
+        for i, text in enumerate(chunk_text(body)):
+            chunk_id = f"{doc_id}:{i}"
+            # The title is indexed with every chunk so lesson names always match
+            terms = Counter(tokenize(f"{title} {text}"))
+            length = sum(terms.values())
+            self._chunks[chunk_id] = {"doc_id": doc_id, "title": title, "text": text, "length": length}
+            for term, tf in terms.items():
+                self._postings[term][chunk_id] = tf
+            self._total_length += length
+            chunk_ids.append(chunk_id)
+        self._doc_chunks[doc_id] = chunk_ids
+        self._doc_hashes[doc_id] = body_hash
+
+    def remove_document(self, doc_id: str):
+        for chunk_id in self._doc_chunks.pop(doc_id, []):
+            chunk = self._chunks.pop(chunk_id)
+            self._total_length -= chunk["length"]
+            for term in set(tokenize(f"{chunk['title']} {chunk['text']}")):
+                postings = self._postings.get(term)
+                if postings is not None:
+                    postings.pop(chunk_id, None)
+                    if not postings:
+                        del self._postings[term]
+        self._doc_hashes.pop(doc_id, None)
+
+    def search(self, query: str, k: int = RAG_TOP_K) -> list[dict]:
+        n = len(self._chunks)
+        if not n:
+            return []
+        avg_length = self._total_length / n
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for chunk_id, tf in postings.items():
+                length = self._chunks[chunk_id]["length"]
+                norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length)
+                scores[chunk_id] += idf * tf * (BM25_K1 + 1) / norm
+        best = sorted(scores.items(), key=lambda kv: kv[1], reverse=True)[:k]
+        return [dict(self._chunks[chunk_id], score=round(score, 4)) for chunk_id, score in best]
+
+
+def select_context(chunks: list[dict], budget: int = RAG_TOKEN_BUDGET) -> list[dict]:
+    """Keep the best-ranked chunks that fit inside the token budget."""
+    selected, used = [], 0
+    for chunk in chunks:
+        cost = estimate_tokens(chunk["text"]) + estimate_tokens(chunk["title"])
+        if used + cost > budget:
+            continue
+        selected.append(chunk)
+        used += cost
+    return selected
+
+
+class ContentRetriever:
+    """Keeps a local chunk index of lesson content in sync with the content
+    service. Refreshes are incremental (only new or changed lessons are
+    re-chunked) and happen in the background once the index is warm, so a
+    slow content service never blocks a chat turn.
+
+    Once the content service has reported a content version, refreshes ask
+    for `since=<version>` and get back only what changed; without one, the
+    full snapshot is revalidated with its ETag, so an unchanged corpus costs
+    a 304."""
+
+    def __init__(self, base_url: str = CONTENT_SERVICE_URL, refresh_seconds: float = CONTENT_REFRESH_SECONDS,
+                 transport: httpx.AsyncBaseTransport | None = None):
+        self.base_url = base_url
+        self.refresh_seconds = refresh_seconds
+        self.index = ChunkIndex()
+        self._transport = transport
+        self._last_refresh = 0.0
+        self._refresh_task = None
+        self._etag = None
+        self._version = None
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.not_modified = 0
+        self.delta_refreshes = 0
+
+    async def _fetch(self) -> dict | None:
+        """The /content/internal payload, or None if nothing changed (304)."""
+        params = {"limit": CONTENT_FETCH_LIMIT}
+        headers = {}
+        if self._version is not None:
+            params["since"] = self._version
+        elif self._etag:
+            headers["If-None-Match"] = self._etag
+        async with httpx.AsyncClient(timeout=5.0, transport=self._transport) as client:
+            response = await client.get(f"{self.base_url}/content/internal", params=params, headers=headers)
+            if response.status_code == 304:
+                return None
+            response.raise_for_status()
+            payload = response.json()
+            self._etag = response.headers.get("etag")
+            return payload
+
+    def _index_item(self, item: dict) -> bool:
+        doc_id, body = item.get("id"), item.get("body") or ""
+        body_hash = hashlib.sha1(f"{item.get('title')}\0{body}".encode()).hexdigest()
+        if self.index.doc_hash(doc_id) == body_hash:
+            return False
+        self.index.add_document(doc_id, item.get("title") or "", body, body_hash)
+        return True
+
+    async def refresh(self) -> int:
+        """Sync the index with the content service. Returns the number of lessons (re)indexed."""
+        try:
+            payload = await self._fetch()
+        except (httpx.HTTPError, ValueError) as e:
+            self.refresh_errors += 1
+            print(f"[chat-service] Content refresh failed, keeping current index: {e}")
+            return 0
+        finally:
+            self._last_refresh = time.monotonic()
+
+        self.refreshes += 1
+        if payload is None:
+            self.not_modified += 1
+            return 0
+
+        items = [item for item in payload.get("content", []) if item.get("id")]
+        changed = sum(self._index_item(item) for item in items)
+        if payload.get("delta"):
+            # Only the changes: everything not mentioned is still current
+            for doc_id in payload.get("deleted", []):
+                self.index.remove_document(doc_id)
+            self.delta_refreshes += 1
+        else:
+            for doc_id in self.index.doc_ids() - {item["id"] for item in items}:
+                self.index.remove_document(doc_id)
+        self._version = payload.get("version")
+        return changed
+
+    async def ensure_fresh(self):
+        cold = self.refreshes == 0 and self.refresh_errors == 0
+        if cold or time.monotonic() - self._last_refresh > self.refresh_seconds:
+            if self._refresh_task is None or self._refresh_task.done():
+                self._refresh_task = asyncio.ensure_future(self.refresh())
+            if cold:
+                # Cold start: wait (once, shared by concurrent turns) so the first answer is grounded
+                await asyncio.shield(self._refresh_task)
+
+    async def context_for(self, query: str, k: int = RAG_TOP_K, budget: int = RAG_TOKEN_BUDGET) -> list[dict]:
+        await self.ensure_fresh()
+        return select_context(self.index.search(query, k), budget)
+
+    def stats(self) -> dict:
+        return {
+            "documents": self.index.doc_count,
+            "chunks": len(self.index),
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors,
+            "not_modified": self.not_modified,
+            "delta_refreshes": self.delta_refreshes,
+            "content_version": self._version,
+            "seconds_since_refresh": round(time.monotonic() - self._last_refresh, 1) if self._last_refresh else None,
+        }
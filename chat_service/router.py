@@ -0,0 +1,177 @@
+import asyncio
+import os
+import re
+from collections import deque
+
+from backends import estimate_tokens
+from governor import PRIORITY_INTERACTIVE
+
+ROUTER_FAST_MODEL = os.getenv("ROUTER_FAST_MODEL")  # unset = backend default model
+ROUTER_STRONG_MODEL = os.getenv("ROUTER_STRONG_MODEL")
+ROUTER_LONG_PROMPT_TOKENS = int(os.getenv("ROUTER_LONG_PROMPT_TOKENS", 1500))
+ROUTER_COMPLEX_MESSAGE_CHARS = int(os.getenv("ROUTER_COMPLEX_MESSAGE_CHARS", 400))
+ROUTER_MAX_ERROR_RATE = float(os.getenv("ROUTER_MAX_ERROR_RATE", 0.3))
+ROUTER_EWMA_ALPHA = float(os.getenv("ROUTER_EWMA_ALPHA", 0.2))
+
+HEDGE_ENABLED = os.getenv("ROUTER_HEDGE_ENABLED", "false").lower() == "true"
+HEDGE_PERCENTILE = float(os.getenv("ROUTER_HEDGE_PERCENTILE", 0.95))
+HEDGE_MIN_DELAY_MS = float(os.getenv("ROUTER_HEDGE_MIN_DELAY_MS", 250))
+HEDGE_DEFAULT_DELAY_MS = float(os.getenv("ROUTER_HEDGE_DEFAULT_DELAY_MS", 3000))  # until we have samples
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 200
+
+# Hedges are speculative: let real first attempts go ahead of them in the governor queue
+PRIORITY_HEDGE = PRIORITY_INTERACTIVE + 1
+
+_COMPLEX_HINTS = re.compile(
+    r"```|\b(explain why|step by step|compare|contrast|trade-?offs?|derive|prove|analy[sz]e|design)\b",
+    re.IGNORECASE,
+)
+
+
+class ModelStats:
+    """EWMA latency and error rate for one model, plus a sliding window of
+    recent latencies for percentile-based hedge delays."""
+
+    def __init__(self, alpha: float = ROUTER_EWMA_ALPHA, window: int = LATENCY_WINDOW):
+        self.alpha = alpha
+        self.ewma_latency_ms = None
+        self.error_rate = 0.0
+        self.requests = 0
+        self.errors = 0
+        self._latencies = deque(maxlen=window)
+
+    def record_success(self, latency_ms: float):
+        self.requests += 1
+        self._latencies.append(latency_ms)
+        if self.ewma_latency_ms is None:
+            self.ewma_latency_ms = latency_ms
+        else:
+            self.ewma_latency_ms = self.alpha * latency_ms + (1 - self.alpha) * self.ewma_latency_ms
+        self.error_rate = (1 - self.alpha) * self.error_rate
+
+    def record_error(self):
+        self.requests += 1
+        self.errors += 1
+        self.error_rate = self.alpha + (1 - self.alpha) * self.error_rate
+
+    def percentile(self, pct: float) -> float | None:
+        if len(self._latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+    def snapshot(self) -> dict:
+        p95 = self.percentile(0.95)
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "ewma_latency_ms": round(self.ewma_latency_ms, 2) if self.ewma_latency_ms is not None else None,
+            "error_rate": round(self.error_rate, 4),
+            "p95_ms": round(p95, 2) if p95 is not None else None,
+        }
+
+
+class ModelRouter:
+    """Picks a model tier per turn and, optionally, hedges slow calls.
+
+    `send(messages, model, priority)` must return (result, timing) — in the
+    chat service that is the governed backend call, so hedges respect the
+    same concurrency limit and rate-limit backoff as everything else."""
+
+    def __init__(self, send, default_model: str, fast_model: str | None = ROUTER_FAST_MODEL,
+                 strong_model: str | None = ROUTER_STRONG_MODEL, hedge_enabled: bool = HEDGE_ENABLED,
+                 is_busy=lambda: False):
+        self._send = send
+        self.fast_model = fast_model or default_model
+        self.strong_model = strong_model or default_model
+        self.hedge_enabled = hedge_enabled
+        self._is_busy = is_busy  # no spare capacity -> don't add hedge load
+        self.models = {}
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def _stats(self, model: str) -> ModelStats:
+        if model not in self.models:
+            self.models[model] = ModelStats()
+        return self.models[model]
+
+    def choose_model(self, messages) -> str:
+        """Short, simple turns go to the fast tier; long or complex ones to the
+        strong tier. A tier that is failing or much slower is avoided."""
+        last = messages[-1]["content"] if messages else ""
+        complex_turn = (
+            sum(estimate_tokens(m["content"]) for m in messages) > ROUTER_LONG_PROMPT_TOKENS
+            or len(last) > ROUTER_COMPLEX_MESSAGE_CHARS
+            or bool(_COMPLEX_HINTS.search(last))
+        )
+        preferred, other = (
+            (self.strong_model, self.fast_model) if complex_turn else (self.fast_model, self.strong_model)
+        )
+        if preferred == other:
+            return preferred
+
+        pref, alt = self._stats(preferred), self._stats(other)
+        if pref.error_rate > ROUTER_MAX_ERROR_RATE and alt.error_rate < pref.error_rate:
+            return other
+        if not complex_turn and pref.ewma_latency_ms and alt.ewma_latency_ms \
+                and pref.ewma_latency_ms > 1.5 * alt.ewma_latency_ms:
+            return other  # the "fast" tier is currently the slow one
+        return preferred
+
+    def hedge_delay(self, model: str) -> float:
+        """Seconds to wait on the first attempt before sending a duplicate."""
+        p = self._stats(model).percentile(HEDGE_PERCENTILE)
+        delay_ms = HEDGE_DEFAULT_DELAY_MS if p is None else max(p, HEDGE_MIN_DELAY_MS)
+        return delay_ms / 1000
+
+    async def _attempt(self, messages, model: str, priority: int):
+        stats = self._stats(model)
+        try:
+            result, timing = await self._send(messages, model, priority)
+        except asyncio.CancelledError:
+            raise  # a cancelled hedge loser says nothing about the model
+        except Exception:
+            stats.record_error()
+            raise
+        stats.record_success(timing.get("llm_ms", 0.0))
+        return result, timing
+
+    async def complete(self, messages, priority: int = PRIORITY_INTERACTIVE):
+        """Returns (result, timing); timing gains `model` and `hedged`."""
+        model = self.choose_model(messages)
+        primary = asyncio.ensure_future(self._attempt(messages, model, priority))
+        tasks = {primary}
+        try:
+            if self.hedge_enabled:
+                done, _ = await asyncio.wait(tasks, timeout=self.hedge_delay(model))
+                if not done and not self._is_busy():
+                    self.hedges += 1
+                    tasks.add(asyncio.ensure_future(self._attempt(messages, model, PRIORITY_HEDGE)))
+
+            error = None
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        result, timing = task.result()
+                        if task is not primary:
+                            self.hedge_wins += 1
+                        return result, dict(timing, model=model, hedged=len(tasks) > 1)
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()  # the loser (or everything, if our caller went away)
+
+    def stats(self) -> dict:
+        return {
+            "fast_model": self.fast_model,
+            "strong_model": self.strong_model,
+            "hedging": self.hedge_enabled,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "models": {name: s.snapshot() for name, s in self.models.items()},
+        }
@@ -0,0 +1,38 @@
+import asyncio
+
+
+class SingleFlight:
+    """Coalesces identical concurrent calls: the first caller for a key starts
+    the work, later callers for the same key await that same result instead
+    of starting their own. The key is forgotten once the work finishes, so
+    this only de-duplicates calls that overlap in time."""
+
+    def __init__(self):
+        self._inflight = {}  # key -> asyncio.Task
+        self.leaders = 0
+        self.followers = 0
+
+    async def do(self, key: str, fn):
+        """Run `fn()` (a coroutine factory) once per in-flight key.
+        Returns (result, shared) where shared is True for callers that
+        piggybacked on another caller's work."""
+        task = self._inflight.get(key)
+        shared = task is not None
+        if shared:
+            self.followers += 1
+        else:
+            self.leaders += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _t: self._inflight.pop(key, None))
+        # shield: one caller disconnecting must not cancel the work for everyone else
+        return await asyncio.shield(task), shared
+
+    def stats(self) -> dict:
+        calls = self.leaders + self.followers
+        return {
+            "in_flight": len(self._inflight),
+            "upstream_calls": self.leaders,
+            "coalesced_calls": self.followers,
+            "coalescing_ratio": round(self.followers / calls, 4) if calls else 0.0,
+        }
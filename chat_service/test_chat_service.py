@@ -0,0 +1,687 @@
+"""
+Tests for the chat service.
+Groq is never called: send_to_llm is replaced with a fake that counts calls,
+and HTTP-level tests run GroqBackend against a local fake transport.
+"""
+
+import asyncio
+import gzip
+import json
+import os
+import time
+import tempfile
+
+import httpx
+import jwt
+import pytest
+from fastapi.testclient import TestClient
+
+# Point the DBs at temp files so tests don't touch real data
+_test_db = tempfile.NamedTemporaryFile(suffix=".db", delete=False)
+TEST_DB_PATH = _test_db.name
+_test_db.close()
+
+os.environ["CHAT_DB_PATH"] = TEST_DB_PATH
+os.environ.setdefault("GROQ_API_KEY", "test-key")
+
+import main  # noqa: E402 (must come after env override)
+from cache import ResponseCache, prompt_fingerprint  # noqa: E402
+from singleflight import SingleFlight  # noqa: E402
+from groq_client import GroqBackend  # noqa: E402
+from backends import FakeBackend, parse_distribution, get_backend  # noqa: E402
+from governor import LLMGovernor, UpstreamError, parse_duration, PRIORITY_BACKGROUND  # noqa: E402
+from retrieval import ContentRetriever, ChunkIndex, chunk_text, select_context  # noqa: E402
+from router import ModelRouter, ModelStats  # noqa: E402
+from compaction import Compactor  # noqa: E402
+from usage import UsageTracker  # noqa: E402
+from export import iter_ndjson  # noqa: E402
+from db import get_connection  # noqa: E402
+
+client = TestClient(main.app)
+_real_send_to_llm = main.send_to_llm
+
+
+# ── Helpers ──────────────────────────────────────────────────
+
+def _auth_header(user_id: str = "test-user", role: str = "fellow") -> dict:
+    token = jwt.encode(
+        {"user_id": user_id, "username": user_id, "role": role, "exp": time.time() + 60},
+        main.SECRET_KEY,
+        algorithm="HS256",
+    )
+    return {"Authorization": f"Bearer {token}"}
+
+
+class FakeContentService:
+    """Stands in for GET /content/internal."""
+
+    def __init__(self, items: list | None = None):
+        self.items = items or []
+        self.requests = 0
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        return httpx.Response(200, json={"content": self.items})
+
+
+class FakeGroq:
+    def __init__(self, delay: float = 0.0):
+        self.calls = 0
+        self.delay = delay
+        self.last_messages = None
+
+    async def __call__(self, messages, priority=0, model=None):
+        self.calls += 1
+        self.last_messages = messages
+        await asyncio.sleep(self.delay)
+        result = {
+            "choices": [{"message": {"content": f"answer #{self.calls}"}}],
+            "usage": {"total_tokens": 42},
+        }
+        return result, {"queue_ms": 0.0, "backoff_ms": 0.0, "llm_ms": self.delay * 1000, "attempts": 1}
+
+
+# ── Fixtures ─────────────────────────────────────────────────
+
+@pytest.fixture(autouse=True)
+def fake_groq(monkeypatch):
+    """Fresh history, cache and fake upstream for every test."""
+    conn = get_connection()
+    conn.execute("DELETE FROM chat_history")
+    conn.execute("DELETE FROM chat_summaries")
+    conn.execute("DELETE FROM usage_totals")
+    conn.execute("DELETE FROM usage_daily")
+    conn.commit()
+    conn.close()
+    monkeypatch.setattr(main, "_response_cache", ResponseCache(db_path=None))
+    monkeypatch.setattr(main, "_inflight", SingleFlight())
+    monkeypatch.setattr(main, "_usage", UsageTracker(request_quota=0, token_quota=0))
+    monkeypatch.setattr(main, "_retriever", ContentRetriever(transport=httpx.MockTransport(FakeContentService())))
+    fake = FakeGroq()
+    monkeypatch.setattr(main, "send_to_llm", fake)
+    yield fake
+
+
+# ── Response cache ───────────────────────────────────────────
+
+class TestResponseCache:
+    def test_repeated_first_turn_question_is_cached(self, fake_groq):
+        first = client.post("/chat", json={"message": "What topics does AISE cover?"}, headers=_auth_header())
+        second = client.post("/chat", json={"message": "  what topics does   AISE cover?"}, headers=_auth_header())
+        assert first.status_code == 200 and second.status_code == 200
+        assert first.json()["cached"] is False
+        assert second.json()["cached"] is True
+        assert second.json()["response"] == first.json()["response"]
+        assert second.json()["tokens_used"] == 0
+        assert first.json()["chat_id"] != second.json()["chat_id"]
+        assert fake_groq.calls == 1
+
+        stats = client.get("/metrics").json()["cache"]
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+
+    def test_follow_up_turns_are_not_cached(self, fake_groq):
+        first = client.post("/chat", json={"message": "hello"}, headers=_auth_header())
+        session_id = first.json()["session_id"]
+        client.post("/chat", json={"message": "hello", "session_id": session_id}, headers=_auth_header())
+        client.post("/chat", json={"message": "hello", "session_id": session_id}, headers=_auth_header())
+        assert fake_groq.calls == 3
+
+    def test_ttl_expiry(self):
+        cache = ResponseCache(ttl_seconds=0.01, db_path=None)
+        cache.set("k", {"response": "r"})
+        time.sleep(0.02)
+        assert cache.get("k") is None
+
+    def test_lru_eviction(self):
+        cache = ResponseCache(max_entries=2, db_path=None)
+        cache.set("a", {"response": "1"})
+        cache.set("b", {"response": "2"})
+        cache.get("a")
+        cache.set("c", {"response": "3"})
+        assert cache.get("b") is None
+        assert cache.get("a") is not None
+        assert cache.stats()["evictions"] == 1
+
+    def test_sqlite_backing_survives_restart(self, tmp_path):
+        path = str(tmp_path / "cache.db")
+        ResponseCache(db_path=path).set("k", {"response": "persisted"})
+        assert ResponseCache(db_path=path).get("k") == {"response": "persisted"}
+
+    def test_fingerprint_covers_system_prompt(self):
+        a = [{"role": "system", "content": "A"}, {"role": "user", "content": "hi"}]
+        b = [{"role": "system", "content": "B"}, {"role": "user", "content": "hi"}]
+        assert prompt_fingerprint(a) != prompt_fingerprint(b)
+
+
+# ── Single-flight coalescing ─────────────────────────────────
+
+class TestSingleFlight:
+    def test_identical_concurrent_prompts_share_one_call(self, fake_groq):
+        fake_groq.delay = 0.05
+
+        async def burst():
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
+                return await asyncio.gather(*[
+                    ac.post("/chat", json={"message": "ask the bot X"}, headers=_auth_header(f"user-{i}"))
+                    for i in range(5)
+                ])
+
+        responses = asyncio.run(burst())
+        bodies = [r.json() for r in responses]
+        assert all(r.status_code == 200 for r in responses)
+        assert fake_groq.calls == 1
+        assert len({b["chat_id"] for b in bodies}) == 5
+        assert sum(b["coalesced"] for b in bodies) == 4
+
+        conn = get_connection()
+        rows = conn.execute("SELECT COUNT(*) FROM chat_history").fetchone()[0]
+        conn.close()
+        assert rows == 5
+
+        stats = client.get("/metrics").json()["singleflight"]
+        assert stats["upstream_calls"] == 1
+        assert stats["coalescing_ratio"] == 0.8
+
+    def test_errors_propagate_to_all_waiters(self):
+        flight = SingleFlight()
+
+        async def boom():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("upstream down")
+
+        async def run():
+            return await asyncio.gather(flight.do("k", boom), flight.do("k", boom), return_exceptions=True)
+
+        results = asyncio.run(run())
+        assert all(isinstance(r, RuntimeError) for r in results)
+        assert flight.stats()["in_flight"] == 0
+
+
+# ── Governor ─────────────────────────────────────────────────
+
+def _completion(content: str = "ok") -> dict:
+    return {"choices": [{"message": {"content": content}}], "usage": {"total_tokens": 7}}
+
+
+class FakeGroqServer:
+    """Local stand-in for the Groq HTTP API: answers 429 `fail_times` times, then 200."""
+
+    def __init__(self, fail_times: int, retry_after: str = "0.05"):
+        self.fail_times = fail_times
+        self.retry_after = retry_after
+        self.requests = 0
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        if self.requests <= self.fail_times:
+            return httpx.Response(429, headers={"retry-after": self.retry_after}, json={"error": "rate limited"})
+        return httpx.Response(200, headers={
+            "x-ratelimit-remaining-requests": "100",
+            "x-ratelimit-reset-requests": "1m0s",
+        }, json=_completion())
+
+
+@pytest.fixture
+def fake_server(monkeypatch):
+    """Wire main.send_to_llm to a real GroqBackend talking to a fake server."""
+    def install(server):
+        governor = LLMGovernor(max_concurrency=2, backoff_base=0.01)
+        backend = GroqBackend(api_key="test-key", observer=governor.observe, transport=httpx.MockTransport(server))
+        monkeypatch.setattr(main, "_governor", governor)
+        monkeypatch.setattr(main, "_backend", backend)
+        monkeypatch.setattr(main, "send_to_llm", _real_send_to_llm)
+        return server
+    return install
+
+
+class TestGovernor:
+    def test_retries_429_honoring_retry_after(self, fake_server):
+        server = fake_server(FakeGroqServer(fail_times=2))
+        result, timing = asyncio.run(main.send_to_llm([{"role": "user", "content": "hi"}]))
+        assert result["choices"][0]["message"]["content"] == "ok"
+        assert server.requests == 3
+        assert timing["attempts"] == 3
+        assert timing["backoff_ms"] >= 100
+        stats = main._governor.stats()
+        assert stats["rate_limited"] == 2
+        assert stats["retries"] == 2
+
+    def test_gives_up_after_max_retries(self, fake_server):
+        fake_server(FakeGroqServer(fail_times=100, retry_after="0.01"))
+        with pytest.raises(UpstreamError) as exc:
+            asyncio.run(main.send_to_llm([{"role": "user", "content": "hi"}]))
+        assert exc.value.status_code == 429
+
+    def test_chat_maps_rate_limit_to_429(self, fake_server):
+        fake_server(FakeGroqServer(fail_times=100, retry_after="0.01"))
+        resp = client.post("/chat", json={"message": "hi"}, headers=_auth_header())
+        assert resp.status_code == 429
+        assert "retry-after" in resp.headers
+
+    def test_concurrency_limit_and_priority(self):
+        governor = LLMGovernor(max_concurrency=1)
+        order = []
+        peak = {"active": 0, "max": 0}
+
+        def job(name):
+            async def run():
+                peak["active"] += 1
+                peak["max"] = max(peak["max"], peak["active"])
+                await asyncio.sleep(0.01)
+                peak["active"] -= 1
+                order.append(name)
+                return name
+            return run
+
+        async def scenario():
+            first = asyncio.create_task(governor.submit(job("first")))
+            await asyncio.sleep(0)
+            background = asyncio.create_task(governor.submit(job("background"), PRIORITY_BACKGROUND))
+            await asyncio.sleep(0)
+            interactive = asyncio.create_task(governor.submit(job("interactive")))
+            return await asyncio.gather(first, background, interactive)
+
+        results = asyncio.run(scenario())
+        assert peak["max"] == 1
+        assert order == ["first", "interactive", "background"]
+        assert results[1][1]["queue_ms"] > 0
+
+    def test_exhausted_quota_pauses_sends(self):
+        governor = LLMGovernor()
+        governor.observe({"x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "2s"})
+        assert governor.stats()["paused_for_s"] > 1.5
+
+    def test_parse_duration(self):
+        assert parse_duration("2m59.56s") == pytest.approx(179.56)
+        assert parse_duration("250ms") == pytest.approx(0.25)
+        assert parse_duration("7.66s") == pytest.approx(7.66)
+
+
+# ── Retrieval-augmented context ──────────────────────────────
+
+LESSONS = [
+    {"id": "l1", "title": "Red Teaming", "body": "Jailbreaking and prompt injection are red teaming techniques. " * 5},
+    {"id": "l2", "title": "Building Agents", "body": "Agents use tools, planning and memory to act autonomously. " * 5},
+]
+
+
+class TestRetrieval:
+    def test_chat_injects_only_relevant_chunks(self, fake_groq, monkeypatch):
+        retriever = ContentRetriever(transport=httpx.MockTransport(FakeContentService(LESSONS)))
+        monkeypatch.setattr(main, "_retriever", retriever)
+        resp = client.post("/chat", json={"message": "what is prompt injection?"}, headers=_auth_header())
+        assert resp.status_code == 200
+        system_prompt = fake_groq.last_messages[0]["content"]
+        assert "prompt injection" in system_prompt
+        assert "Agents use tools" not in system_prompt
+        assert resp.json()["sources"] == ["Red Teaming"]
+
+    def test_refresh_is_incremental(self):
+        service = FakeContentService([dict(item) for item in LESSONS])
+        retriever = ContentRetriever(transport=httpx.MockTransport(service))
+        assert asyncio.run(retriever.refresh()) == 2
+        assert asyncio.run(retriever.refresh()) == 0
+
+        service.items[1]["body"] = "Agents now do evaluation loops."
+        service.items.pop(0)
+        assert asyncio.run(retriever.refresh()) == 1
+        assert retriever.index.doc_ids() == {"l2"}
+        assert retriever.index.search("jailbreaking") == []
+
+    def test_refresh_uses_deltas_and_etags(self):
+        requests = []
+
+        def versioned(request: httpx.Request) -> httpx.Response:
+            requests.append(request)
+            if request.url.params.get("since") == "7":
+                return httpx.Response(200, json={"content": [{"id": "l3", "title": "New", "body": "fresh lesson"}],
+                                                 "version": 9, "delta": True, "deleted": ["l1"]})
+            return httpx.Response(200, json={"content": LESSONS, "version": 7}, headers={"ETag": '"v7"'})
+
+        retriever = ContentRetriever(transport=httpx.MockTransport(versioned))
+        assert asyncio.run(retriever.refresh()) == 2
+        assert asyncio.run(retriever.refresh()) == 1
+        assert requests[1].url.params["since"] == "7"
+        assert retriever.index.doc_ids() == {"l2", "l3"}
+        assert retriever.stats()["delta_refreshes"] == 1
+
+        unversioned = ContentRetriever(transport=httpx.MockTransport(
+            lambda request: httpx.Response(304) if request.headers.get("if-none-match") == '"e1"'
+            else httpx.Response(200, json={"content": LESSONS}, headers={"ETag": '"e1"'})
+        ))
+        assert asyncio.run(unversioned.refresh()) == 2
+        assert asyncio.run(unversioned.refresh()) == 0
+        assert unversioned.stats()["not_modified"] == 1
+        assert unversioned.index.doc_ids() == {"l1", "l2"}
+
+    def test_context_respects_token_budget(self):
+        index = ChunkIndex()
+        index.add_document("big", "Safety", "alignment " * 1000, "h")
+        chunks = index.search("alignment", k=10)
+        assert len(chunks) > 1
+        selected = select_context(chunks, budget=400)
+        assert 0 < len(selected) < len(chunks)
+
+    def test_chunks_overlap(self):
+        words = [f"w{i}" for i in range(250)]
+        chunks = chunk_text(" ".join(words), size=100, overlap=20)
+        assert len(chunks) == 3
+        assert chunks[1].split()[0] == "w80"
+        assert chunks[-1].split()[-1] == "w249"
+
+
+# ── Pluggable backends ───────────────────────────────────────
+
+class TestFakeBackend:
+    def test_is_deterministic_for_a_seed(self):
+        messages = [{"role": "user", "content": "What is alignment?"}]
+
+        def run():
+            backend = FakeBackend(latency_ms="uniform:1,3", completion_tokens="uniform:5,50", seed=7)
+            return [asyncio.run(backend.complete(messages)) for _ in range(3)]
+
+        assert run() == run()
+
+    def test_token_counts_follow_config(self):
+        backend = FakeBackend(latency_ms="0", completion_tokens="fixed:12")
+        result = asyncio.run(backend.complete([{"role": "user", "content": "x" * 40}]))
+        assert result["usage"]["completion_tokens"] == 12
+        assert result["usage"]["prompt_tokens"] == 10
+        assert len(result["choices"][0]["message"]["content"].split()) == 12
+
+    def test_streaming_yields_the_same_text(self):
+        messages = [{"role": "user", "content": "stream me"}]
+        full = asyncio.run(FakeBackend(latency_ms="0", seed=1).complete(messages))
+
+        async def collect():
+            return "".join([delta async for delta in FakeBackend(latency_ms="0", seed=1).stream(messages)])
+
+        assert asyncio.run(collect()) == full["choices"][0]["message"]["content"]
+
+    def test_error_injection_goes_through_governor_retries(self):
+        backend = FakeBackend(latency_ms="0", error_rate=1.0, error_status=429, retry_after="0.01")
+        governor = LLMGovernor(max_retries=2)
+        with pytest.raises(UpstreamError):
+            asyncio.run(governor.submit(lambda: backend.complete([{"role": "user", "content": "hi"}])))
+        assert backend.calls == 3
+
+    def test_chat_runs_without_groq_key(self, monkeypatch):
+        backend = FakeBackend(latency_ms="fixed:1")
+        monkeypatch.setattr(main, "_backend", backend)
+        monkeypatch.setattr(main, "send_to_llm", _real_send_to_llm)
+        monkeypatch.setattr(main, "_router", ModelRouter(
+            lambda messages, model, priority: main.send_to_llm(messages, priority, model),
+            default_model=backend.model,
+        ))
+        resp = client.post("/chat", json={"message": "offline?"}, headers=_auth_header())
+        assert resp.status_code == 200
+        assert resp.json()["response"].startswith("[fake-llm]")
+        assert client.get("/metrics").json()["backend"]["name"] == "fake"
+
+    def test_distribution_parsing(self):
+        import random
+        rng = random.Random(0)
+        assert parse_distribution("50")(rng) == 50
+        assert 20 <= parse_distribution("uniform:20,200")(rng) <= 200
+        assert parse_distribution("normal:-100,1")(rng) == 0.0
+        with pytest.raises(ValueError):
+            parse_distribution("poisson:3")
+
+    def test_unknown_backend_rejected(self):
+        with pytest.raises(ValueError):
+            get_backend("openai")
+
+
+# ── Model routing and hedging ────────────────────────────────
+
+class FakeModels:
+    """send() for the router: per-model latency script, records what ran."""
+
+    def __init__(self, latencies: dict):
+        self.latencies = latencies  # model -> list of seconds, consumed in order
+        self.started = []
+        self.cancelled = 0
+
+    async def __call__(self, messages, model, priority):
+        self.started.append((model, priority))
+        delay = self.latencies[model].pop(0)
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return _completion(model), {"llm_ms": delay * 1000}
+
+
+class TestRouter:
+    def test_short_turns_use_fast_tier_and_complex_use_strong(self):
+        router = ModelRouter(FakeModels({}), default_model="base", fast_model="small", strong_model="large")
+        assert router.choose_model([{"role": "user", "content": "hi there"}]) == "small"
+        assert router.choose_model([{"role": "user", "content": "Compare RLHF and DPO step by step"}]) == "large"
+        assert router.choose_model([{"role": "user", "content": "x" * 8000}]) == "large"
+
+    def test_failing_tier_is_avoided(self):
+        router = ModelRouter(FakeModels({}), default_model="base", fast_model="small", strong_model="large")
+        for _ in range(5):
+            router._stats("small").record_error()
+        assert router.choose_model([{"role": "user", "content": "hi"}]) == "large"
+
+    def test_hedge_wins_and_loser_is_cancelled(self):
+        send = FakeModels({"m": [1.0, 0.01]})
+        router = ModelRouter(send, default_model="m", hedge_enabled=True)
+        router.hedge_delay = lambda model: 0.02
+
+        started = time.monotonic()
+        result, timing = asyncio.run(router.complete([{"role": "user", "content": "hi"}]))
+        assert time.monotonic() - started < 0.5
+        assert timing["hedged"] is True
+        assert router.hedges == 1 and router.hedge_wins == 1
+        assert send.cancelled == 1
+        assert send.started[1][1] > send.started[0][1]  # hedge queued at lower priority
+
+    def test_no_hedge_when_primary_is_fast(self):
+        send = FakeModels({"m": [0.001]})
+        router = ModelRouter(send, default_model="m", hedge_enabled=True)
+        _, timing = asyncio.run(router.complete([{"role": "user", "content": "hi"}]))
+        assert timing["hedged"] is False
+        assert router.hedges == 0
+
+    def test_hedge_delay_tracks_p95(self):
+        stats = ModelStats()
+        for ms in range(1, 101):
+            stats.record_success(ms * 10.0)
+        assert stats.percentile(0.95) == 960.0
+        assert stats.ewma_latency_ms > 500
+
+    def test_chat_reports_model(self, fake_groq):
+        resp = client.post("/chat", json={"message": "hi"}, headers=_auth_header())
+        assert resp.json()["timing"]["model"] == main._backend.model
+        assert main._backend.model in client.get("/metrics").json()["router"]["models"]
+
+
+# ── Conversation compaction ──────────────────────────────────
+
+def _chat_turns(n: int, session_id: str | None = None) -> str:
+    for i in range(n):
+        body = {"message": f"turn {i}"}
+        if session_id:
+            body["session_id"] = session_id
+        session_id = client.post("/chat", json=body, headers=_auth_header()).json()["session_id"]
+    return session_id
+
+
+class TestCompaction:
+    def test_prompt_uses_summary_plus_recent_turns(self, fake_groq):
+        session_id = _chat_turns(10)
+        assert asyncio.run(main._compactor.compact("test-user", session_id)) is True
+
+        client.post("/chat", json={"message": "next", "session_id": session_id}, headers=_auth_header())
+        messages = fake_groq.last_messages
+        assert messages[1]["role"] == "system"
+        assert messages[1]["content"].startswith("Summary of the earlier conversation")
+        user_turns = [m["content"] for m in messages if m["role"] == "user"]
+        assert user_turns == ["turn 6", "turn 7", "turn 8", "turn 9", "next"]
+
+    def test_short_sessions_are_left_alone(self, fake_groq):
+        session_id = _chat_turns(3)
+        calls = fake_groq.calls
+        assert asyncio.run(main._compactor.compact("test-user", session_id)) is False
+        assert fake_groq.calls == calls
+
+    def test_compaction_is_incremental(self, fake_groq):
+        session_id = _chat_turns(8)
+        asyncio.run(main._compactor.compact("test-user", session_id))
+        _chat_turns(4, session_id)
+        assert asyncio.run(main._compactor.compact("test-user", session_id)) is True
+        conn = get_connection()
+        turns = conn.execute(
+            "SELECT turns_summarized FROM chat_summaries WHERE session_id = ?", (session_id,)
+        ).fetchone()[0]
+        conn.close()
+        assert turns == 8  # 4 + 4, the newest 4 stay verbatim
+
+    def test_worker_waits_for_idle_and_bounds_concurrency(self, fake_groq):
+        session_ids = [_chat_turns(8) for _ in range(4)]
+        state = {"idle": False, "running": 0, "peak": 0}
+
+        async def summarize(messages):
+            state["running"] += 1
+            state["peak"] = max(state["peak"], state["running"])
+            await asyncio.sleep(0.01)
+            state["running"] -= 1
+            return "summary"
+
+        async def scenario():
+            compactor = Compactor(summarize, is_idle=lambda: state["idle"], concurrency=2)
+            await compactor.start()
+            for sid in session_ids:
+                compactor.enqueue("test-user", sid)
+            await asyncio.sleep(0.05)
+            assert compactor.compactions == 0  # not idle yet
+            state["idle"] = True
+            for _ in range(100):
+                if compactor.compactions == 4:
+                    break
+                await asyncio.sleep(0.01)
+            await compactor.stop()
+            return compactor
+
+        compactor = asyncio.run(scenario())
+        assert compactor.compactions == 4
+        assert state["peak"] <= 2
+
+
+# ── Usage counters and quotas ────────────────────────────────
+
+class TestUsage:
+    def test_usage_endpoint_counts_requests_and_tokens(self, fake_groq):
+        client.post("/chat", json={"message": "one"}, headers=_auth_header())
+        client.post("/chat", json={"message": "two"}, headers=_auth_header())
+        client.post("/chat", json={"message": "one"}, headers=_auth_header())  # cache hit: no tokens
+        usage = client.get("/usage", headers=_auth_header()).json()
+        assert usage["today"]["requests"] == 3
+        assert usage["today"]["tokens"] == 84
+        assert usage["total"] == {"requests": 3, "tokens": 84}
+
+    def test_usage_requires_auth(self):
+        assert client.get("/usage").status_code == 401
+
+    def test_flush_is_batched_and_incremental(self):
+        tracker = UsageTracker(flush_batch=1000)
+        for i in range(50):
+            tracker.record(f"user-{i % 5}", 10)
+        assert tracker.flush() == 5
+        tracker.record("user-0", 1)
+        tracker.flush()
+        assert tracker.flushes == 2
+        assert tracker.get("user-0")["total"] == {"requests": 11, "tokens": 101}
+
+    def test_workers_share_counters_through_db(self):
+        worker_a, worker_b = UsageTracker(), UsageTracker()
+        worker_a.record("shared", 5)
+        worker_a.flush()
+        worker_b.record("shared", 7)
+        assert worker_b.get("shared")["today"] == {"day": worker_b.get("shared")["today"]["day"],
+                                                   "requests": 2, "tokens": 12}
+
+    def test_quota_blocks_before_llm_call(self, fake_groq, monkeypatch):
+        monkeypatch.setattr(main, "_usage", UsageTracker(request_quota=2))
+        assert client.post("/chat", json={"message": "a"}, headers=_auth_header()).status_code == 200
+        assert client.post("/chat", json={"message": "b"}, headers=_auth_header()).status_code == 200
+        resp = client.post("/chat", json={"message": "c"}, headers=_auth_header())
+        assert resp.status_code == 429
+        assert "retry-after" in resp.headers
+        assert fake_groq.calls == 2
+
+
+# ── Admin NDJSON export ──────────────────────────────────────
+
+def _insert_history(n: int, user_id: str = "u1", session_id: str = "s1", timestamp: str = "2026-02-21 10:00:00"):
+    conn = get_connection()
+    conn.executemany(
+        "INSERT INTO chat_history (id, user_id, message, response, session_id, tokens_used, timestamp) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [(f"{user_id}-{session_id}-{i}", user_id, f"q{i}", f"a{i}", session_id, i, timestamp) for i in range(n)],
+    )
+    conn.commit()
+    conn.close()
+
+
+def _ndjson(body: bytes) -> list[dict]:
+    return [json.loads(line) for line in body.decode().splitlines()]
+
+
+class TestExport:
+    def test_requires_admin(self):
+        assert client.get("/admin/export").status_code == 401
+        assert client.get("/admin/export", headers=_auth_header()).status_code == 403
+
+    def test_streams_all_rows_as_ndjson(self):
+        _insert_history(25)
+        resp = client.get("/admin/export", headers=_auth_header("root", role="admin"))
+        assert resp.status_code == 200
+        assert resp.headers["content-type"].startswith("application/x-ndjson")
+        rows = _ndjson(resp.content)
+        assert [r["message"] for r in rows] == [f"q{i}" for i in range(25)]
+
+    def test_filters_and_resume(self):
+        _insert_history(5, user_id="u1", timestamp="2026-02-20 09:00:00")
+        _insert_history(5, user_id="u2", timestamp="2026-02-21 09:00:00")
+        admin = _auth_header("root", role="admin")
+
+        rows = _ndjson(client.get("/admin/export", params={"user_id": "u2"}, headers=admin).content)
+        assert {r["user_id"] for r in rows} == {"u2"}
+
+        rows = _ndjson(client.get("/admin/export", params={"until": "2026-02-21T00:00:00"}, headers=admin).content)
+        assert {r["user_id"] for r in rows} == {"u1"}
+
+        first = _ndjson(client.get("/admin/export", headers=admin).content)
+        resumed = _ndjson(client.get("/admin/export", params={"after": first[3]["cursor"]}, headers=admin).content)
+        assert resumed == first[4:]
+
+    def test_gzip_format(self):
+        _insert_history(10)
+        resp = client.get("/admin/export", params={"format": "ndjson.gz"}, headers=_auth_header("root", role="admin"))
+        assert resp.headers["content-type"] == "application/gzip"
+        assert len(_ndjson(gzip.decompress(resp.content))) == 10
+
+    def test_rows_are_fetched_in_bounded_batches(self):
+        _insert_history(25)
+        chunks = list(iter_ndjson(batch_rows=10))
+        assert [len(chunk.splitlines()) for chunk in chunks] == [10, 10, 5]
+
+    def test_writes_succeed_while_an_export_is_paused(self):
+        _insert_history(25)
+        export = iter_ndjson(batch_rows=10)
+        first = next(export)  # a client that read one chunk and stalled
+        conn = get_connection()
+        conn.execute("PRAGMA busy_timeout = 0")  # fail fast instead of waiting out a lock
+        conn.execute(
+            "INSERT INTO chat_history (id, user_id, message, response, session_id) VALUES ('late', 'u1', 'q', 'a', 's1')"
+        )
+        conn.commit()
+        conn.close()
+        rows = _ndjson(first + b"".join(export))
+        assert len(rows) == 26 and rows[-1]["id"] == "late"
@@ -0,0 +1,168 @@
+import asyncio
+import os
+import time
+from collections import defaultdict
+
+from db import get_connection
+
+USAGE_FLUSH_SECONDS = float(os.getenv("USAGE_FLUSH_SECONDS", 2))
+USAGE_FLUSH_BATCH = int(os.getenv("USAGE_FLUSH_BATCH", 100))
+# 0 = unlimited
+USAGE_DAILY_REQUEST_QUOTA = int(os.getenv("USAGE_DAILY_REQUEST_QUOTA", 0))
+USAGE_DAILY_TOKEN_QUOTA = int(os.getenv("USAGE_DAILY_TOKEN_QUOTA", 0))
+
+
+class QuotaExceeded(Exception):
+    def __init__(self, kind: str, used: int, limit: int):
+        super().__init__(f"Daily {kind} quota exceeded ({used}/{limit})")
+        self.kind = kind
+        self.used = used
+        self.limit = limit
+
+
+def _today() -> str:
+    return time.strftime("%Y-%m-%d", time.gmtime())
+
+
+def seconds_until_tomorrow() -> int:
+    """Seconds until the UTC day (and so the daily quota) rolls over."""
+    return int(86400 - time.time() % 86400) + 1
+
+
+class UsageTracker:
+    """Materialized per-user and per-user-per-day request/token counters.
+
+    `record()` only bumps an in-memory delta; deltas are written with one
+    batched upsert per table, on a timer or once enough users are pending.
+    Reads are two primary-key lookups plus the unflushed delta, so /usage
+    and quota checks never aggregate chat_history. Counters are shared
+    through the DB, so several workers see each other's usage within one
+    flush interval."""
+
+    def __init__(self, request_quota: int = USAGE_DAILY_REQUEST_QUOTA,
+                 token_quota: int = USAGE_DAILY_TOKEN_QUOTA, flush_batch: int = USAGE_FLUSH_BATCH):
+        self.request_quota = request_quota
+        self.token_quota = token_quota
+        self.flush_batch = flush_batch
+        self._pending = defaultdict(lambda: [0, 0])  # (user_id, day) -> [requests, tokens]
+        self._pending_totals = defaultdict(lambda: [0, 0])  # user_id -> [requests, tokens]
+        self._flusher = None
+        self.flushes = 0
+        self.rows_flushed = 0
+
+    # ---- Writes ----
+    def record(self, user_id: str, tokens: int, requests: int = 1):
+        for delta in (self._pending[(user_id, _today())], self._pending_totals[user_id]):
+            delta[0] += requests
+            delta[1] += tokens
+        if len(self._pending) >= self.flush_batch:
+            self.flush()
+
+    def _take(self):
+        """Detach the pending deltas (on the event loop thread, so record() never races a write)."""
+        pending, self._pending = self._pending, defaultdict(lambda: [0, 0])
+        totals, self._pending_totals = self._pending_totals, defaultdict(lambda: [0, 0])
+        return pending, totals
+
+    def _restore(self, pending, totals):
+        """Merge deltas back after a failed write so nothing is lost."""
+        for merged, restored in ((self._pending, pending), (self._pending_totals, totals)):
+            for key, (r, t) in restored.items():
+                merged[key][0] += r
+                merged[key][1] += t
+
+    def _write(self, pending, totals):
+        """One batched upsert per table, in a single transaction."""
+        now = time.time()
+        conn = get_connection()
+        try:
+            conn.executemany(
+                "INSERT INTO usage_daily (user_id, day, requests, tokens) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(user_id, day) DO UPDATE SET requests = requests + excluded.requests, "
+                "tokens = tokens + excluded.tokens",
+                [(user_id, day, r, t) for (user_id, day), (r, t) in pending.items()],
+            )
+            conn.executemany(
+                "INSERT INTO usage_totals (user_id, requests, tokens, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET requests = requests + excluded.requests, "
+                "tokens = tokens + excluded.tokens, updated_at = excluded.updated_at",
+                [(user_id, r, t, now) for user_id, (r, t) in totals.items()],
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        self.flushes += 1
+        self.rows_flushed += len(pending)
+
+    def flush(self) -> int:
+        """Write all pending deltas now. Returns the number of daily rows upserted."""
+        if not self._pending:
+            return 0
+        pending, totals = self._take()
+        try:
+            self._write(pending, totals)
+        except Exception:
+            self._restore(pending, totals)
+            raise
+        return len(pending)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(USAGE_FLUSH_SECONDS)
+            if not self._pending:
+                continue
+            pending, totals = self._take()
+            try:
+                await asyncio.to_thread(self._write, pending, totals)
+            except Exception as e:
+                self._restore(pending, totals)
+                print(f"[chat-service] Usage flush failed, will retry: {e}")
+
+    async def start(self):
+        self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._flusher:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        self.flush()
+
+    # ---- Reads ----
+    def get(self, user_id: str) -> dict:
+        day = _today()
+        conn = get_connection()
+        try:
+            daily = conn.execute(
+                "SELECT requests, tokens FROM usage_daily WHERE user_id = ? AND day = ?", (user_id, day)
+            ).fetchone() or (0, 0)
+            total = conn.execute(
+                "SELECT requests, tokens FROM usage_totals WHERE user_id = ?", (user_id,)
+            ).fetchone() or (0, 0)
+        finally:
+            conn.close()
+        today_delta = self._pending.get((user_id, day), (0, 0))
+        total_delta = self._pending_totals.get(user_id, (0, 0))
+        return {
+            "user_id": user_id,
+            "today": {"day": day, "requests": daily[0] + today_delta[0], "tokens": daily[1] + today_delta[1]},
+            "total": {"requests": total[0] + total_delta[0], "tokens": total[1] + total_delta[1]},
+            "quota": {"daily_requests": self.request_quota or None, "daily_tokens": self.token_quota or None},
+        }
+
+    def check_quota(self, user_id: str):
+        """Raise QuotaExceeded if the user is out of today's budget."""
+        if not (self.request_quota or self.token_quota):
+            return
+        today = self.get(user_id)["today"]
+        if self.request_quota and today["requests"] >= self.request_quota:
+            raise QuotaExceeded("request", today["requests"], self.request_quota)
+        if self.token_quota and today["tokens"] >= self.token_quota:
+            raise QuotaExceeded("token", today["tokens"], self.token_quota)
+
+    def stats(self) -> dict:
+        return {
+            "pending_rows": len(self._pending),
+            "flushes": self.flushes,
+            "rows_flushed": self.rows_flushed,
+        }
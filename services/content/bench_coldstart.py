@@ -0,0 +1,106 @@
+"""
+Cold-start benchmark for the content service's search cache.
+
+Seeds a temporary database, then starts fresh interpreters and times the
+first search each one serves (the cache load included):
+
+  - no snapshot:      CONTENT_SNAPSHOT_PATH="" (full table query + indexing)
+  - first start:      same, plus writing the snapshot
+  - from snapshot:    snapshot loaded and validated, nothing to replay
+  - snapshot + delta: snapshot loaded, then --delta newer rows replayed
+
+    python bench_coldstart.py --rows 20000 --delta 200
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+_STARTED = time.perf_counter()
+
+
+def _rows(start: int, count: int):
+    from bench_search import synthetic_docs
+    from dedup import content_hash
+
+    for i, doc in enumerate(synthetic_docs(start + count)):
+        if i >= start:
+            yield {"id": doc["id"], "title": doc["title"], "body": doc["body"], "content_type": doc["content_type"],
+                   "metadata_json": json.dumps(doc["metadata"]), "created_at": f"2026-01-01T00:00:{i:08d}",
+                   "is_indexed": 1, "content_hash": content_hash(doc["title"], doc["body"])}
+
+
+def seed(start: int, count: int):
+    import database
+
+    database.init_db()
+    with database.engine.begin() as conn:
+        conn.execute(database.DBContent.__table__.insert(), list(_rows(start, count)))
+
+
+def first_query(cache_size: int) -> dict:
+    import database
+    from fastapi.testclient import TestClient
+    from main import app
+
+    imported = time.perf_counter()
+    database.MAX_CACHE_SIZE = cache_size
+    client = TestClient(app)
+    started = time.perf_counter()
+    resp = client.post("/content/search", json={"query": "alignment safety", "limit": 5}, headers={"x-user-id": "bench"})
+    resp.raise_for_status()
+    done = time.perf_counter()
+    return {
+        "first_query_ms": round((done - started) * 1000, 1),
+        "process_to_first_result_ms": round((done - _STARTED) * 1000, 1),
+        "import_ms": round((imported - _STARTED) * 1000, 1),
+        "documents": len(database._content_cache),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20_000)
+    parser.add_argument("--delta", type=int, default=200)
+    parser.add_argument("--child", choices=["seed", "query"], help=argparse.SUPPRESS)
+    parser.add_argument("--start", type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child == "seed":
+        seed(args.start, args.rows)
+        return
+    if args.child == "query":
+        print(json.dumps(first_query(args.rows)))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        snapshot_path = os.path.join(tmp, "content.db.index")
+        base_env = {**os.environ, "CONTENT_DB_PATH": os.path.join(tmp, "content.db"), "CONTENT_DB_THREADS": "0",
+                    "CONTENT_SEARCH_BACKEND": "memory"}
+
+        def child(mode: str, rows: int, start: int = 0, snapshot: bool = True) -> str:
+            env = {**base_env, "CONTENT_SNAPSHOT_PATH": snapshot_path if snapshot else "",
+                   "CONTENT_SNAPSHOT_KEY": "bench"}
+            return subprocess.run(
+                [sys.executable, __file__, "--child", mode, "--rows", str(rows), "--start", str(start)],
+                env=env, capture_output=True, text=True, check=True,
+            ).stdout
+
+        child("seed", args.rows, snapshot=False)
+        cache_size = args.rows + args.delta
+        runs = [("no snapshot", False), ("first start", True), ("from snapshot", True)]
+        for label, snapshot in runs:
+            result = json.loads(child("query", cache_size, snapshot=snapshot).strip().splitlines()[-1])
+            print(f"{label:>16}: " + "  ".join(f"{k}={v}" for k, v in result.items()))
+        child("seed", args.delta, start=args.rows, snapshot=False)
+        result = json.loads(child("query", cache_size).strip().splitlines()[-1])
+        print(f"{'snapshot + delta':>16}: " + "  ".join(f"{k}={v}" for k, v in result.items()))
+        print(f"snapshot file: {os.path.getsize(snapshot_path) / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Concurrency benchmark for the content service's DB thread pool.
+
+Seeds a temporary database, then drives the app in-process with concurrent
+whole-corpus FTS5 searches (slow queries that spend their time inside
+SQLite) while a probe measures /health latency, i.e. how long unrelated
+requests wait behind DB work. Runs once per
+CONTENT_DB_THREADS value, each in a fresh interpreter:
+
+    python bench_concurrency.py --rows 20000 --clients 12 --requests 20 --threads 0 8
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def _percentile(samples: list[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+async def _drive(app, clients: int, requests: int) -> dict:
+    import httpx
+
+    transport = httpx.ASGITransport(app=app)
+    headers = {"x-user-id": "bench"}
+    latencies, probes = [], []
+    done = asyncio.Event()
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def searcher():
+            for _ in range(requests):
+                started = time.perf_counter()
+                resp = await client.post("/content/search", json={"query": "lorem dolor", "limit": 5}, headers=headers)
+                resp.raise_for_status()
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        async def probe():
+            # Timed from when the request was due, so time spent waiting for a
+            # blocked event loop counts, not just the handler itself
+            while not done.is_set():
+                due = time.perf_counter() + 0.005
+                await asyncio.sleep(0.005)
+                await client.get("/health")
+                probes.append((time.perf_counter() - due) * 1000)
+
+        probe_task = asyncio.create_task(probe())
+        started = time.perf_counter()
+        await asyncio.gather(*(searcher() for _ in range(clients)))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await probe_task
+
+    return {
+        "searches_per_s": round(clients * requests / elapsed, 1),
+        "search_p50_ms": round(statistics.median(latencies), 1),
+        "search_p95_ms": round(_percentile(latencies, 0.95), 1),
+        "health_p50_ms": round(statistics.median(probes), 1),
+        "health_p99_ms": round(_percentile(probes, 0.99), 1),
+    }
+
+
+def run_once(rows: int, clients: int, requests: int) -> dict:
+    """Runs in the child process; CONTENT_DB_PATH/CONTENT_DB_THREADS already set."""
+    import database
+    from main import app
+
+    database.init_db()
+    with database.engine.begin() as conn:
+        conn.execute(database.DBContent.__table__.insert(), [
+            {"id": f"bench-{i}", "title": f"Lesson {i}", "body": "lorem ipsum dolor sit amet " * 80,
+             "content_type": "lesson", "metadata_json": json.dumps({"week": i % 12 + 1}),
+             "created_at": f"2026-01-01T00:00:{i:08d}", "is_indexed": 1}
+            for i in range(rows)
+        ])
+    return asyncio.run(_drive(app, clients, requests))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20_000)
+    parser.add_argument("--clients", type=int, default=12)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--threads", type=int, nargs="+", default=[0, 8])
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_once(args.rows, args.clients, args.requests)))
+        return
+
+    for threads in args.threads:
+        with tempfile.TemporaryDirectory() as tmp:
+            env = {**os.environ, "CONTENT_DB_PATH": os.path.join(tmp, "bench.db"), "CONTENT_DB_THREADS": str(threads),
+                   "CONTENT_SEARCH_BACKEND": "fts5"}
+            out = subprocess.run(
+                [sys.executable, __file__, "--child", "--rows", str(args.rows), "--clients", str(args.clients),
+                 "--requests", str(args.requests)],
+                env=env, capture_output=True, text=True, check=True,
+            ).stdout
+        result = json.loads(out.strip().splitlines()[-1])
+        label = "inline" if threads == 0 else f"{threads} threads"
+        print(f"{label:>10}: " + "  ".join(f"{k}={v}" for k, v in result.items()))
+
+
+if __name__ == "__main__":
+    main()
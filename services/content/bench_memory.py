@@ -0,0 +1,57 @@
+"""
+Memory report for the content service's in-process cache.
+
+Fills a ContentCache (documents plus their SearchIndex) with a synthetic
+corpus and reports traced bytes per document, split into the cached
+documents themselves and the index built over them:
+
+    python bench_memory.py --docs 20000
+"""
+
+import argparse
+import gc
+import tracemalloc
+
+import database
+from bench_search import synthetic_docs
+
+
+def _traced(build) -> tuple[object, int]:
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = build()
+        gc.collect()
+        return result, tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=20_000)
+    args = parser.parse_args()
+
+    database.MAX_CACHE_SIZE = args.docs
+    docs = list(synthetic_docs(args.docs))
+    # The source dicts stand in for rows already held by the caller; only what the cache adds is counted
+    cache, total = _traced(lambda: _fill(docs))
+    _, dict_bytes = _traced(lambda: [dict(doc) for doc in docs])
+    _, entry_bytes = _traced(lambda: [database.ContentCache.entry(doc) for doc in docs])
+    print(f"docs={args.docs}")
+    print(f"cache total:      {total / args.docs:8.0f} bytes/doc")
+    print(f"  entries:        {entry_bytes / args.docs:8.0f} bytes/doc  (as plain dicts: {dict_bytes / args.docs:.0f})")
+    print(f"  index:          {(total - entry_bytes) / args.docs:8.0f} bytes/doc")
+    return cache
+
+
+def _fill(docs):
+    cache = database.ContentCache()
+    for doc in docs:
+        cache.put(dict(doc))
+    return cache
+
+
+if __name__ == "__main__":
+    main()
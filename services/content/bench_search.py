@@ -0,0 +1,146 @@
+"""
+Search micro-benchmark for the content service's in-memory index.
+
+Builds a synthetic corpus and times queries against it:
+
+    python bench_search.py --docs 100000 --queries 200
+"""
+
+import argparse
+import random
+import statistics
+import time
+
+from search_index import SearchIndex
+
+_VOCAB = [
+    "alignment", "interpretability", "robustness", "governance", "prompt", "engineering", "agents",
+    "tools", "planning", "memory", "evaluation", "red", "teaming", "jailbreak", "injection", "bias",
+    "safety", "llm", "reasoning", "chain", "thought", "few", "shot", "zero", "system", "design",
+    "reward", "model", "policy", "oversight", "scalable", "deception", "benchmark", "capstone",
+]
+_RARE = [f"term{i}" for i in range(5000)]
+
+
+def synthetic_docs(n: int, seed: int = 0):
+    rng = random.Random(seed)
+    for i in range(n):
+        body_words = rng.choices(_VOCAB, k=60) + rng.choices(_RARE, k=20)
+        yield {
+            "id": f"doc-{i}",
+            "title": " ".join(rng.choices(_VOCAB, k=4)),
+            "body": " ".join(body_words),
+            "content_type": rng.choice(["lesson", "schedule", "exercise"]),
+            "metadata": {"week": rng.randint(1, 12), "tags": rng.sample(_VOCAB, 3)},
+        }
+
+
+def _timed(fn, runs: int) -> list[float]:
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def _summary(samples: list[float]) -> str:
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    return f"p50={statistics.median(ordered):.2f}ms  p95={p95:.2f}ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    docs = list(synthetic_docs(args.docs))
+    index = SearchIndex()
+    started = time.perf_counter()
+    for doc in docs:
+        index.add(doc)
+    print(f"indexed {args.docs} docs in {time.perf_counter() - started:.2f}s")
+
+    # The first query touching a term builds its impact list and bitmap; time that separately
+    started = time.perf_counter()
+    for term in _VOCAB:
+        index.search(term, 5)
+    print(f"warmed {len(_VOCAB)} broad terms in {time.perf_counter() - started:.2f}s")
+
+    rng = random.Random(1)
+    rare_queries = [" ".join(rng.sample(_RARE, 2)) for _ in range(args.queries)]
+    common_queries = [" ".join(rng.sample(_VOCAB, 2)) for _ in range(args.queries)]
+    # Every _VOCAB word is in ~85% of documents with near-uniform impacts: the
+    # threshold algorithm's worst case, and more so the more terms a query has
+    wide_rng = random.Random(2)  # own stream, so the queries of the rows below stay the same
+    wide_queries = [" ".join(wide_rng.sample(_VOCAB, 3)) for _ in range(args.queries)]
+    rare_iter, common_iter, wide_iter = iter(rare_queries), iter(common_queries), iter(wide_queries)
+    print(f"selective queries: {_summary(_timed(lambda: index.search(next(rare_iter), 5), args.queries))}")
+    print(f"broad queries:     {_summary(_timed(lambda: index.search(next(common_iter), 5), args.queries))}")
+    print(f"broad, 3 terms:    {_summary(_timed(lambda: index.search(next(wide_iter), 5), args.queries))}")
+
+    filters = [{"week": [str(rng.randint(1, 12))], "tags": [rng.choice(_VOCAB)]} for _ in range(args.queries)]
+    for f in filters:  # first use of each facet value builds its bitmap
+        index.facets.mask(f)
+    filtered = iter(zip(common_queries, filters))
+
+    def filtered_search():
+        query, f = next(filtered)
+        index.search(query, 5, f)
+        index.facet_counts(query, f)
+
+    print(f"week+tag filtered: {_summary(_timed(filtered_search, args.queries))}")
+
+    # As-you-type: prefixes and single-deletion typos, as /content/suggest runs them
+    partial = []
+    for _ in range(args.queries):
+        word = rng.choice(_VOCAB + _RARE)
+        partial.append(word[: rng.randint(1, len(word))])
+        typo = rng.choice(_VOCAB)
+        cut = rng.randrange(len(typo))
+        partial.append(typo[:cut] + typo[cut + 1:])
+    partial_iter = iter(partial)
+
+    def suggest():
+        suggestions = index.suggest(next(partial_iter), 5)
+        if suggestions:
+            index.search(suggestions[0], 5)
+
+    print(f"suggest:           {_summary(_timed(suggest, len(partial)))}")
+
+    # Snippets for a page of 10 hits, from the offsets stored at index time
+    bodies = {doc["id"]: doc["body"] for doc in docs}
+    snippet_iter = iter(common_queries)
+
+    def snippets():
+        query = next(snippet_iter)
+        terms = index.query_terms(query)
+        for doc_id, _ in index.search(query, 10)[0]:
+            index.snippet(doc_id, bodies[doc_id], terms)
+
+    print(f"search+10 snippets: {_summary(_timed(snippets, args.queries))}")
+
+    # Related content: the first lookup vectorises the corpus in one batch
+    started = time.perf_counter()
+    index.related(docs[0]["id"], 5)
+    print(f"related vectors built in {time.perf_counter() - started:.2f}s")
+    related_ids = [doc["id"] for doc in rng.sample(docs, args.queries)]
+    related_iter = iter(related_ids)
+    print(f"related (first):   {_summary(_timed(lambda: index.related(next(related_iter), 5), args.queries))}")
+    related_iter = iter(related_ids)
+    print(f"related (memo):    {_summary(_timed(lambda: index.related(next(related_iter), 5), args.queries))}")
+    # Uploads are merged into the memoized lists they beat
+    new_docs = iter(synthetic_docs(args.queries, seed=2))
+
+    def upload():
+        doc = next(new_docs)
+        index.add({**doc, "id": f"new-{doc['id']}"})
+        index.related(related_ids[0], 5)
+
+    print(f"upload + related:  {_summary(_timed(upload, args.queries))}")
+
+
+if __name__ == "__main__":
+    main()
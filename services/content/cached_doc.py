@@ -0,0 +1,46 @@
+PREVIEW_CHARS = 200
+
+
+def preview(body: str | None) -> str:
+    """First PREVIEW_CHARS characters of a body, with "..." if it was cut."""
+    body = body or ""
+    return body[:PREVIEW_CHARS] + "..." if len(body) > PREVIEW_CHARS else body
+
+
+class CachedDoc:
+    """One cached content item.
+
+    A slotted object rather than a dict (80 bytes instead of ~185 with no
+    per-instance hash table). Supports `doc["title"]` / `doc.get("title")` so
+    code written against the old cache dicts keeps working."""
+
+    __slots__ = ("id", "title", "body", "content_type", "metadata")
+
+    def __init__(self, id: str, title: str, body: str, content_type: str | None, metadata: dict | None):
+        self.id = id
+        self.title = title
+        self.body = body
+        self.content_type = content_type
+        self.metadata = metadata or {}
+
+    @classmethod
+    def from_dict(cls, item: dict) -> "CachedDoc":
+        return cls(item["id"], item.get("title"), item.get("body"), item.get("content_type"), item.get("metadata"))
+
+    def __getitem__(self, key: str):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key: str, default=None):
+        return getattr(self, key, default) if key in self.__slots__ else default
+
+    def __eq__(self, other):
+        if not isinstance(other, CachedDoc):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"CachedDoc(id={self.id!r}, title={self.title!r})"
@@ -0,0 +1,56 @@
+import os
+
+# Every write to `content` appends the affected id here (via triggers, so
+# ORM, Core, bulk and raw-SQL writes are all covered). The autoincrement
+# version is the content version: a worker that has applied everything up
+# to version N only needs the ids changed after N.
+CHANGES_TABLE = "content_changes"
+# Change rows kept for workers that are behind; older ones are pruned and a
+# worker that falls further behind than this reloads in full.
+CHANGELOG_RETENTION = int(os.getenv("CONTENT_CHANGELOG_RETENTION", 10000))
+
+_DDL = [
+    f"CREATE TABLE IF NOT EXISTS {CHANGES_TABLE} ("
+    "version INTEGER PRIMARY KEY AUTOINCREMENT, content_id TEXT NOT NULL)",
+    f"CREATE TRIGGER IF NOT EXISTS content_changes_insert AFTER INSERT ON content BEGIN "
+    f"INSERT INTO {CHANGES_TABLE} (content_id) VALUES (new.id); END",
+    f"CREATE TRIGGER IF NOT EXISTS content_changes_update AFTER UPDATE ON content BEGIN "
+    f"INSERT INTO {CHANGES_TABLE} (content_id) VALUES (new.id); "
+    f"INSERT INTO {CHANGES_TABLE} (content_id) SELECT old.id WHERE old.id != new.id; END",
+    f"CREATE TRIGGER IF NOT EXISTS content_changes_delete AFTER DELETE ON content BEGIN "
+    f"INSERT INTO {CHANGES_TABLE} (content_id) VALUES (old.id); END",
+]
+
+
+def init_changelog(engine):
+    with engine.begin() as conn:
+        for statement in _DDL:
+            conn.exec_driver_sql(statement)
+
+
+def version_range(conn) -> tuple[int, int]:
+    """(oldest retained, current) version; two rowid lookups, cheap enough to run per read."""
+    oldest, current = conn.exec_driver_sql(f"SELECT min(version), max(version) FROM {CHANGES_TABLE}").one()
+    return oldest or 0, current or 0
+
+
+def change_at(conn, version: int) -> str | None:
+    """The content id recorded at `version`, or None if there is no such row
+    (pruned, or never written: another database)."""
+    row = conn.exec_driver_sql(f"SELECT content_id FROM {CHANGES_TABLE} WHERE version = ?", (version,)).first()
+    return row[0] if row else None
+
+
+def changed_ids(conn, since: int, limit: int) -> list[str] | None:
+    """Distinct ids changed after `since`, or None if there are more than
+    `limit` (a full reload is cheaper then)."""
+    rows = conn.exec_driver_sql(
+        f"SELECT DISTINCT content_id FROM {CHANGES_TABLE} WHERE version > ? LIMIT ?", (since, limit + 1)
+    ).all()
+    if len(rows) > limit:
+        return None
+    return [row[0] for row in rows]
+
+
+def prune(conn, current: int, retention: int = CHANGELOG_RETENTION):
+    conn.exec_driver_sql(f"DELETE FROM {CHANGES_TABLE} WHERE version <= ?", (current - retention,))
@@ -1,15 +1,67 @@
+import asyncio
+import functools
+import itertools
 import json
+import threading
 import uuid
 import os
+import pickle
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from collections import OrderedDict
-from sqlalchemy import create_engine, Column, String, Integer, Text
+from sqlalchemy import create_engine, event, inspect, select, update, bindparam, Column, String, Integer, Text, Index
 from sqlalchemy.orm import sessionmaker, declarative_base, Session
 
+import changelog
+import index_snapshot
+from cached_doc import CachedDoc
+from dedup import content_hash
+from fts_search import drop_fts, init_fts
+from search_index import SearchIndex
+
 DATABASE_PATH = os.getenv("CONTENT_DB_PATH", "content.db")
 DATABASE_URL = f"sqlite:///{DATABASE_PATH}"
+# "memory": BM25 index over the LRU cache; "fts5": SQLite FTS5 over the whole table
+SEARCH_BACKEND = os.getenv("CONTENT_SEARCH_BACKEND", "memory").lower()
+
+# Blocking DB work runs on this many threads (0 = inline on the event loop, for comparison)
+DB_THREADS = int(os.getenv("CONTENT_DB_THREADS", min(32, (os.cpu_count() or 1) + 4)))
+DB_POOL_SIZE = int(os.getenv("CONTENT_DB_POOL_SIZE", max(DB_THREADS, 5)))
+DB_MAX_OVERFLOW = int(os.getenv("CONTENT_DB_MAX_OVERFLOW", 10))
+# WAL lets readers run alongside the single writer instead of queueing behind it
+DB_JOURNAL_MODE = os.getenv("CONTENT_DB_JOURNAL_MODE", "WAL")
+DB_SYNCHRONOUS = os.getenv("CONTENT_DB_SYNCHRONOUS", "NORMAL")
+DB_BUSY_TIMEOUT_MS = int(os.getenv("CONTENT_DB_BUSY_TIMEOUT_MS", 5000))
+
+engine = create_engine(
+    DATABASE_URL,
+    connect_args={"check_same_thread": False},
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+)
+
+
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={DB_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous={DB_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    cursor.close()
+
+
+_db_executor = ThreadPoolExecutor(max_workers=DB_THREADS, thread_name_prefix="content-db") if DB_THREADS else None
+
+
+async def run_db(fn, *args, **kwargs):
+    """Run blocking DB (or cache) work off the event loop on the sized DB pool,
+    so one slow query doesn't stall every other request on the worker."""
+    if _db_executor is None:
+        return fn(*args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(_db_executor, functools.partial(fn, *args, **kwargs))
+
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
@@ -26,6 +78,14 @@ class DBContent(Base):
     updated_at = Column(String, nullable=True)
     uploaded_by = Column(String, nullable=True)
     is_indexed = Column(Integer, default=1)
+    # dedup.content_hash(title, body); NULL only for duplicates that predate the column
+    content_hash = Column(String, nullable=True)
+
+    __table_args__ = (
+        # Keyset pagination for the newest-first listing
+        Index("ix_content_created_at_id", "created_at", "id"),
+        Index("ux_content_hash", "content_hash", unique=True),
+    )
 
 
 def get_db():
@@ -39,14 +99,65 @@ def get_session():
     """Returns a direct session, mostly used for synchronous non-request contexts like init_db"""
     return SessionLocal()
 
-def init_db():
+def _backfill_content_hash():
+    """Add and fill content_hash on databases created before it existed.
+    Where old rows are already duplicates, only the oldest gets the hash
+    (the unique index would reject the rest); the others are left as they are."""
+    with engine.begin() as conn:
+        if "content_hash" not in {c["name"] for c in inspect(conn).get_columns("content")}:
+            conn.exec_driver_sql("ALTER TABLE content ADD COLUMN content_hash TEXT")
+        rows = conn.execute(
+            select(DBContent.id, DBContent.title, DBContent.body)
+            .where(DBContent.content_hash.is_(None)).order_by(DBContent.created_at, DBContent.id)
+        ).all()
+        if not rows:
+            return
+        taken = set(conn.execute(select(DBContent.content_hash).where(DBContent.content_hash.is_not(None))).scalars())
+        updates = []
+        for row in rows:
+            digest = content_hash(row.title, row.body)
+            if digest not in taken:
+                taken.add(digest)
+                updates.append({"row_id": row.id, "digest": digest})
+        if not updates:
+            return
+        conn.execute(
+            update(DBContent.__table__).where(DBContent.__table__.c.id == bindparam("row_id"))
+            .values(content_hash=bindparam("digest")),
+            updates,
+        )
+        print(f"[content-service] Backfilled content_hash on {len(updates)} rows "
+              f"({len(rows) - len(updates)} duplicates left unhashed)")
+
+
+def existing_by_hash(db: Session, hashes) -> dict[str, str]:
+    """content_hash -> id of the stored rows among `hashes`, in one query."""
+    hashes = list(hashes)
+    if not hashes:
+        return {}
+    rows = db.execute(select(DBContent.content_hash, DBContent.id).where(DBContent.content_hash.in_(hashes)))
+    return dict(rows.all())
+
+
+def init_db(seed_defaults: bool = True):
     Base.metadata.create_all(bind=engine)
-    
+    _backfill_content_hash()
+    # create_all() skips tables that already exist, so add newer indexes to older DBs
+    for index in DBContent.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
+    # Built (from the content table) when the fts5 backend is first used, dropped
+    # otherwise so the other backends don't keep a second copy of every body
+    if SEARCH_BACKEND == "fts5":
+        init_fts(engine)
+    else:
+        drop_fts(engine)
+    changelog.init_changelog(engine)
+
     db = get_session()
     try:
         # Seed default content if count is 0
         count = db.query(DBContent).count()
-        if count == 0:
+        if count == 0 and seed_defaults:
             _seed_content(db)
     finally:
         db.close()
@@ -86,12 +197,80 @@ def _seed_content(db: Session):
         },
     ]
     for item in default_content:
-        db.add(DBContent(**item, is_indexed=1))
+        db.add(DBContent(**item, content_hash=content_hash(item["title"], item["body"]), is_indexed=1))
     db.commit()
     print("[content-service] Seeded default content.")
 
 MAX_CACHE_SIZE = 1000
+# Held for every cache read or write: DB pool threads sync the cache while others search it
+cache_lock = threading.RLock()
+# How often a worker checks the change log before serving from its cache (0 = every
+# read). Its own writes are visible at once through the write-through cache; this
+# bounds how stale other workers' writes can be, and keeps reads off the DB
+CACHE_SYNC_SECONDS = float(os.getenv("CONTENT_CACHE_SYNC_SECONDS", 1.0))
+# On-disk snapshot of the cache and its indexes, shared by every worker; off unless
+# a path is set. It is a pickle, so it is only written and read with a signing key:
+# without CONTENT_SNAPSHOT_KEY write access to the file would mean code execution
+SNAPSHOT_PATH = os.getenv("CONTENT_SNAPSHOT_PATH", "")
+SNAPSHOT_KEY = os.getenv("CONTENT_SNAPSHOT_KEY", "").encode()
+if SNAPSHOT_PATH and not SNAPSHOT_KEY:
+    print("[content-service] CONTENT_SNAPSHOT_PATH is set without CONTENT_SNAPSHOT_KEY; index snapshots disabled")
+    SNAPSHOT_PATH = ""
+# Rewrite the snapshot once this many change-log versions have been replayed on top of it
+SNAPSHOT_REFRESH_CHANGES = int(os.getenv("CONTENT_SNAPSHOT_REFRESH_CHANGES", 1000))
 _content_cache = None
+# Process-wide, so a reloaded cache never reuses a generation of the one it replaced
+_generations = itertools.count(1)
+
+
+class ContentCache(OrderedDict):
+    """LRU map of content id -> CachedDoc that keeps a SearchIndex in step
+    with its entries, so search never has to walk the cache.
+
+    `version` is the last content_changes version applied, which is how a
+    worker catches up with writes made by other workers. `generation` moves
+    on with every local change (including write-through puts, which don't
+    touch `version`), so anything derived from the cache can be tagged with it."""
+
+    def __init__(self):
+        super().__init__()
+        self.index = SearchIndex()
+        self.version = 0
+        self.checked_at = 0.0
+        self.delta_syncs = 0
+        self.generation = next(_generations)
+        self.snapshot_version = None  # content version of the last snapshot written or loaded
+
+    @staticmethod
+    def entry(item: dict | CachedDoc) -> CachedDoc:
+        return item if isinstance(item, CachedDoc) else CachedDoc.from_dict(item)
+
+    def put(self, item: dict | CachedDoc):
+        doc = self.entry(item)
+        self.generation = next(_generations)
+        key = doc.id
+        self[key] = doc
+        self.move_to_end(key)
+        self.index.add(doc)
+
+        # Evict oldest item if we exceed capacity
+        while len(self) > MAX_CACHE_SIZE:
+            evicted_id, _ = self.popitem(last=False)
+            self.index.remove(evicted_id)
+
+    def discard(self, key: str):
+        if self.pop(key, None) is not None:
+            self.generation = next(_generations)
+            self.index.remove(key)
+
+
+def cache_item(row) -> CachedDoc:
+    try:
+        metadata_dict = json.loads(row.metadata_json) if row.metadata_json else {}
+    except json.JSONDecodeError:
+        metadata_dict = {}
+    return CachedDoc(row.id, row.title, row.body, row.content_type, metadata_dict)
+
 
 def update_item_in_cache(item_dict: dict):
     """
@@ -99,45 +278,140 @@ def update_item_in_cache(item_dict: dict):
     If the cache hasn't been initialized yet, it does nothing
     (the next read will pull the fresh state from the DB).
     """
-    global _content_cache
-    if _content_cache is not None:
-        key = item_dict["id"]
-        _content_cache[key] = item_dict
-        _content_cache.move_to_end(key)
-        
-        # Evict oldest item if we exceed capacity
-        if len(_content_cache) > MAX_CACHE_SIZE:
-            _content_cache.popitem(last=False)
+    with cache_lock:
+        if _content_cache is not None:
+            _content_cache.put(item_dict)
+
+
+def _load_cache() -> ContentCache:
+    db = get_session()
+    try:
+        # Read the version first: anything written during the load is re-applied by the next sync
+        _, version = changelog.version_range(db.connection())
+        # Query up to MAX_CACHE_SIZE newest items
+        rows = db.query(DBContent).filter(DBContent.is_indexed == 1).order_by(DBContent.created_at.desc()).limit(MAX_CACHE_SIZE).all()
+
+        new_cache = ContentCache()
+        # Iterate in reverse to insert oldest first, so newest are most recently used
+        for row in reversed(rows):
+            new_cache.put(cache_item(row))
+        new_cache.version = version
+        new_cache.checked_at = time.monotonic()
+        return new_cache
+    finally:
+        db.close()
+
+
+def _sync_cache(cache: ContentCache) -> bool:
+    """Apply writes made since cache.version (by any worker) as a delta.
+    Returns False when the cache is too far behind and must be reloaded."""
+    db = get_session()
+    try:
+        conn = db.connection()
+        oldest, current = changelog.version_range(conn)
+        cache.checked_at = time.monotonic()
+        if current <= cache.version:
+            return True
+        if cache.version + 1 < oldest:
+            return False  # the changes we'd need were pruned
+        ids = changelog.changed_ids(conn, cache.version, MAX_CACHE_SIZE)
+        if ids is None:
+            return False
+        rows = {row.id: row for row in db.query(DBContent).filter(DBContent.id.in_(ids)).all()}
+        for content_id in ids:
+            row = rows.get(content_id)
+            if row is None or not row.is_indexed:
+                cache.discard(content_id)
+                continue
+            item = cache_item(row)
+            # This worker's own writes are already in the cache (write-through); don't re-index them
+            if cache.get(content_id) != item:
+                cache.put(item)
+        cache.version = current
+        cache.delta_syncs += 1
+        if current - oldest >= 2 * changelog.CHANGELOG_RETENTION:
+            changelog.prune(conn, current)
+            db.commit()
+        return True
+    finally:
+        db.close()
+
+
+def _save_snapshot(cache: ContentCache):
+    if not SNAPSHOT_PATH:
+        return
+    started = time.perf_counter()
+    db = get_session()
+    try:
+        # Lets a later load check the snapshot belongs to this database's history
+        last_change = changelog.change_at(db.connection(), cache.version)
+    finally:
+        db.close()
+    try:
+        index_snapshot.save(cache, SNAPSHOT_PATH, {"version": cache.version, "last_change": last_change,
+                                                   "documents": len(cache)}, SNAPSHOT_KEY)
+    except OSError as e:
+        print(f"[content-service] Could not write index snapshot: {e}")
+        return
+    cache.snapshot_version = cache.version
+    print(f"[content-service] Wrote index snapshot of {len(cache)} documents at version {cache.version} "
+          f"in {(time.perf_counter() - started) * 1000:.0f}ms")
+
+
+def _load_snapshot() -> ContentCache | None:
+    """The cache as of the on-disk snapshot, if there is one this database
+    can bring up to date; the caller replays the delta with _sync_cache()."""
+    if not SNAPSHOT_PATH or not os.path.exists(SNAPSHOT_PATH):
+        return None
+    started = time.perf_counter()
+    try:
+        with index_snapshot.IndexSnapshot(SNAPSHOT_PATH, SNAPSHOT_KEY) as snapshot:
+            meta = snapshot.meta
+            db = get_session()
+            try:
+                conn = db.connection()
+                oldest, current = changelog.version_range(conn)
+                recorded = changelog.change_at(conn, meta["version"]) if meta["version"] else None
+            finally:
+                db.close()
+            if meta["version"] > current or recorded != meta["last_change"] or meta["version"] + 1 < oldest:
+                print("[content-service] Index snapshot does not match the database; rebuilding")
+                return None
+            cache = snapshot.load()
+    except (OSError, ValueError, KeyError, pickle.UnpicklingError) as e:
+        print(f"[content-service] Could not read index snapshot: {e}")
+        return None
+    cache.generation = next(_generations)
+    cache.snapshot_version = cache.version
+    while len(cache) > MAX_CACHE_SIZE:  # MAX_CACHE_SIZE may have been lowered since
+        evicted_id, _ = cache.popitem(last=False)
+        cache.index.remove(evicted_id)
+    print(f"[content-service] Loaded index snapshot of {len(cache)} documents at version {cache.version} "
+          f"in {(time.perf_counter() - started) * 1000:.0f}ms")
+    return cache
+
 
 def get_cached_content(force_refresh=False):
     """
     Retrieves indexed content from the database, caching the results in memory.
-    Implements an LRU cache bounded by MAX_CACHE_SIZE.
+    Implements an LRU cache bounded by MAX_CACHE_SIZE, kept coherent across
+    workers by replaying the content_changes log.
     """
     global _content_cache
-    if _content_cache is None or force_refresh:
-        db = get_session()
-        try:
-            # Query up to MAX_CACHE_SIZE newest items
-            rows = db.query(DBContent).filter(DBContent.is_indexed == 1).order_by(DBContent.created_at.desc()).limit(MAX_CACHE_SIZE).all()
-            
-            new_cache = OrderedDict()
-            # Iterate in reverse to insert oldest first, so newest are most recently used
-            for row in reversed(rows):
-                try:
-                    metadata_dict = json.loads(row.metadata_json) if row.metadata_json else {}
-                except json.JSONDecodeError:
-                    metadata_dict = {}
-                    
-                new_cache[row.id] = {
-                    "id": row.id,
-                    "title": row.title,
-                    "body": row.body,
-                    "content_type": row.content_type,
-                    "metadata": metadata_dict,
-                }
-            _content_cache = new_cache
-        finally:
-            db.close()
-        
-    return _content_cache
+    with cache_lock:
+        cache = _content_cache
+        if not force_refresh:
+            if cache is None:
+                # Cold start: the snapshot plus the changes made since it was written
+                cache = _load_snapshot()
+                fresh = cache is not None and _sync_cache(cache)
+            else:
+                fresh = time.monotonic() - cache.checked_at < CACHE_SYNC_SECONDS or _sync_cache(cache)
+            if fresh:
+                _content_cache = cache
+                if SNAPSHOT_PATH and cache.version - (cache.snapshot_version or 0) >= SNAPSHOT_REFRESH_CHANGES:
+                    _save_snapshot(cache)
+                return cache
+        _content_cache = _load_cache()
+        _save_snapshot(_content_cache)
+        return _content_cache
@@ -0,0 +1,21 @@
+import hashlib
+import re
+import unicodedata
+
+# What an upload does with an item whose content hash is already stored:
+# "skip" keeps the existing row, "upsert" overwrites its fields (same id)
+DUPLICATE_MODES = ("skip", "upsert")
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize(text: str | None) -> str:
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFC", text or "")).strip().casefold()
+
+
+def content_hash(title: str | None, body: str | None) -> str:
+    """Identity of a content item for deduplication: its title and body,
+    ignoring case, Unicode normalization form and whitespace. Type and
+    metadata are not part of it, so a re-import with new metadata is an
+    update of the same item."""
+    return hashlib.sha256(f"{normalize(title)}\0{normalize(body)}".encode()).hexdigest()
@@ -19,3 +19,11 @@ class UploadFailedException(HTTPException):
 class FileUploadFailedException(HTTPException):
     def __init__(self, detail: str):
         super().__init__(status_code=500, detail=f"File upload failed: {detail}")
+
+class ContentNotFoundException(HTTPException):
+    def __init__(self, detail: str = "Content not found"):
+        super().__init__(status_code=404, detail=detail)
+
+class InvalidListParamsException(HTTPException):
+    def __init__(self, detail: str):
+        super().__init__(status_code=400, detail=detail)
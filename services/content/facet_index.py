@@ -0,0 +1,139 @@
+from collections import defaultdict
+
+FACETS = ("content_type", "module", "week", "tags")
+
+# (facet, value) -> itself: every document with a value shares one key tuple
+_KEYS = {}
+
+
+def facet_values(doc) -> tuple[tuple[str, str], ...]:
+    """Interned (facet, value) pairs of a cached content item; values compared as strings."""
+    metadata = doc.get("metadata") or {}
+    pairs = []
+    if doc.get("content_type"):
+        pairs.append(("content_type", str(doc["content_type"])))
+    for facet in ("module", "week"):
+        if metadata.get(facet) is not None:
+            pairs.append((facet, str(metadata[facet])))
+    tags = metadata.get("tags") or []
+    if not isinstance(tags, list):
+        tags = [tags]
+    pairs.extend(("tags", tag) for tag in dict.fromkeys(str(t) for t in tags))
+    return tuple(_KEYS.setdefault(pair, pair) for pair in pairs)
+
+
+def build_filters(content_type=None, module=None, week=None, tags=None) -> dict[str, list[str]]:
+    """Request parameters -> {facet: [values]}, leaving out the unset ones."""
+    filters = {}
+    for facet, value in (("content_type", content_type), ("module", module), ("week", week)):
+        if value is not None:
+            filters[facet] = [str(value)]
+    if tags:
+        filters["tags"] = [str(tag) for tag in tags]
+    return filters
+
+
+def mask_of(ordinals) -> int:
+    """Bitset of the given ordinals, built in a bytearray (OR-ing into an int
+    one bit at a time would copy the whole int every time)."""
+    ordinals = list(ordinals)
+    if not ordinals:
+        return 0
+    bits = bytearray(max(ordinals) // 8 + 1)
+    for ordinal in ordinals:
+        bits[ordinal >> 3] |= 1 << (ordinal & 7)
+    return int.from_bytes(bits, "little")
+
+
+def ordinals_of(mask: int):
+    """Ordinals set in a bitset, ascending."""
+    data = mask.to_bytes((mask.bit_length() + 7) // 8, "little")
+    for i, byte in enumerate(data):
+        while byte:
+            low = byte & -byte
+            yield i * 8 + low.bit_length() - 1
+            byte ^= low
+
+
+class FacetIndex:
+    """Per-value bitmap indexes over content_type, module, week and tags.
+
+    Documents are identified by small-int ordinals (handed out by
+    SearchIndex), so each (facet, value) is one Python int used as a
+    compressed bitset. A filter is a few ANDs and a count is a bit_count(),
+    with no per-row JSON parsing. Bitsets are built on first use and then
+    patched in place, so bulk loads don't pay an int copy per document."""
+
+    def __init__(self):
+        self._members = defaultdict(set)  # (facet, value) -> ordinals
+        self._values = {}  # ordinal -> ((facet, value), ...), for removal
+        self._bitmaps = {}  # (facet, value) -> bitset, built lazily
+        self._live = None  # bitset of every indexed ordinal, built lazily
+
+    def add(self, ordinal: int, doc: dict):
+        if ordinal in self._values:
+            self.remove(ordinal)
+        bit = 1 << ordinal
+        pairs = facet_values(doc)
+        for key in pairs:
+            self._members[key].add(ordinal)
+            if key in self._bitmaps:
+                self._bitmaps[key] |= bit
+        self._values[ordinal] = pairs
+        if self._live is not None:
+            self._live |= bit
+
+    def remove(self, ordinal: int):
+        pairs = self._values.pop(ordinal, None)
+        if pairs is None:
+            return
+        bit = ~(1 << ordinal)
+        for key in pairs:
+            members = self._members[key]
+            members.discard(ordinal)
+            if not members:
+                del self._members[key]
+                self._bitmaps.pop(key, None)
+            elif key in self._bitmaps:
+                self._bitmaps[key] &= bit
+        if self._live is not None:
+            self._live &= bit
+
+    def clear(self):
+        self._members.clear()
+        self._values.clear()
+        self._bitmaps.clear()
+        self._live = None
+
+    @property
+    def live(self) -> int:
+        if self._live is None:
+            self._live = mask_of(self._values)
+        return self._live
+
+    def bitmap(self, facet: str, value) -> int:
+        key = (facet, str(value))
+        bitmap = self._bitmaps.get(key)
+        if bitmap is None:
+            members = self._members.get(key)
+            if not members:
+                return 0
+            bitmap = self._bitmaps[key] = mask_of(members)
+        return bitmap
+
+    def mask(self, filters: dict[str, list[str]] | None) -> int:
+        """Documents matching every filter value: AND within and across facets."""
+        mask = self.live
+        for facet, values in (filters or {}).items():
+            for value in values:
+                mask &= self.bitmap(facet, value)
+        return mask
+
+    def counts(self, mask: int) -> dict[str, dict[str, int]]:
+        """{facet: {value: documents in mask}}, zero counts left out."""
+        counts = {facet: {} for facet in FACETS}
+        for facet, value in self._members:
+            count = (self.bitmap(facet, value) & mask).bit_count()
+            if count:
+                counts[facet][value] = count
+        return counts
@@ -0,0 +1,148 @@
+import json
+
+from sqlalchemy import text
+
+from search_index import tokenize
+
+# Standalone FTS5 table (it keeps its own copy of the text, so snippet() and
+# highlight() work on the tags pulled out of the metadata JSON too). Triggers
+# on `content` keep it in sync, so every write path is covered and the index
+# survives restarts. Only exists while the fts5 backend is in use: the copy
+# and the per-write indexing are not paid for otherwise.
+FTS_TABLE = "content_fts"
+# content.id -> FTS rowid. `content` has a TEXT primary key, so its implicit
+# rowid can change on VACUUM and cannot link the two tables; an UNINDEXED
+# FTS column can only be searched by scanning the whole table.
+FTS_KEYS_TABLE = "content_fts_keys"
+# bm25() column weights: id (unindexed), title, body, tags
+FTS_WEIGHTS = (0.0, 10.0, 1.0, 5.0)
+SNIPPET_TOKENS = 24
+
+_TAGS = "CASE WHEN json_valid({row}.metadata) THEN json_extract({row}.metadata, '$.tags') END"
+_TRIGGERS = ("content_fts_insert", "content_fts_delete", "content_fts_update")
+
+_INDEX_NEW = (
+    f"INSERT INTO {FTS_KEYS_TABLE} (id) SELECT new.id WHERE new.is_indexed = 1; "
+    f"INSERT INTO {FTS_TABLE} (rowid, id, title, body, tags) "
+    f"SELECT fts_rowid, new.id, new.title, new.body, {_TAGS.format(row='new')} "
+    f"FROM {FTS_KEYS_TABLE} WHERE id = new.id AND new.is_indexed = 1; "
+)
+_UNINDEX_OLD = (
+    f"DELETE FROM {FTS_TABLE} WHERE rowid = (SELECT fts_rowid FROM {FTS_KEYS_TABLE} WHERE id = old.id); "
+    f"DELETE FROM {FTS_KEYS_TABLE} WHERE id = old.id; "
+)
+
+_DDL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "id UNINDEXED, title, body, tags, tokenize = 'unicode61 remove_diacritics 2')",
+    f"CREATE TABLE IF NOT EXISTS {FTS_KEYS_TABLE} (fts_rowid INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE)",
+    f"CREATE TRIGGER IF NOT EXISTS content_fts_insert AFTER INSERT ON content BEGIN {_INDEX_NEW}END",
+    f"CREATE TRIGGER IF NOT EXISTS content_fts_delete AFTER DELETE ON content BEGIN {_UNINDEX_OLD}END",
+    f"CREATE TRIGGER IF NOT EXISTS content_fts_update AFTER UPDATE ON content BEGIN {_UNINDEX_OLD}{_INDEX_NEW}END",
+]
+
+_BACKFILL = [
+    f"INSERT INTO {FTS_KEYS_TABLE} (id) SELECT id FROM content WHERE is_indexed = 1",
+    f"INSERT INTO {FTS_TABLE} (rowid, id, title, body, tags) "
+    f"SELECT k.fts_rowid, c.id, c.title, c.body, {_TAGS.format(row='c')} "
+    f"FROM {FTS_KEYS_TABLE} k JOIN content c ON c.id = k.id",
+]
+
+
+def _tables(conn) -> set[str]:
+    rows = conn.exec_driver_sql(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name IN (?, ?)", (FTS_TABLE, FTS_KEYS_TABLE)
+    )
+    return {name for (name,) in rows}
+
+
+def init_fts(engine):
+    """Create the FTS table and triggers; backfill once if the table is new.
+    A table from before FTS_KEYS_TABLE (linked to content by rowid) is rebuilt."""
+    with engine.begin() as conn:
+        tables = _tables(conn)
+        if tables and FTS_KEYS_TABLE not in tables:
+            _drop(conn)
+            tables = set()
+        for statement in _DDL:
+            conn.exec_driver_sql(statement)
+        if not tables:
+            for statement in _BACKFILL:
+                conn.exec_driver_sql(statement)
+
+
+def _drop(conn):
+    for trigger in _TRIGGERS:
+        conn.exec_driver_sql(f"DROP TRIGGER IF EXISTS {trigger}")
+    conn.exec_driver_sql(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    conn.exec_driver_sql(f"DROP TABLE IF EXISTS {FTS_KEYS_TABLE}")
+
+
+def drop_fts(engine):
+    """Remove the FTS tables and their triggers; init_fts() rebuilds them from `content`."""
+    with engine.begin() as conn:
+        if _tables(conn):
+            _drop(conn)
+
+
+def match_expression(query: str) -> str | None:
+    """Free text -> FTS5 query: every token quoted (so user input can't be
+    FTS syntax) and OR-ed, matching the in-memory index's semantics."""
+    terms = dict.fromkeys(tokenize(query))
+    if not terms:
+        return None
+    return " OR ".join(f'"{term}"' for term in terms)
+
+
+# json_each/json_extract raise on malformed JSON; such rows just have no facets
+_METADATA = "(CASE WHEN json_valid(c.metadata) THEN c.metadata END)"
+
+
+def filter_clauses(filters: dict | None) -> tuple[str, dict]:
+    """Facet filters ({facet: [values]}) as SQL over the joined `content c` row."""
+    clauses, params = [], {}
+    for facet, values in (filters or {}).items():
+        for i, value in enumerate(values):
+            name = f"{facet}_{i}"
+            params[name] = str(value)
+            if facet == "content_type":
+                clauses.append(f"c.content_type = :{name}")
+            elif facet == "tags":
+                clauses.append(f"EXISTS (SELECT 1 FROM json_each({_METADATA}, '$.tags') WHERE value = :{name})")
+            else:
+                clauses.append(f"CAST(json_extract({_METADATA}, '$.{facet}') AS TEXT) = :{name}")
+    return "".join(f" AND {clause}" for clause in clauses), params
+
+
+def search(db, query: str, limit: int | None, filters: dict | None = None) -> tuple[list[dict], int]:
+    """Returns ([result dict] best first, total matches) straight from SQLite."""
+    expression = match_expression(query)
+    if expression is None:
+        return [], 0
+    where, params = filter_clauses(filters)
+    params["q"] = expression
+    total = db.execute(
+        text(f"SELECT count(*) FROM {FTS_TABLE} JOIN content c ON c.id = {FTS_TABLE}.id "
+             f"WHERE {FTS_TABLE} MATCH :q{where}"),
+        params,
+    ).scalar()
+    weights = ", ".join(str(w) for w in FTS_WEIGHTS)
+    rows = db.execute(
+        text(
+            f"SELECT {FTS_TABLE}.id, c.title, c.body, c.content_type, c.metadata, -bm25({FTS_TABLE}, {weights}) AS score, "
+            f"highlight({FTS_TABLE}, 1, '<mark>', '</mark>') AS title_highlight, "
+            f"snippet({FTS_TABLE}, 2, '<mark>', '</mark>', '…', {SNIPPET_TOKENS}) AS snippet "
+            f"FROM {FTS_TABLE} JOIN content c ON c.id = {FTS_TABLE}.id "
+            f"WHERE {FTS_TABLE} MATCH :q{where} ORDER BY bm25({FTS_TABLE}, {weights}) LIMIT :limit"
+        ),
+        {**params, "limit": -1 if limit is None else limit},
+    ).mappings().all()
+
+    results = []
+    for row in rows:
+        try:
+            metadata = json.loads(row["metadata"]) if row["metadata"] else {}
+        except json.JSONDecodeError:
+            metadata = {}
+        results.append({**row, "metadata": metadata})
+    return results, total
@@ -0,0 +1,88 @@
+import hashlib
+import hmac
+import json
+import mmap
+import os
+import pickle
+import struct
+import tempfile
+
+# Bump whenever the pickled layout of ContentCache, CachedDoc, SearchIndex,
+# FacetIndex, TrigramIndex or SimilarityIndex changes; snapshots of other
+# formats are ignored
+SNAPSHOT_FORMAT = 4
+
+_MAGIC = b"CIDX"
+_PREFIX = struct.Struct("<4sII")  # magic, format, length of the JSON metadata that follows the header
+_HEADER = struct.Struct("<4sII32s")  # the prefix plus an HMAC-SHA256 of prefix, metadata and payload
+
+
+def _mac(key: bytes, prefix: bytes, meta_bytes, payload) -> bytes:
+    mac = hmac.new(key, prefix, hashlib.sha256)
+    mac.update(meta_bytes)
+    mac.update(payload)
+    return mac.digest()
+
+
+def save(cache, path: str, meta: dict, key: bytes):
+    """Write `cache` (documents plus their indexes) to `path` atomically:
+    readers see the old snapshot or the new one, never a partial file.
+
+    The payload is a pickle, and unpickling can run code, so the file is
+    signed with `key` and IndexSnapshot.load() refuses anything not signed
+    with the same key."""
+    payload = pickle.dumps(cache, protocol=pickle.HIGHEST_PROTOCOL)
+    meta_bytes = json.dumps(meta).encode()
+    prefix = _PREFIX.pack(_MAGIC, SNAPSHOT_FORMAT, len(meta_bytes))
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=".index-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, SNAPSHOT_FORMAT, len(meta_bytes), _mac(key, prefix, meta_bytes, payload)))
+            f.write(meta_bytes)
+            f.write(payload)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+class IndexSnapshot:
+    """A snapshot file, memory-mapped. `meta` (plain JSON) is readable
+    straight away, so a snapshot can be validated before paying for
+    `load()`, which checks the signature and then unpickles from the mapping
+    without reading the file into a separate buffer."""
+
+    def __init__(self, path: str, key: bytes):
+        self._key = key
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if len(self._mm) < _HEADER.size:
+                raise ValueError("Index snapshot is truncated")
+            magic, version, meta_length, self._signature = _HEADER.unpack_from(self._mm, 0)
+            if magic != _MAGIC or version != SNAPSHOT_FORMAT:
+                raise ValueError(f"Unsupported index snapshot format {version}")
+            self._offset = _HEADER.size + meta_length
+            if len(self._mm) < self._offset:
+                raise ValueError("Index snapshot is truncated")
+            self.meta = json.loads(self._mm[_HEADER.size:self._offset])
+        except Exception:
+            self._mm.close()
+            raise
+
+    def load(self):
+        with memoryview(self._mm) as view, view[_HEADER.size:self._offset] as meta, view[self._offset:] as payload:
+            prefix = _PREFIX.pack(_MAGIC, SNAPSHOT_FORMAT, len(meta))
+            if not hmac.compare_digest(_mac(self._key, prefix, meta, payload), self._signature):
+                raise ValueError("Index snapshot signature does not match CONTENT_SNAPSHOT_KEY")
+            return pickle.loads(payload)
+
+    def close(self):
+        self._mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,328 @@
+import codecs
+import json
+import os
+import uuid
+from datetime import datetime, timezone
+
+from pydantic import ValidationError
+from sqlalchemy import insert, update
+from sqlalchemy.exc import IntegrityError
+
+from database import DBContent, existing_by_hash, get_session, run_db, update_item_in_cache
+from dedup import content_hash
+from models import ContentUpload
+
+INGEST_CHUNK_ROWS = int(os.getenv("INGEST_CHUNK_ROWS", 500))
+INGEST_READ_BYTES = int(os.getenv("INGEST_READ_BYTES", 64 * 1024))
+# Largest single item the parser will buffer while waiting for it to complete
+INGEST_MAX_ITEM_BYTES = int(os.getenv("INGEST_MAX_ITEM_BYTES", 16 * 1024 * 1024))
+# Reports stay bounded however large the file is
+MAX_REPORTED_ERRORS = 100
+MAX_REPORTED_IDS = 1000
+
+_WHITESPACE = " \t\r\n"
+
+
+class FileReadError(Exception):
+    """Reading the upload failed, as opposed to storing what was read."""
+
+
+class JSONItemStream:
+    """Incremental parser for uploads that are a JSON array of objects, NDJSON,
+    or a single object.
+
+    `feed()` takes raw bytes as they are read and returns the items that are
+    complete so far as (index, item, error) triples; only the unparsed tail
+    is kept. Objects outside an array may span lines (a pretty-printed
+    file) until one has parsed on a single line; from then on the input is
+    NDJSON and an unparseable line is a per-item error, with parsing resumed
+    on the next line. Inside an array, or in a value spanning lines, there
+    is no safe place to resume, so a syntax error there stops the stream and
+    sets `error`."""
+
+    def __init__(self, max_item_bytes: int = INGEST_MAX_ITEM_BYTES):
+        self.max_item_bytes = max_item_bytes
+        self.error = None
+        self.index = 0
+        self._decoder = json.JSONDecoder()
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._mode = None  # "array" or "lines", from the first character
+        self._ndjson = False  # a "lines" item has parsed on one line
+        self._expect_item = True
+        self._closed = False
+
+    def _item(self, out, item=None, error=None):
+        out.append((self.index, item, error))
+        self.index += 1
+
+    def _fail(self, message: str):
+        self.error = message
+
+    def feed(self, data: bytes, final: bool = False) -> list[tuple[int, object, str | None]]:
+        out = []
+        if self.error:
+            return out
+        try:
+            buf = self._buffer + self._utf8.decode(data, final)
+        except UnicodeDecodeError as e:
+            self._fail(f"File is not valid UTF-8: {e.reason}")
+            return out
+        pos, n = 0, len(buf)
+        while True:
+            while pos < n and buf[pos] in _WHITESPACE:
+                pos += 1
+            if pos >= n:
+                break
+            if self._mode is None:
+                if buf[pos] == "[":
+                    self._mode = "array"
+                    pos += 1
+                    continue
+                if buf[pos] != "{":
+                    self._fail("Expected a JSON array, a JSON object or NDJSON")
+                    return out
+                self._mode = "lines"
+
+            if self._mode == "array":
+                char = buf[pos]
+                if self._closed:
+                    self._fail("Unexpected data after the closing ']'")
+                    return out
+                if char == "]" or char == ",":
+                    if self._expect_item and (char == "," or self.index):
+                        self._fail(f"Expected an item at position {self.index}")
+                        return out
+                    self._closed = char == "]"
+                    self._expect_item = char == ","
+                    pos += 1
+                    continue
+                if not self._expect_item:
+                    self._fail(f"Expected ',' or ']' after item {self.index - 1}")
+                    return out
+                try:
+                    item, pos = self._decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError as e:
+                    if final:
+                        self._fail(f"Item {self.index}: {e.msg}")
+                        return out
+                    if n - pos > self.max_item_bytes:
+                        self._fail(f"Item {self.index} is larger than {self.max_item_bytes} bytes")
+                        return out
+                    break  # incomplete; wait for more data
+                self._expect_item = False
+                self._item(out, item)
+            else:
+                try:
+                    item, end = self._decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError as e:
+                    newline = buf.find("\n", pos)
+                    # An error on the last, unterminated line, or in a string that runs
+                    # to the end of the buffer, may only mean the value is cut off
+                    truncated = buf.find("\n", e.pos) == -1 or e.msg.startswith("Unterminated string")
+                    if truncated and not final:
+                        if n - pos > self.max_item_bytes:
+                            self._fail(f"Item {self.index} is larger than {self.max_item_bytes} bytes")
+                            return out
+                        break  # incomplete; wait for more data
+                    if not self._ndjson and newline != -1 and newline < e.pos:
+                        # A value spanning lines before any line parsed alone: not NDJSON,
+                        # so there is no line to resume on
+                        self._fail(f"Item {self.index}: {e.msg}")
+                        return out
+                    self._item(out, error=f"Invalid JSON: {e.msg}")
+                    pos = n if newline == -1 else newline + 1
+                    continue
+                if not self._ndjson and buf.find("\n", pos, end) == -1:
+                    self._ndjson = True
+                pos = end
+                self._item(out, item)
+
+        self._buffer = buf[pos:]
+        if final:
+            if self._mode is None:
+                self._fail("File is empty")
+            elif self._mode == "array" and not self._closed:
+                self._fail("Truncated JSON array")
+        return out
+
+
+def validate_item(item) -> tuple[ContentUpload | None, str | None]:
+    if not isinstance(item, dict):
+        return None, "Item is not a JSON object"
+    if not item.get("title") or not item.get("body"):
+        return None, "Item needs a non-empty title and body"
+    try:
+        return ContentUpload(**item), None
+    except ValidationError as e:
+        return None, "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+
+
+class Ingestor:
+    """Streams an uploaded file into `content` in bounded chunks.
+
+    The file is read INGEST_READ_BYTES at a time and parsed incrementally;
+    every INGEST_CHUNK_ROWS valid items are written with one Core
+    executemany and committed, then pushed into the search cache. Memory is
+    bounded by one chunk plus the largest item, and no write transaction
+    spans the whole file.
+
+    Duplicates (see dedup.content_hash) are found with one IN lookup per
+    chunk; repeats within a chunk are resolved in memory. With
+    on_duplicate="upsert" they become one executemany UPDATE by id."""
+
+    def __init__(self, user_id: str, chunk_rows: int | None = None, read_bytes: int | None = None,
+                 on_duplicate: str = "skip"):
+        self.user_id = user_id
+        self.on_duplicate = on_duplicate
+        self.chunk_rows = chunk_rows or INGEST_CHUNK_ROWS
+        self.read_bytes = read_bytes or INGEST_READ_BYTES
+        self.inserted = 0
+        self.failed = 0
+        self.chunks = 0
+        self.bytes_read = 0
+        self.errors = []
+        self.content_ids = []
+        self.duplicates = 0
+        self.updated = 0
+        self.deduplicated = []
+        self.fatal = None
+
+    def record_error(self, index, message: str):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"index": index, "error": message})
+
+    def row(self, content: ContentUpload) -> dict:
+        """A validated item as a `content` row, ready for write_chunk()."""
+        return {
+            "id": str(uuid.uuid4()),
+            "title": content.title,
+            "body": content.body,
+            "content_type": content.content_type or "lesson",
+            "metadata_json": json.dumps(content.metadata) if content.metadata else None,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "uploaded_by": self.user_id,
+            "is_indexed": 1,
+            "content_hash": content_hash(content.title, content.body),
+        }
+
+    def _plan_chunk(self, db, rows: list[tuple[int, dict]]):
+        """Split a chunk into rows to insert, updates by id and (index, id)
+        duplicates, with a single lookup for the whole chunk."""
+        stored = existing_by_hash(db, {row["content_hash"] for _, row in rows})
+        inserts, updates, duplicates = {}, {}, []
+        now = datetime.now(timezone.utc).isoformat()
+        for index, row in rows:
+            digest = row["content_hash"]
+            content_id = stored.get(digest)
+            if content_id is None and digest not in inserts:
+                inserts[digest] = row
+                continue
+            if content_id is None:  # repeated within this chunk: the later copy wins on upsert
+                target = inserts[digest]
+                content_id = target["id"]
+            else:
+                target = updates.setdefault(content_id, {"id": content_id, "updated_at": now})
+            if self.on_duplicate == "upsert":
+                target.update({key: row[key] for key in ("title", "body", "content_type", "metadata_json")})
+            duplicates.append((index, content_id))
+        return list(inserts.values()), list(updates.values()) if self.on_duplicate == "upsert" else [], duplicates
+
+    def write_chunk(self, db, rows: list[tuple[object, dict]]):
+        """Insert, skip or update one chunk of (index, row) pairs and commit.
+        `index` is only used to label errors and duplicates in the report."""
+        for attempt in range(2):
+            try:
+                inserts, updates, duplicates = self._plan_chunk(db, rows)
+                if inserts:
+                    db.execute(insert(DBContent), inserts)
+                if updates:
+                    db.execute(update(DBContent), updates)
+                db.commit()
+                break
+            except IntegrityError as e:
+                # Another upload stored some of this content after our lookup; look again once
+                db.rollback()
+                if attempt:
+                    self._chunk_failed(rows, e)
+                    return
+            except Exception as e:
+                db.rollback()
+                self._chunk_failed(rows, e)
+                return
+        self.chunks += 1
+        self.inserted += len(inserts)
+        for row in inserts:
+            if len(self.content_ids) < MAX_REPORTED_IDS:
+                self.content_ids.append(row["id"])
+        action = "updated" if self.on_duplicate == "upsert" else "skipped"
+        self.duplicates += len(duplicates)
+        for index, content_id in duplicates:
+            if len(self.deduplicated) < MAX_REPORTED_ERRORS:
+                self.deduplicated.append({"index": index, "content_id": content_id, "action": action})
+        self.updated += len(updates)
+        for row in inserts + updates:
+            update_item_in_cache({
+                "id": row["id"],
+                "title": row["title"],
+                "body": row["body"],
+                "content_type": row["content_type"],
+                "metadata": json.loads(row["metadata_json"]) if row["metadata_json"] else {},
+            })
+        print(f"[content-service] Ingest chunk {self.chunks}: {self.inserted} inserted, "
+              f"{self.duplicates} duplicates, {self.failed} failed, {self.bytes_read} bytes read")
+
+    def _chunk_failed(self, rows: list[tuple[int, dict]], error: Exception):
+        for index, _ in rows:
+            self.record_error(index, f"Insert failed: {error}")
+
+    async def run(self, file):
+        """Ingest an UploadFile (or anything with an async read(size))."""
+        parser = JSONItemStream()
+        pending = []
+        db = get_session()
+        try:
+            while True:
+                try:
+                    data = await file.read(self.read_bytes)
+                except Exception as e:
+                    raise FileReadError(str(e)) from e
+                self.bytes_read += len(data)
+                for index, item, error in parser.feed(data, final=not data):
+                    if error is None:
+                        content, error = validate_item(item)
+                    if error is not None:
+                        self.record_error(index, error)
+                        continue
+                    pending.append((index, self.row(content)))
+                    if len(pending) >= self.chunk_rows:
+                        await run_db(self.write_chunk, db, pending)
+                        pending = []
+                if not data or parser.error:
+                    break
+            if pending:
+                await run_db(self.write_chunk, db, pending)
+        finally:
+            db.close()
+        self.fatal = parser.error
+        return self
+
+    def summary(self) -> dict:
+        status = "indexed" if not (self.fatal or self.failed) else ("partial" if self.inserted else "failed")
+        message = f"Successfully uploaded {self.inserted} content items"
+        if self.fatal:
+            message += f"; stopped early: {self.fatal}"
+        return {
+            "message": message,
+            "count": self.inserted,
+            "content_ids": self.content_ids,
+            "status": status,
+            "failed": self.failed,
+            "errors": self.errors,
+            "chunks": self.chunks,
+            "bytes_read": self.bytes_read,
+            "duplicates": self.duplicates,
+            "updated": self.updated,
+            "deduplicated": self.deduplicated,
+        }
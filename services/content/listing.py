@@ -0,0 +1,98 @@
+import base64
+import json
+
+from sqlalchemy import func, select, tuple_
+
+from cached_doc import PREVIEW_CHARS, preview
+from database import DBContent, get_session
+
+LIST_FIELDS = ("id", "title", "body", "content_type", "metadata", "created_at")
+STREAM_BATCH_ROWS = 500
+
+_COLUMNS = {
+    "id": DBContent.id,
+    "title": DBContent.title,
+    # One character past the preview is enough to know whether to add "..."
+    "body": func.substr(DBContent.body, 1, PREVIEW_CHARS + 1).label("body"),
+    "content_type": DBContent.content_type,
+    "metadata": DBContent.metadata_json.label("metadata"),
+    "created_at": DBContent.created_at,
+}
+
+
+def safe_json_loads(data: str) -> dict:
+    if not data:
+        return {}
+    try:
+        return json.loads(data)
+    except json.JSONDecodeError:
+        return {}
+
+
+def parse_fields(fields: str | None) -> tuple[str, ...]:
+    """`fields=title,body` -> ("id", "title", "body"); id is always included.
+    Raises ValueError on unknown names."""
+    if not fields:
+        return LIST_FIELDS
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in requested if f not in LIST_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return tuple(f for f in LIST_FIELDS if f == "id" or f in requested)
+
+
+def encode_cursor(created_at: str, content_id: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([created_at, content_id]).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[str, str]:
+    """Raises ValueError if the cursor wasn't produced by encode_cursor()."""
+    try:
+        created_at, content_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+    return created_at, content_id
+
+
+def build_listing_query(fields, limit: int | None = None, cursor: str | None = None, ids=None):
+    """Newest-first keyset query on (created_at, id), selecting only the
+    projected columns; served by ix_content_created_at_id."""
+    columns = [_COLUMNS[f] for f in fields]
+    if "created_at" not in fields:
+        columns.append(_COLUMNS["created_at"])  # needed for the next cursor
+    query = select(*columns).order_by(DBContent.created_at.desc(), DBContent.id.desc())
+    if cursor:
+        query = query.where(tuple_(DBContent.created_at, DBContent.id) < tuple_(*decode_cursor(cursor)))
+    if ids is not None:
+        query = query.where(DBContent.id.in_(ids))
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+
+def list_item(row, fields) -> dict:
+    """A listing row as the projected response dict."""
+    item = {}
+    for field in fields:
+        value = row._mapping[field]
+        if field == "body" and value:
+            value = preview(value)
+        elif field == "metadata":
+            value = safe_json_loads(value)
+        item[field] = value
+    return item
+
+
+def iter_ndjson(fields, limit: int | None = None, cursor: str | None = None, ids=None,
+                batch_rows: int = STREAM_BATCH_ROWS):
+    """Yield the listing as NDJSON bytes, one batch of rows at a time.
+
+    Uses its own session: the request's is closed before a streaming body
+    is sent."""
+    db = get_session()
+    try:
+        result = db.execute(build_listing_query(fields, limit, cursor, ids).execution_options(yield_per=batch_rows))
+        for rows in result.partitions():
+            yield "".join(json.dumps(list_item(row, fields), ensure_ascii=False) + "\n" for row in rows).encode()
+    finally:
+        db.close()
@@ -6,30 +6,46 @@ Port: 8003"""
 import json
 import os
 import uuid
+from datetime import datetime, timezone
+from typing import Literal
 
-from fastapi import FastAPI, HTTPException, Header, UploadFile, File, Depends
+from fastapi import FastAPI, HTTPException, Header, UploadFile, File, Depends, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
 from models import (
     ContentUpload, ContentSearch,
     UploadResponse, UploadFileResponse, SearchResponse, SearchResultItem,
-    ListContentResponse, ContentItem, ListInternalContentResponse, InternalContentItem, HealthResponse
+    SuggestResponse, SuggestTitle, RelatedResponse, ListContentResponse, ContentItem, ListInternalContentResponse, HealthResponse
 )
-from database import init_db, get_db, DBContent, update_item_in_cache, get_cached_content
+from database import (
+    init_db, get_db, run_db, cache_lock, DBContent, update_item_in_cache, get_cached_content, existing_by_hash,
+    cache_item,
+)
+import database
+import fts_search
+import snapshot
+from cached_doc import preview
+from dedup import DUPLICATE_MODES, content_hash
+from facet_index import build_filters, ordinals_of
+from search_index import mark_terms
+from ingest import FileReadError, Ingestor
+from result_cache import ResultCache, query_key
+from listing import build_listing_query, decode_cursor, encode_cursor, iter_ndjson, list_item, parse_fields
 from exceptions import (
-    AuthException, InvalidFileException, FileReadException,
-    UploadFailedException, FileUploadFailedException
+    AuthException, InvalidFileException, FileReadException, ContentNotFoundException,
+    UploadFailedException, FileUploadFailedException, InvalidListParamsException
 )
 from dependencies import require_user_id
 
-def safe_json_loads(data: str) -> dict:
-    if not data:
-        return {}
-    try:
-        return json.loads(data)
-    except json.JSONDecodeError:
-        return {}
+LIST_DEFAULT_LIMIT = 50
+LIST_MAX_LIMIT = 1000
+
+# Search results of the in-memory index, valid for one cache generation
+_result_cache = ResultCache()
 
 # ── App ───────────────────────────────────────────────────────────────────────
 from contextlib import asynccontextmanager
@@ -37,6 +53,9 @@ from contextlib import asynccontextmanager
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     init_db()
+    if database.SEARCH_BACKEND != "fts5":
+        # Warm the search cache (from the index snapshot when there is one) before taking traffic
+        await run_db(get_cached_content)
     print("[content-service] Started on port 8003")
     yield
 
@@ -56,112 +75,94 @@ app.add_middleware(
 @app.post("/content/upload", response_model=UploadResponse)
 async def upload_content(
     content: ContentUpload,
+    on_duplicate: Literal[DUPLICATE_MODES] = Query("skip"),
     x_user_id: str = Depends(require_user_id),
     db: Session = Depends(get_db),
 ):
-
-    content_id = str(uuid.uuid4())
-    metadata_str = json.dumps(content.metadata) if content.metadata else None
-
+    """Same title and body (ignoring case and whitespace) as a stored item
+    is a duplicate: `on_duplicate=skip` returns the stored item's id,
+    `on_duplicate=upsert` overwrites it in place."""
     try:
-        new_content = DBContent(
-            id=content_id,
-            title=content.title,
-            body=content.body,
-            content_type=content.content_type,
-            metadata_json=metadata_str,
-            uploaded_by=x_user_id,
-            is_indexed=1
-        )
-        db.add(new_content)
-        db.commit()
-        
-        # Write-through cache: Update the cache gracefully without wiping it
-        cached_item = {
-            "id": content_id,
-            "title": content.title,
-            "body": content.body,
-            "content_type": content.content_type,
-            "metadata": content.metadata or {},
-        }
-        update_item_in_cache(cached_item)
-        
+        content_id, status = await run_db(_insert_content, db, content, x_user_id, on_duplicate)
     except Exception as e:
-        db.rollback()
+        await run_db(db.rollback)
         raise UploadFailedException(str(e))
 
+    messages = {
+        "indexed": "Content uploaded successfully",
+        "duplicate": "Content already exists",
+        "updated": "Existing content updated",
+    }
     return UploadResponse(
-        message="Content uploaded successfully",
+        message=messages[status],
         content_id=content_id,
         title=content.title,
-        status="indexed",
+        status=status,
+        deduplicated=status != "indexed",
     )
 
 
+def _insert_content(db: Session, content: ContentUpload, x_user_id: str, on_duplicate: str,
+                    retry: bool = True) -> tuple[str, str]:
+    """(content id, status) after inserting, skipping or updating."""
+    digest = content_hash(content.title, content.body)
+    fields = {
+        "title": content.title,
+        "body": content.body,
+        "content_type": content.content_type,
+        "metadata_json": json.dumps(content.metadata) if content.metadata else None,
+    }
+    content_id = existing_by_hash(db, [digest]).get(digest)
+    if content_id is not None:
+        if on_duplicate == "skip":
+            return content_id, "duplicate"
+        db.execute(update(DBContent).where(DBContent.id == content_id)
+                   .values(**fields, updated_at=datetime.now(timezone.utc).isoformat()))
+        status = "updated"
+    else:
+        content_id = str(uuid.uuid4())
+        db.add(DBContent(id=content_id, **fields, content_hash=digest, uploaded_by=x_user_id, is_indexed=1))
+        status = "indexed"
+    try:
+        db.commit()
+    except IntegrityError:
+        # Another request stored the same content between our lookup and insert
+        db.rollback()
+        if not retry:
+            raise
+        return _insert_content(db, content, x_user_id, on_duplicate, retry=False)
+
+    # Write-through cache: Update the cache gracefully without wiping it
+    cached_item = {
+        "id": content_id,
+        "title": content.title,
+        "body": content.body,
+        "content_type": content.content_type,
+        "metadata": content.metadata or {},
+    }
+    update_item_in_cache(cached_item)
+    return content_id, status
+
+
 @app.post("/content/upload-file", response_model=UploadFileResponse)
 async def upload_content_file(
     file: UploadFile = File(...),
+    on_duplicate: Literal[DUPLICATE_MODES] = Query("skip"),
     x_user_id: str = Depends(require_user_id),
-    db: Session = Depends(get_db),
 ):
-
+    """Bulk upload from a JSON array, NDJSON or a single JSON object. The
+    file is parsed and inserted in bounded chunks (see ingest.Ingestor), so
+    invalid items are reported rather than failing the whole upload, and
+    items already stored are skipped or updated per `on_duplicate`."""
     try:
-        raw = await file.read()
-        data = json.loads(raw)
-    except json.JSONDecodeError:
-        raise InvalidFileException()
-    except Exception as e:
+        ingestor = await Ingestor(x_user_id, on_duplicate=on_duplicate).run(file)
+    except FileReadError as e:
         raise FileReadException(str(e))
-
-    items = data if isinstance(data, list) else [data]
-    uploaded_ids = []
-    new_cache_items = []
-
-    try:
-        for item in items:
-            if not item.get("title") or not item.get("body"):
-                continue  # skip malformed items, don't blow up the whole batch
-            content_id = str(uuid.uuid4())
-            metadata = item.get("metadata")
-            
-            
-            new_content = DBContent(
-                id=content_id,
-                title=item["title"],
-                body=item["body"],
-                content_type=item.get("content_type", "lesson"),
-                metadata_json=json.dumps(metadata) if metadata else None,
-                uploaded_by=x_user_id,
-                is_indexed=1
-            )
-            db.add(new_content)
-            uploaded_ids.append(content_id)
-            
-            # Prepare for write-through cache update
-            new_cache_items.append({
-                "id": content_id,
-                "title": item["title"],
-                "body": item["body"],
-                "content_type": item.get("content_type", "lesson"),
-                "metadata": metadata or {},
-            })
-            
-        db.commit()
-        
-        # Write-through cache: add all new items to the existing memory cache
-        for cache_item in new_cache_items:
-            update_item_in_cache(cache_item)
-            
     except Exception as e:
-        db.rollback()
         raise FileUploadFailedException(str(e))
-
-    return UploadFileResponse(
-        message=f"Successfully uploaded {len(uploaded_ids)} content items",
-        count=len(uploaded_ids),
-        content_ids=uploaded_ids,
-        status="indexed",
-    )
+    if ingestor.fatal and not ingestor.inserted:
+        raise InvalidFileException(f"Invalid JSON file: {ingestor.fatal}")
+    return UploadFileResponse(**ingestor.summary())
 
 
 @app.post("/content/search", response_model=SearchResponse)
@@ -171,87 +172,229 @@ async def search_content(
     db: Session = Depends(get_db),
 ):
 
-    cached_content = get_cached_content()
-    rows = list(cached_content.values())
+    filters = build_filters(search.content_type, search.module, search.week, search.tags)
+    if database.SEARCH_BACKEND == "fts5":
+        return await run_db(_search_fts, search, filters, db)
+    return await run_db(_search_index, search, filters)
+
+
+def _search_index(search: ContentSearch, filters: dict) -> SearchResponse:
+    with cache_lock:
+        cached_content = get_cached_content()
+        key = query_key(search.query, search.limit, filters)
+        cached = _result_cache.get(key, cached_content.generation) if key is not None else None
+        if cached is not None:
+            results, total, facets = cached
+            # Already validated when first built
+            return SearchResponse.model_construct(
+                results=results, total=total, query=search.query, source="index", facets=facets,
+            )
 
-    query_lower = search.query.lower()
-    query_words = set(query_lower.split())
+        index = cached_content.index
+        hits, total = index.search(search.query, search.limit, filters)
+        terms = index.query_terms(search.query) if hits else []
 
-    results = []
-    for row in rows:
-        title_lower = (row.get("title") or "").lower()
-        body_lower = (row.get("body") or "").lower()
-        metadata = row.get("metadata") or {}
-        tags = metadata.get("tags", [])
-
-        score = 0
-        for word in query_words:
-            if word in title_lower:
-                score += 10
-            if word in body_lower:
-                score += 1
-            if any(word in tag for tag in tags):
-                score += 5
-
-        if score > 0:
-            body = row.get("body") or ""
+        results = []
+        for doc_id, score in hits:
+            doc = cached_content[doc_id]
+            snippet, spans = index.snippet(doc_id, doc.body or "", terms) or (None, None)
             results.append(SearchResultItem(
-                id=row.get("id"),
-                title=row.get("title"),
-                body=body[:200] + "..." if len(body) > 200 else body,
-                content_type=row.get("content_type"),
-                score=score,
-                metadata=metadata,
+                id=doc.id,
+                title=doc.title,
+                body=preview(doc.body),
+                content_type=doc.content_type,
+                score=round(score, 4),
+                metadata=doc.metadata,
+                snippet=snippet,
+                title_highlight=mark_terms(doc.title or "", terms),
+                highlights=spans,
             ))
 
-    results.sort(key=lambda x: x.score, reverse=True)
+        facets = index.facet_counts(search.query, filters)
+        if key is not None:
+            _result_cache.put(key, cached_content.generation, (results, total, facets))
+        return SearchResponse(results=results, total=total, query=search.query, source="index", facets=facets)
 
-    return SearchResponse(
-        results=results[: search.limit],
-        total=len(results),
-        query=search.query,
-        source="cache",
-    )
+
+def _search_fts(search: ContentSearch, filters: dict, db: Session) -> SearchResponse:
+    """Whole-corpus search straight from the FTS5 table; no cache warm-up.
+    Filters become SQL conditions; facet counts need the bitmaps, so none here."""
+    rows, total = fts_search.search(db, search.query, search.limit, filters)
+    results = []
+    for row in rows:
+        results.append(SearchResultItem(
+            id=row["id"],
+            title=row["title"],
+            body=preview(row["body"]),
+            content_type=row["content_type"],
+            score=round(row["score"], 4),
+            metadata=row["metadata"],
+            snippet=row["snippet"],
+            title_highlight=row["title_highlight"],
+        ))
+    return SearchResponse(results=results, total=total, query=search.query, source="fts5")
+
+
+@app.get("/content/suggest", response_model=SuggestResponse)
+async def suggest_content(
+    q: str = Query(..., max_length=200),
+    limit: int = Query(5, ge=1, le=20),
+    x_user_id: str = Depends(require_user_id),
+):
+    """As-you-type lookups: completed/corrected queries plus the best matching titles."""
+    return await run_db(_suggest, q, limit)
+
+
+def _suggest(q: str, limit: int) -> SuggestResponse:
+    with cache_lock:
+        cached_content = get_cached_content()
+        suggestions = cached_content.index.suggest(q, limit)
+        hits, _ = cached_content.index.search(suggestions[0], limit) if suggestions else ([], 0)
+        return SuggestResponse(
+            query=q,
+            suggestions=suggestions,
+            titles=[SuggestTitle(id=doc_id, title=cached_content[doc_id].title) for doc_id, _ in hits],
+        )
+
+
+@app.get("/content/{content_id}/related", response_model=RelatedResponse)
+async def related_content(
+    content_id: str,
+    limit: int = Query(5, ge=1, le=50),
+    x_user_id: str = Depends(require_user_id),
+    db: Session = Depends(get_db),
+):
+    """Lessons most similar to this one, by cosine over TF-IDF vectors of the indexed content."""
+    return await run_db(_related, content_id, limit, db)
+
+
+def _related(content_id: str, limit: int, db: Session) -> RelatedResponse:
+    with cache_lock:
+        cached = content_id in get_cached_content()
+    doc = None
+    if not cached:
+        # Older than anything the cache holds: compare it against the indexed content as it is
+        row = db.query(DBContent).filter(DBContent.id == content_id, DBContent.is_indexed == 1).first()
+        if row is None:
+            raise ContentNotFoundException()
+        doc = cache_item(row)
+    with cache_lock:
+        cached_content = get_cached_content()
+        hits = cached_content.index.related(content_id, limit, doc)
+        results = []
+        for doc_id, score in hits:
+            hit = cached_content[doc_id]
+            results.append(SearchResultItem(
+                id=hit.id,
+                title=hit.title,
+                body=preview(hit.body),
+                content_type=hit.content_type,
+                score=round(score, 4),
+                metadata=hit.metadata,
+            ))
+        return RelatedResponse(id=content_id, results=results, total=len(results), source="index")
 
 
-@app.get("/content", response_model=ListContentResponse)
+@app.get("/content", response_model=ListContentResponse, response_model_exclude_unset=True)
 async def list_content(
+    limit: int | None = Query(None, ge=1, le=LIST_MAX_LIMIT),
+    cursor: str | None = None,
+    fields: str | None = None,
+    stream: bool = False,
+    facets: bool = False,
+    content_type: str | None = None,
+    module: str | None = None,
+    week: int | None = None,
+    tags: list[str] | None = Query(None),
     x_user_id: str = Depends(require_user_id),
     db: Session = Depends(get_db),
 ):
+    """Newest-first listing, one keyset page at a time: pass `next_cursor`
+    back as `cursor` for the next page. `fields=` projects columns and bodies
+    are cut to a preview in SQL. `stream=true` returns NDJSON instead (all
+    remaining rows unless `limit` is given).
+
+    Facet filters are answered by the cache's bitmap indexes, so they (and
+    the facet counts, returned with filters or `facets=true`) cover the
+    indexed content held in the cache."""
+    try:
+        projection = parse_fields(fields)
+        if cursor:
+            decode_cursor(cursor)
+    except ValueError as e:
+        raise InvalidListParamsException(str(e))
 
-    rows = db.query(DBContent).order_by(DBContent.created_at.desc()).all()
+    filters = build_filters(content_type, module, week, tags)
+    ids, facet_counts = None, None
+    if filters or facets:
+        ids, facet_counts = await run_db(_facet_lookup, filters)
 
-    content_list = []
-    for row in rows:
-        body = row.body or ""
-        content_list.append(ContentItem(
-            id=row.id,
-            title=row.title,
-            body=body[:200] + "..." if len(body) > 200 else body,
-            content_type=row.content_type,
-            metadata=safe_json_loads(row.metadata_json),
-            created_at=row.created_at,
-        ))
+    if stream:
+        return StreamingResponse(iter_ndjson(projection, limit, cursor, ids), media_type="application/x-ndjson")
+
+    page_size = limit or LIST_DEFAULT_LIMIT
+    # One extra row tells us whether there is a next page
+    rows = await run_db(_fetch_all, db, build_listing_query(projection, page_size + 1, cursor, ids))
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+
+    content_list = [ContentItem(**list_item(row, projection)) for row in rows]
+    response = ListContentResponse(content=content_list, total=len(content_list), next_cursor=next_cursor)
+    if facet_counts is not None:
+        response.facets = facet_counts
+    return response
 
-    return ListContentResponse(content=content_list, total=len(content_list))
+
+def _facet_lookup(filters: dict) -> tuple[list[str] | None, dict]:
+    """(ids matching the filters, or None without filters; facet counts)."""
+    with cache_lock:
+        index = get_cached_content().index
+        mask = index.facets.mask(filters)
+        ids = [index.doc_id(o) for o in ordinals_of(mask)] if filters else None
+        return ids, index.facets.counts(mask)
+
+
+def _fetch_all(db: Session, query):
+    return db.execute(query).all()
 
 
 @app.get("/content/internal", response_model=ListInternalContentResponse)
-async def list_content_internal(db: Session = Depends(get_db)):
+async def list_content_internal(
+    request: Request,
+    limit: int = Query(10, ge=1, le=1000),
+    since: int | None = Query(None, ge=0),
+    db: Session = Depends(get_db),
+):
     """
-    Internal endpoint for the chat service to fetch content for system prompt context.
+    Internal endpoint for the chat service to fetch content for its retrieval index.
     No auth required — only reachable service-to-service (not exposed via gateway).
+
+    Served from a snapshot rebuilt only when content changes, with a strong
+    ETag (send it back as If-None-Match for a 304) and a pre-gzipped body.
+    `since=<version>` returns just the changes to the newest-`limit` window
+    after that version (see snapshot.internal_delta), or the full snapshot
+    if they are no longer available.
     """
-    rows = db.query(DBContent)\
-        .filter(DBContent.is_indexed == 1)\
-        .order_by(DBContent.created_at.desc())\
-        .limit(10)\
-        .all()
-    
-    return ListInternalContentResponse(
-        content=[InternalContentItem(id=row.id, title=row.title, body=row.body, content_type=row.content_type) for row in rows]
-    )
+    if since is not None:
+        delta = await run_db(snapshot.internal_delta, db, since, limit)
+        if delta is not None:
+            return delta
+
+    snap = await run_db(snapshot.internal_snapshot, db, limit)
+    headers = {"ETag": snap.etag, "X-Content-Version": str(snap.version), "Vary": "Accept-Encoding"}
+    if snapshot.etag_matches(request.headers.get("if-none-match"), snap.etag):
+        return Response(status_code=304, headers=headers)
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        return Response(snap.gzipped, media_type="application/json", headers={**headers, "Content-Encoding": "gzip"})
+    return Response(snap.body, media_type="application/json", headers=headers)
+
+
+@app.get("/metrics")
+async def metrics():
+    """Operational counters for the content service."""
+    return {"search_cache": _result_cache.stats()}
 
 
 @app.get("/health", response_model=HealthResponse)
@@ -1,4 +1,4 @@
-from typing import Optional, List, Any
+from typing import Optional, List, Any, Dict
 from pydantic import BaseModel
 
 
@@ -12,20 +12,44 @@ class ContentUpload(BaseModel):
 class ContentSearch(BaseModel):
     query: str
     limit: Optional[int] = 5
+    # Facet filters; a document must match all of them (every listed tag included)
+    content_type: Optional[str] = None
+    module: Optional[str] = None
+    week: Optional[int] = None
+    tags: Optional[List[str]] = None
 
 
 class UploadResponse(BaseModel):
     message: str
-    content_id: str
+    content_id: str  # the existing item's id when deduplicated
     title: str
-    status: str
+    status: str  # "indexed", or "duplicate" / "updated" when the content was already stored
+    deduplicated: bool = False
+
+
+class UploadItemError(BaseModel):
+    index: int  # position of the item in the file
+    error: str
+
+
+class DeduplicatedItem(BaseModel):
+    index: int  # position of the item in the file
+    content_id: str  # the stored item it duplicates
+    action: str  # "skipped" or "updated"
 
 
 class UploadFileResponse(BaseModel):
     message: str
     count: int
-    content_ids: List[str]
-    status: str
+    content_ids: List[str]  # first 1000 only
+    status: str  # "indexed", or "partial" when some items failed
+    failed: int = 0
+    errors: List[UploadItemError] = []  # first 100 only
+    chunks: int = 0
+    bytes_read: int = 0
+    duplicates: int = 0  # items already stored (or repeated in the file), skipped or updated
+    updated: int = 0
+    deduplicated: List[DeduplicatedItem] = []  # first 100 only
 
 
 class SearchResultItem(BaseModel):
@@ -33,8 +57,11 @@ class SearchResultItem(BaseModel):
     title: Optional[str] = None
     body: Optional[str] = None
     content_type: Optional[str] = None
-    score: int
+    score: float
     metadata: Optional[dict] = None
+    snippet: Optional[str] = None
+    title_highlight: Optional[str] = None
+    highlights: Optional[List[List[int]]] = None  # [start, end) offsets into snippet of the marked terms
 
 
 class SearchResponse(BaseModel):
@@ -42,6 +69,25 @@ class SearchResponse(BaseModel):
     total: int
     query: str
     source: str
+    facets: Optional[Dict[str, Dict[str, int]]] = None
+
+
+class RelatedResponse(BaseModel):
+    id: str
+    results: List[SearchResultItem]  # score is the TF-IDF cosine similarity
+    total: int
+    source: str
+
+
+class SuggestTitle(BaseModel):
+    id: str
+    title: Optional[str] = None
+
+
+class SuggestResponse(BaseModel):
+    query: str
+    suggestions: List[str]
+    titles: List[SuggestTitle]
 
 
 class ContentItem(BaseModel):
@@ -55,7 +101,9 @@ class ContentItem(BaseModel):
 
 class ListContentResponse(BaseModel):
     content: List[ContentItem]
-    total: int
+    total: int  # items in this page
+    next_cursor: Optional[str] = None
+    facets: Optional[Dict[str, Dict[str, int]]] = None
 
 
 class InternalContentItem(BaseModel):
@@ -67,6 +115,9 @@ class InternalContentItem(BaseModel):
 
 class ListInternalContentResponse(BaseModel):
     content: List[InternalContentItem]
+    version: Optional[int] = None  # content version; pass back as `since` for a delta
+    delta: bool = False  # True: only changes after `since`, apply on top of what you have
+    deleted: List[str] = []  # delta only: ids no longer among the newest `limit` (removed, unindexed or pushed out)
 
 
 class HealthResponse(BaseModel):
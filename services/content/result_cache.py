@@ -0,0 +1,81 @@
+import os
+from collections import OrderedDict
+
+from search_index import tokenize
+
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("CONTENT_RESULT_CACHE_MAX_ENTRIES", 1000))
+# Unbounded (limit=None) and very large result sets are not worth holding on to
+RESULT_CACHE_MAX_LIMIT = 100
+
+
+def query_key(query: str, limit: int | None, filters: dict | None) -> tuple | None:
+    """Cache key for a search, or None if it shouldn't be cached. Case,
+    punctuation, word order and repeats don't change results, so they don't
+    change the key either."""
+    if limit is None or limit > RESULT_CACHE_MAX_LIMIT:
+        return None
+    terms = tuple(sorted(set(tokenize(query))))
+    facets = tuple(sorted((facet, tuple(sorted(values))) for facet, values in (filters or {}).items()))
+    return terms, limit, facets
+
+
+class ResultCache:
+    """LRU cache of search results tagged with the content generation they
+    were computed at.
+
+    Any change to the cached content (write-through puts, change-log syncs,
+    evictions, reloads) moves the generation on, and the first lookup at a
+    new generation drops every entry: results are exact, never stale, and
+    there is no TTL to tune."""
+
+    def __init__(self, max_entries: int = RESULT_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.generation = None
+        self._entries = OrderedDict()  # key -> results
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _check(self, generation):
+        if generation != self.generation:
+            if self._entries:
+                self.invalidations += 1
+                self._entries.clear()
+            self.generation = generation
+
+    def get(self, key, generation):
+        self._check(generation)
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, generation, value):
+        self._check(generation)
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        self.generation = None
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "generation": self.generation,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
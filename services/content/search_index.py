@@ -0,0 +1,542 @@
+import bisect
+from array import array
+import heapq
+import math
+import re
+import sys
+from collections import defaultdict
+
+from facet_index import FacetIndex, mask_of, ordinals_of
+from similarity_index import SimilarityIndex
+from trigram_index import TrigramIndex
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+# BM25F: per-field weight and length normalization; k1 is shared
+FIELDS = ("title", "body", "tags")
+FIELD_WEIGHTS = (10.0, 1.0, 5.0)  # same title > tags > body ordering the substring scorer used
+FIELD_B = (0.5, 0.75, 0.3)
+BM25_K1 = 1.2
+# Rebuild a term's impact list once average field lengths drift this much from when it was built
+IMPACT_DRIFT = 0.1
+# Terms with shorter posting lists are scored exhaustively; only longer ones get impact lists/bitmaps
+IMPACT_LIST_MIN_DF = 2048
+# Threshold-algorithm reads start at 64 entries per list and double up to this;
+# larger blocks overshoot the stopping depth by more, smaller ones re-check it more often
+TA_MAX_BLOCK = 1024
+
+# Snippet window length, and how many occurrences of each query term it is chosen from
+SNIPPET_CHARS = 160
+SNIPPET_MAX_OCCURRENCES = 32
+
+# Per-field tf and length tuples are drawn from a small set of values, so
+# equal ones are shared rather than allocated per posting
+_SMALL_TUPLES = {}
+
+
+def tokenize(text: str) -> list[str]:
+    return _TOKEN.findall(text.lower())
+
+
+def token_starts(text: str) -> tuple[list[str], list[int] | None]:
+    """Tokens of a text with their character offsets into it. Offsets are
+    None if lowercasing changed the text's length (they would point at the
+    wrong characters)."""
+    lowered = text.lower()
+    if len(lowered) != len(text):
+        return tokenize(text), None
+    tokens, starts = [], []
+    for match in _TOKEN.finditer(lowered):
+        tokens.append(match.group())
+        starts.append(match.start())
+    return tokens, starts
+
+
+def doc_fields(doc: dict) -> tuple[tuple[list[str], list[str], list[str]], list[int] | None]:
+    """Token lists for (title, body, tags) of a cached content item, plus
+    the body tokens' character offsets."""
+    metadata = doc.get("metadata") or {}
+    tags = metadata.get("tags") or []
+    if not isinstance(tags, list):
+        tags = [tags]
+    body, starts = token_starts(doc.get("body") or "")
+    return (tokenize(doc.get("title") or ""), body, tokenize(" ".join(str(t) for t in tags))), starts
+
+
+def field_counts(fields) -> dict[str, list[int]]:
+    """term -> [title tf, body tf, tags tf] for doc_fields() token lists."""
+    counts = defaultdict(lambda: [0, 0, 0])
+    for f, tokens in enumerate(fields):
+        for token in tokens:
+            counts[token][f] += 1
+    return counts
+
+
+def _offset_table(terms, tokens: list[str], starts: list[int]) -> array:
+    """Body offsets grouped by term, in one flat array: entries i and i+1
+    bound the offsets of terms[i], which follow the len(terms)+1 bounds."""
+    grouped = defaultdict(list)
+    for token, start in zip(tokens, starts):
+        grouped[token].append(start)
+    bounds, offsets = [len(terms) + 1], []
+    for term in terms:
+        offsets.extend(grouped.get(term, ()))
+        bounds.append(len(terms) + 1 + len(offsets))
+    return array("I", bounds + offsets)
+
+
+def mark_terms(text: str, terms) -> str:
+    """`text` with every token that is one of `terms` wrapped in <mark>."""
+    lowered = text.lower()
+    if len(lowered) != len(text):
+        return text
+    terms = set(terms)
+    parts, pos = [], 0
+    for match in _TOKEN.finditer(lowered):
+        if match.group() in terms:
+            parts += [text[pos:match.start()], "<mark>", text[match.start():match.end()], "</mark>"]
+            pos = match.end()
+    parts.append(text[pos:])
+    return "".join(parts)
+
+
+class _SparseImpacts(dict):
+    """ordinal -> impact for a term with a short posting list; reads 0.0 for
+    documents without the term, like the dense array("d") of a long one."""
+
+    def __missing__(self, ordinal):
+        return 0.0
+
+
+def _impact(tfs, lengths, avg) -> float:
+    """Saturated BM25F term weight for one document (idf applied by the caller)."""
+    weighted_tf = 0.0
+    for f in range(3):
+        if tfs[f]:
+            norm = 1 - FIELD_B[f] + FIELD_B[f] * lengths[f] / avg[f]
+            weighted_tf += FIELD_WEIGHTS[f] * tfs[f] / norm
+    return weighted_tf / (BM25_K1 + weighted_tf)
+
+
+class SearchIndex:
+    """In-memory inverted index with BM25F scoring over title, body and tags.
+
+    Postings map a term to {doc_id: (title_tf, body_tf, tags_tf)}, so a query
+    only touches documents that contain at least one query term. Documents
+    are added/removed one at a time, which is what the write-through cache
+    needs.
+
+    For top-k queries each term also gets a lazily built impact list (its
+    postings sorted by precomputed score), kept sorted on insert/remove. The
+    threshold algorithm walks those lists best-first and stops as soon as no
+    unseen document can beat the current k-th result, so broad terms with
+    huge posting lists are read to some depth rather than scanned in full.
+    Documents are scored by ordinal from dense per-term impact arrays, which
+    cost 8 bytes per document each, so only long posting lists get them."""
+
+    def __init__(self):
+        self._postings = defaultdict(dict)  # term -> {doc_id: (tf_title, tf_body, tf_tags)}
+        self._lengths = {}  # doc_id -> (len_title, len_body, len_tags)
+        self._doc_terms = {}  # doc_id -> distinct terms, for cheap removal
+        self._body_offsets = {}  # doc_id -> _offset_table() over _doc_terms, for snippets
+        self._total_lengths = [0, 0, 0]
+        # term -> (sorted [(-impact, ordinal)], impact by ordinal, avg lengths at build); the
+        # impacts are an array("d") over all ordinals for long posting lists, else _SparseImpacts
+        self._impacts = {}
+        # Per-term int bitsets over doc ordinals, built lazily; OR + bit_count gives match totals
+        self._ordinals = {}  # doc_id -> small int, reused after removal
+        self._doc_ids = {}  # ordinal -> doc_id
+        self._free_ordinals = []
+        self._bitmaps = {}  # term -> int
+        self.terms = TrigramIndex()  # vocabulary, for completion and typo correction
+        self.facets = FacetIndex()  # shares the ordinals, so term and facet bitsets combine directly
+        self.similar = SimilarityIndex(self._postings, self._doc_terms, FIELD_WEIGHTS)  # related content
+
+    def __len__(self):
+        return len(self._lengths)
+
+    def __setstate__(self, state):
+        # Unpickled terms are new string objects; interning them now keeps
+        # later add() calls sharing the posting keys (see add())
+        self.__dict__.update(state)
+        for term in self._postings:
+            sys.intern(term)
+
+    def __contains__(self, doc_id):
+        return doc_id in self._lengths
+
+    def _avg_lengths(self) -> list[float]:
+        n = max(len(self._lengths), 1)
+        return [max(total / n, 1e-9) for total in self._total_lengths]
+
+    def add(self, doc: dict):
+        doc_id = doc["id"]
+        if doc_id in self._lengths:
+            self.remove(doc_id)
+        fields, body_starts = doc_fields(doc)
+        counts = field_counts(fields)
+        lengths = tuple(len(tokens) for tokens in fields)
+        lengths = _SMALL_TUPLES.setdefault(lengths, lengths)
+        self._lengths[doc_id] = lengths
+        ordinal = self._free_ordinals.pop() if self._free_ordinals else len(self._ordinals)
+        self._ordinals[doc_id] = ordinal
+        self._doc_ids[ordinal] = doc_id
+        self.facets.add(ordinal, doc)
+        for f in range(3):
+            self._total_lengths[f] += lengths[f]
+        terms = []
+        for term, tfs in counts.items():
+            # Interned, so _doc_terms points at the posting keys instead of holding its own copies
+            term = sys.intern(term)
+            terms.append(term)
+            tfs = tuple(tfs)
+            tfs = _SMALL_TUPLES.setdefault(tfs, tfs)
+            if term not in self._postings:
+                self.terms.add(term)
+            self._postings[term][doc_id] = tfs
+            cached = self._impacts.get(term)
+            if cached is not None:
+                ordered, impacts, avg = cached
+                impact = _impact(tfs, lengths, avg)
+                if isinstance(impacts, array):
+                    self._pad(impacts)
+                impacts[ordinal] = impact
+                bisect.insort(ordered, (-impact, ordinal))
+            if term in self._bitmaps:
+                self._bitmaps[term] |= 1 << ordinal
+        # Remember the terms so removal doesn't have to re-tokenize the body
+        self._doc_terms[doc_id] = tuple(terms)
+        if body_starts is not None:
+            self._body_offsets[doc_id] = _offset_table(terms, fields[1], body_starts)
+        self.similar.add(doc_id)
+
+    def remove(self, doc_id: str):
+        lengths = self._lengths.pop(doc_id, None)
+        if lengths is None:
+            return
+        for f in range(3):
+            self._total_lengths[f] -= lengths[f]
+        self._body_offsets.pop(doc_id, None)
+        self.similar.remove(doc_id)
+        ordinal = self._ordinals.pop(doc_id)
+        del self._doc_ids[ordinal]
+        self.facets.remove(ordinal)
+        self._free_ordinals.append(ordinal)
+        for term in self._doc_terms.pop(doc_id):
+            postings = self._postings[term]
+            postings.pop(doc_id, None)
+            if not postings:
+                del self._postings[term]
+                self.terms.remove(term)
+                self._impacts.pop(term, None)
+                self._bitmaps.pop(term, None)
+                continue
+            if term in self._bitmaps:
+                self._bitmaps[term] &= ~(1 << ordinal)
+            cached = self._impacts.get(term)
+            if cached is not None:
+                ordered, impacts, _ = cached
+                entry = (-impacts[ordinal], ordinal)
+                if isinstance(impacts, array):
+                    impacts[ordinal] = 0.0  # the ordinal may be reused by a document without the term
+                else:
+                    del impacts[ordinal]
+                i = bisect.bisect_left(ordered, entry)
+                if i < len(ordered) and ordered[i] == entry:
+                    del ordered[i]
+
+    def clear(self):
+        self._postings.clear()
+        self._lengths.clear()
+        self._doc_terms.clear()
+        self._body_offsets.clear()
+        self._impacts.clear()
+        self._ordinals.clear()
+        self._doc_ids.clear()
+        self._free_ordinals.clear()
+        self.facets.clear()
+        self.similar.clear()
+        self._bitmaps.clear()
+        self.terms.clear()
+        self._total_lengths = [0, 0, 0]
+
+    def _pad(self, impacts: array):
+        """Grow an impact array to cover every ordinal in use, so scoring can
+        index it with any document's ordinal."""
+        missing = len(self._ordinals) + len(self._free_ordinals) - len(impacts)
+        if missing > 0:
+            impacts.frombytes(bytes(missing * impacts.itemsize))
+
+    def _impact_list(self, term: str, avg: list[float]):
+        cached = self._impacts.get(term)
+        if cached is not None:
+            built_avg = cached[2]
+            if all(abs(a - b) <= IMPACT_DRIFT * b for a, b in zip(avg, built_avg)):
+                if isinstance(cached[1], array):
+                    self._pad(cached[1])
+                return cached
+        lengths, ordinals = self._lengths, self._ordinals
+        postings = self._postings[term]
+        if len(postings) >= IMPACT_LIST_MIN_DF:
+            impacts = array("d")
+            self._pad(impacts)
+        else:
+            impacts = _SparseImpacts()
+        ordered = []
+        for doc_id, tfs in postings.items():
+            ordinal = ordinals[doc_id]
+            impacts[ordinal] = impact = _impact(tfs, lengths[doc_id], avg)
+            ordered.append((-impact, ordinal))
+        ordered.sort()
+        cached = self._impacts[term] = (ordered, impacts, list(avg))
+        if len(ordered) >= IMPACT_LIST_MIN_DF:
+            # Counting matches needs the bitmap too; building it with the impact
+            # list keeps that one-off cost out of the first multi-term query
+            self._bitmap(term)
+        return cached
+
+    def _idf(self, df: int) -> float:
+        n = len(self._lengths)
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def _bitmap(self, term: str) -> int:
+        bitmap = self._bitmaps.get(term)
+        if bitmap is None:
+            ordinals = self._ordinals
+            bitmap = self._bitmaps[term] = mask_of(ordinals[doc_id] for doc_id in self._postings[term])
+        return bitmap
+
+    def _match_mask(self, terms) -> int:
+        """Bitset of documents containing any of the terms. Only long posting
+        lists keep a cached bitmap; short ones are cheap to rebuild."""
+        mask = 0
+        short = []
+        for term in terms:
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            if len(postings) >= IMPACT_LIST_MIN_DF:
+                mask |= self._bitmap(term)
+            else:
+                short.extend(postings)
+        ordinals = self._ordinals
+        return mask | mask_of(ordinals[doc_id] for doc_id in short)
+
+    def _search_exhaustive(self, terms, k: int, avg, candidates=None) -> list[tuple[str, float]]:
+        # Same formula as _impact(), inlined: this loop is the whole cost of a selective query
+        (wt, wb, wg), (bt, bb, bg) = FIELD_WEIGHTS, FIELD_B
+        at, ab, ag = avg
+        scores = defaultdict(float)
+        lengths = self._lengths
+        for term in terms:
+            postings = self._postings[term]
+            idf = self._idf(len(postings))
+            if candidates is None:
+                entries = postings.items()
+            else:
+                entries = [(doc_id, postings[doc_id]) for doc_id in candidates if doc_id in postings]
+            for doc_id, (tt, tb, tg) in entries:
+                lt, lb, lg = lengths[doc_id]
+                tf = 0.0
+                if tt:
+                    tf += wt * tt / (1 - bt + bt * lt / at)
+                if tb:
+                    tf += wb * tb / (1 - bb + bb * lb / ab)
+                if tg:
+                    tf += wg * tg / (1 - bg + bg * lg / ag)
+                scores[doc_id] += idf * tf / (BM25_K1 + tf)
+        return heapq.nlargest(k, scores.items(), key=lambda item: (item[1], item[0]))
+
+    def match_count(self, terms) -> int:
+        """Number of documents containing at least one of the terms."""
+        postings = [self._postings[t] for t in terms if t in self._postings]
+        if len(postings) <= 1:
+            return len(postings[0]) if postings else 0
+        if all(len(p) < IMPACT_LIST_MIN_DF for p in postings):
+            return len(set().union(*postings))
+        union = 0
+        for term in terms:
+            if term in self._postings:
+                union |= self._bitmap(term)
+        return union.bit_count()
+
+    def doc_id(self, ordinal: int) -> str:
+        return self._doc_ids[ordinal]
+
+    def df(self, term: str) -> int:
+        postings = self._postings.get(term)
+        return len(postings) if postings else 0
+
+    def correct(self, token: str) -> str | None:
+        """The token itself if indexed, else its closest indexed spelling, else
+        its most common completion ("eng" -> "engineering"), else None."""
+        if token in self._postings:
+            return token
+        matches = self.terms.fuzzy(token, 1, self.df)
+        if matches:
+            return matches[0][0]
+        completions = self.terms.complete(token, 1, self.df) if len(token) >= 3 else []
+        return completions[0] if completions else None
+
+    def suggest(self, text: str, limit: int) -> list[str]:
+        """As-you-type query completions: earlier words spell-corrected, the
+        last one completed by prefix, or corrected if nothing starts with it."""
+        tokens = tokenize(text)
+        if not tokens:
+            return []
+        head = [self.correct(t) or t for t in tokens[:-1]]
+        last = tokens[-1]
+        candidates = self.terms.complete(last, limit, self.df)
+        if len(candidates) < limit:
+            candidates += [t for t, _ in self.terms.fuzzy(last, limit, self.df) if t not in candidates]
+        return [" ".join(head + [c]) for c in candidates[:limit]]
+
+    def query_terms(self, query: str) -> list[str]:
+        """Distinct indexed terms a query searches for, after spelling correction."""
+        terms = {self.correct(t) for t in tokenize(query)}
+        return [t for t in terms if t is not None]
+
+    def snippet(self, doc_id: str, body: str, terms, max_chars: int = SNIPPET_CHARS):
+        """(snippet, spans) for the window of `body` holding the most distinct
+        query terms (then the most occurrences), with matches wrapped in
+        <mark> like the FTS5 backend; spans are the [start, end) offsets of
+        the marked terms within the returned snippet text, so
+        snippet[start:end] is the term itself. None if no term occurs in the
+        body.
+
+        Works from the offsets stored at add() time: the cost depends on the
+        number of occurrences considered (at most SNIPPET_MAX_OCCURRENCES per
+        term) and the window size, not on the body length."""
+        table = self._body_offsets.get(doc_id)
+        if table is None:
+            return None
+        doc_terms = self._doc_terms[doc_id]
+        occurrences = []  # (start, end, term number)
+        for t, term in enumerate(terms):
+            try:
+                i = doc_terms.index(term)
+            except ValueError:
+                continue
+            lo, hi = table[i], min(table[i + 1], table[i] + SNIPPET_MAX_OCCURRENCES)
+            occurrences.extend((start, start + len(term), t) for start in table[lo:hi])
+        if not occurrences:
+            return None
+        occurrences.sort()
+
+        # Sliding window over the occurrences, tracking term counts inside it
+        in_window = defaultdict(int)
+        best, best_range, lo = (0, 0), (0, 0), 0
+        for hi, (_, end, t) in enumerate(occurrences):
+            in_window[t] += 1
+            while lo < hi and end - occurrences[lo][0] > max_chars:
+                left = occurrences[lo][2]
+                in_window[left] -= 1
+                if not in_window[left]:
+                    del in_window[left]
+                lo += 1
+            score = (len(in_window), hi - lo + 1)
+            if score > best:
+                best, best_range = score, (lo, hi)
+        first, last = occurrences[best_range[0]][0], occurrences[best_range[1]][1]
+
+        # Centre the matched span, then pull both ends in to whitespace
+        start = max(0, first - max(0, max_chars - (last - first)) // 2)
+        end = min(len(body), max(last, start + max_chars))
+        start = max(0, min(start, end - max_chars))
+        if start > 0:
+            space = body.find(" ", start, first)
+            if space != -1:
+                start = space + 1
+        if end < len(body):
+            space = body.rfind(" ", last, end)
+            if space != -1:
+                end = space
+
+        parts = ["…"] if start > 0 else []
+        spans, pos, length = [], start, len(parts)
+        for s, e, _ in occurrences:
+            if s < start or e > end:
+                continue
+            length += s - pos + len("<mark>")
+            spans.append((length, length + e - s))
+            length += e - s + len("</mark>")
+            parts += [body[pos:s], "<mark>", body[s:e], "</mark>"]
+            pos = e
+        parts.append(body[pos:end])
+        if end < len(body):
+            parts.append("…")
+        return "".join(parts), spans
+
+    def facet_counts(self, query: str | None = None, filters: dict | None = None) -> dict[str, dict[str, int]]:
+        """Facet value counts over the documents a query (if any) and filters match."""
+        mask = self.facets.mask(filters)
+        if query:
+            mask &= self._match_mask(self.query_terms(query))
+        return self.facets.counts(mask)
+
+    def related(self, doc_id: str, limit: int, doc: dict | None = None) -> list[tuple[str, float]]:
+        """[(doc_id, cosine)] of the documents most like `doc_id`, best first.
+        A `doc` that is not indexed (evicted from the cache, say) is
+        vectorised on the spot and compared against the indexed ones."""
+        hits = self.similar.related(doc_id, limit)
+        if hits is None and doc is not None:
+            hits = self.similar.similar_to(field_counts(doc_fields(doc)[0]).items(), limit)
+        return hits or []
+
+    def search(self, query: str, limit: int | None, filters: dict | None = None) -> tuple[list[tuple[str, float]], int]:
+        """Returns ([(doc_id, score)] best first, total matches). Misspelled
+        query words are replaced by their closest indexed term. `filters`
+        ({facet: [values]}) restricts matches through the facet bitmaps."""
+        terms = self.query_terms(query)
+        if not terms:
+            return [], 0
+        avg = self._avg_lengths()
+        if filters:
+            allowed = self.facets.mask(filters) & self._match_mask(terms)
+            total = allowed.bit_count()
+            k = total if limit is None else min(limit, total)
+            candidates = [self._doc_ids[o] for o in ordinals_of(allowed)]
+            return self._search_exhaustive(terms, k, avg, candidates), total
+
+        total = self.match_count(terms)
+        k = total if limit is None else min(limit, total)
+        if k <= 0:
+            return [], total
+
+        if all(len(self._postings[t]) < IMPACT_LIST_MIN_DF for t in terms):
+            return self._search_exhaustive(terms, k, avg), total
+
+        lists = []
+        for term in terms:
+            ordered, impacts, _ = self._impact_list(term, avg)
+            lists.append((self._idf(len(ordered)), ordered, impacts))
+
+        # Threshold algorithm: sorted access down every list in lockstep, random
+        # access into the others to score each newly seen document. Lists are
+        # consumed in blocks, doubling up to TA_MAX_BLOCK, so the per-document
+        # work stays in comprehensions over ordinals and impact arrays; the
+        # bound for unseen documents is the sum of the lowest impacts read so far.
+        weights = [(idf, impacts) for idf, _, impacts in lists]
+        top, seen, depth, block = [], set(), 0, 64
+        while True:
+            threshold, fresh = 0.0, []
+            for idf, ordered, _ in lists:
+                chunk = ordered[depth:depth + block]
+                if chunk:
+                    threshold -= idf * chunk[-1][0]
+                    fresh.extend([ordinal for _, ordinal in chunk])
+            if not fresh:
+                break
+            new = list(set(fresh).difference(seen))
+            seen.update(new)
+            # One flat pass per term rather than a small sum per document
+            scores = [0.0] * len(new)
+            for w, impacts in weights:
+                scores = [score + w * impact for score, impact in zip(scores, map(impacts.__getitem__, new))]
+            top = heapq.nlargest(k, top + list(zip(scores, new)))
+            if len(top) == k and top[-1][0] >= threshold:
+                break
+            depth += block
+            block = min(block * 2, TA_MAX_BLOCK)
+        doc_ids = self._doc_ids
+        return [(doc_ids[ordinal], score) for score, ordinal in top], total
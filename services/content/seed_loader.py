@@ -0,0 +1,153 @@
+"""
+Bulk-load seed content from a directory tree of JSON/NDJSON files.
+
+Files are parsed and validated in a process pool, while the main process
+writes the rows in batched transactions, skipping (or upserting) content
+whose hash is already stored. The in-memory search index (and its on-disk
+snapshot, when configured) is built once at the end instead of per item:
+
+    python seed_loader.py ../../seed_data --workers 4 --batch-rows 1000
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import database
+from dedup import DUPLICATE_MODES
+from ingest import INGEST_READ_BYTES, Ingestor, JSONItemStream, validate_item
+
+SEED_SUFFIXES = (".json", ".ndjson", ".jsonl")
+SEED_USER_ID = "seed-loader"
+
+
+def find_files(paths: list[str]) -> list[str]:
+    """Seed files under `paths`, in a stable order so reloads are reproducible."""
+    found = []
+    for path in paths:
+        if os.path.isfile(path):
+            found.append(path)
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            found.extend(os.path.join(root, name) for name in sorted(files) if name.endswith(SEED_SUFFIXES))
+    return found
+
+
+def parse_file(path: str, user_id: str = SEED_USER_ID):
+    """Parse and validate one file; runs in a pool worker.
+
+    Returns (path, [(index, row)], [(index, error)], fatal error, bytes read)."""
+    builder = Ingestor(user_id)
+    parser = JSONItemStream()
+    rows, errors, size = [], [], 0
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(INGEST_READ_BYTES)
+            size += len(data)
+            for index, item, error in parser.feed(data, final=not data):
+                if error is None:
+                    content, error = validate_item(item)
+                if error is not None:
+                    errors.append((index, error))
+                else:
+                    rows.append((index, builder.row(content)))
+            if not data or parser.error:
+                break
+    return path, rows, errors, parser.error, size
+
+
+def load(paths: list[str], workers: int | None = None, batch_rows: int = 1000,
+         on_duplicate: str = "skip", user_id: str = SEED_USER_ID) -> dict:
+    """Load every seed file under `paths`. With `workers` of 0 or 1 files are
+    parsed in-process."""
+    files = find_files(paths)
+    writer = Ingestor(user_id, chunk_rows=batch_rows, on_duplicate=on_duplicate)
+    started = time.perf_counter()
+    # The pool is started before the database is opened, so forked workers
+    # never inherit a live SQLite connection
+    workers = min(os.cpu_count() or 1, len(files)) if workers is None else min(workers, len(files))
+    pool = ProcessPoolExecutor(workers) if workers > 1 else None
+    try:
+        if pool:
+            chunksize = max(1, len(files) // (workers * 4))
+            results = pool.map(parse_file, files, [user_id] * len(files), chunksize=chunksize)
+        else:
+            results = map(parse_file, files, [user_id] * len(files))
+
+        database.init_db(seed_defaults=False)
+        db = database.get_session()
+        pending, write_seconds, files_failed = [], 0.0, 0
+        try:
+            for path, rows, errors, fatal, size in results:
+                label = os.path.relpath(path)
+                writer.bytes_read += size
+                for index, error in errors:
+                    writer.record_error(f"{label}[{index}]", error)
+                if fatal:
+                    files_failed += 1
+                    writer.record_error(label, fatal)
+                pending.extend((f"{label}[{index}]", row) for index, row in rows)
+                while len(pending) >= batch_rows:
+                    batch_started = time.perf_counter()
+                    writer.write_chunk(db, pending[:batch_rows])
+                    write_seconds += time.perf_counter() - batch_started
+                    pending = pending[batch_rows:]
+            if pending:
+                batch_started = time.perf_counter()
+                writer.write_chunk(db, pending)
+                write_seconds += time.perf_counter() - batch_started
+        finally:
+            db.close()
+    finally:
+        if pool:
+            pool.shutdown()
+    loaded = time.perf_counter()
+
+    cache = database.get_cached_content(force_refresh=True)
+    finished = time.perf_counter()
+    elapsed = finished - started
+    items = writer.inserted + writer.duplicates + writer.failed
+    return {
+        "files": len(files),
+        "files_failed": files_failed,
+        "items": items,
+        "inserted": writer.inserted,
+        "duplicates": writer.duplicates,
+        "updated": writer.updated,
+        "failed": writer.failed,
+        "errors": writer.errors,
+        "batches": writer.chunks,
+        "bytes_read": writer.bytes_read,
+        "indexed": len(cache),
+        "load_seconds": round(loaded - started, 3),
+        "write_seconds": round(write_seconds, 3),
+        "index_seconds": round(finished - loaded, 3),
+        "items_per_s": round(items / elapsed, 1) if elapsed else 0.0,
+        "mb_per_s": round(writer.bytes_read / elapsed / 1e6, 2) if elapsed else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="seed files or directories to search recursively")
+    parser.add_argument("--workers", type=int, default=None, help="parser processes (default: CPU count, 0: in-process)")
+    parser.add_argument("--batch-rows", type=int, default=1000, help="rows per write transaction")
+    parser.add_argument("--on-duplicate", choices=DUPLICATE_MODES, default="skip")
+    args = parser.parse_args()
+
+    report = load(args.paths, args.workers, args.batch_rows, args.on_duplicate)
+    for error in report["errors"]:
+        print(f"  {error['index']}: {error['error']}", file=sys.stderr)
+    print(f"{report['files']} files, {report['items']} items: {report['inserted']} inserted, "
+          f"{report['duplicates']} duplicates ({report['updated']} updated), {report['failed']} failed")
+    print(f"load {report['load_seconds']}s (writes {report['write_seconds']}s in {report['batches']} batches), "
+          f"index {report['index_seconds']}s for {report['indexed']} documents")
+    print(f"{report['items_per_s']} items/s, {report['mb_per_s']} MB/s")
+    sys.exit(1 if report["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+import heapq
+import math
+import os
+from array import array
+from collections import defaultdict
+
+# Neighbours memoized per document; asking for more computes them on the spot
+RELATED_TOP_K = int(os.getenv("CONTENT_RELATED_TOP_K", 10))
+# Strongest terms kept per vector: the tail adds little to cosine but a lot to scan time
+RELATED_MAX_TERMS = 32
+# Once a term is in more than RELATED_COMMON_MIN_DF documents and this share of
+# the corpus it is left out of vectors: it says little about similarity and
+# has the longest column to scan
+RELATED_MAX_DF = 0.1
+RELATED_COMMON_MIN_DF = 50
+# Re-weight every vector once the corpus size drifts this far from the last full build
+RELATED_IDF_DRIFT = 0.5
+# Batches up to this size are merged into the memoized neighbour lists; larger ones drop them
+RELATED_MERGE_MAX = 256
+
+
+class SimilarityIndex:
+    """Top-k cosine neighbours over sparse TF-IDF document vectors.
+
+    Term frequencies come from the owning SearchIndex's postings, so no text
+    is stored twice. Each vector keeps the document's RELATED_MAX_TERMS
+    strongest terms, L2-normalised, laid out twice in flat arrays: by row
+    (CSR: _indptr/_indices/_data, indexed by slot) to read one document's
+    vector, and by column (term id -> array("I") slots, array("f") weights)
+    so scoring a document only walks the columns of its own terms.
+
+    Added documents are vectorised in one batch on the next lookup, all with
+    the same IDF. Neighbour lists are computed on first request and
+    memoized; a small batch of new documents is merged into the memoized
+    lists it beats. Slots are never reused, so a list naming a removed (or
+    re-added) document is detected by a dead slot and recomputed."""
+
+    def __init__(self, postings, doc_terms, field_weights):
+        self._postings = postings  # term -> {doc_id: per-field tfs}, owned by SearchIndex
+        self._doc_terms = doc_terms  # doc_id -> distinct terms, owned by SearchIndex
+        self._field_weights = field_weights
+        self._pending = {}  # doc ids added since the last build, in order
+        self._slots = {}  # doc_id -> slot
+        self._slot_ids = []  # slot -> doc_id, None once removed
+        self._indptr = array("I", [0])
+        self._indices = array("I")  # term ids
+        self._data = array("f")
+        self._term_ids = {}
+        self._columns = []  # term id -> (array("I") slots, array("f") weights)
+        self._built_n = 0  # corpus size the IDF of the current vectors was taken at
+        self._top = {}  # doc_id -> (array("I") slots, array("f") scores), best first
+
+    def __len__(self):
+        return len(self._slots)
+
+    def add(self, doc_id: str):
+        self._pending[doc_id] = None
+
+    def remove(self, doc_id: str):
+        self._pending.pop(doc_id, None)
+        self._top.pop(doc_id, None)
+        slot = self._slots.pop(doc_id, None)
+        if slot is not None:
+            self._slot_ids[slot] = None
+            if len(self._slot_ids) > 2 * len(self._slots) + 64:
+                self._compact()
+
+    def clear(self):
+        self._pending.clear()
+        self._reset()
+
+    def _reset(self):
+        self._slots.clear()
+        self._slot_ids = []
+        self._indptr = array("I", [0])
+        self._indices = array("I")
+        self._data = array("f")
+        self._term_ids.clear()
+        self._columns = []
+        self._top.clear()
+
+    def weigh(self, term_tfs, n: int) -> list[tuple[float, str]]:
+        """Unit TF-IDF weights for (term, per-field tfs) pairs, strongest
+        RELATED_MAX_TERMS only, against a corpus of `n` documents."""
+        w_title, w_body, w_tags = self._field_weights
+        weights = []
+        for term, tfs in term_tfs:
+            postings = self._postings.get(term)
+            df = len(postings) if postings else 0
+            if df > RELATED_COMMON_MIN_DF and df > RELATED_MAX_DF * n:
+                continue
+            tf = w_title * tfs[0] + w_body * tfs[1] + w_tags * tfs[2]
+            weights.append(((1 + math.log(tf)) * (math.log((1 + n) / (1 + df)) + 1), term))
+        if len(weights) > RELATED_MAX_TERMS:
+            weights = heapq.nlargest(RELATED_MAX_TERMS, weights)
+        norm = math.sqrt(sum(w * w for w, _ in weights)) or 1.0
+        return [(w / norm, term) for w, term in weights]
+
+    def _append(self, doc_id: str, weights):
+        slot = len(self._slot_ids)
+        self._slot_ids.append(doc_id)
+        self._slots[doc_id] = slot
+        for weight, term in weights:
+            term_id = self._term_ids.get(term)
+            if term_id is None:
+                term_id = self._term_ids[term] = len(self._columns)
+                self._columns.append((array("I"), array("f")))
+            slots, column = self._columns[term_id]
+            slots.append(slot)
+            column.append(weight)
+            self._indices.append(term_id)
+            self._data.append(weight)
+        self._indptr.append(len(self._indices))
+
+    def _compact(self):
+        """Rewrite the arrays without removed slots. Renumbers slots, so the
+        memoized lists go too."""
+        rows = [(doc_id, self._row(slot)) for slot, doc_id in enumerate(self._slot_ids) if doc_id is not None]
+        terms = list(self._term_ids)
+        self._reset()
+        for doc_id, (term_ids, weights) in rows:
+            self._append(doc_id, [(w, terms[t]) for t, w in zip(term_ids, weights)])
+
+    def _build(self):
+        n = len(self._doc_terms)
+        if abs(n - self._built_n) > RELATED_IDF_DRIFT * self._built_n:
+            # IDF has moved enough to re-weight the whole corpus in one batch
+            self._reset()
+            self._pending = dict.fromkeys(self._doc_terms)
+            self._built_n = n
+        if not self._pending:
+            return
+        batch = [doc_id for doc_id in self._pending if doc_id in self._doc_terms]
+        self._pending.clear()
+        postings = self._postings
+        for doc_id in batch:
+            self._append(doc_id, self.weigh(((t, postings[t][doc_id]) for t in self._doc_terms[doc_id]), n))
+        if len(batch) > RELATED_MERGE_MAX:
+            self._top.clear()
+        elif self._top:
+            self._merge(batch)
+
+    def _row(self, slot: int):
+        start, end = self._indptr[slot], self._indptr[slot + 1]
+        return self._indices[start:end], self._data[start:end]
+
+    def _scores(self, term_ids, weights) -> dict[int, float]:
+        """Cosine against every vector sharing a term, by slot (dead slots included)."""
+        scores = defaultdict(float)
+        columns = self._columns
+        for term_id, weight in zip(term_ids, weights):
+            slots, column = columns[term_id]
+            for slot, other in zip(slots, column):
+                scores[slot] += weight * other
+        return scores
+
+    def _best(self, scores: dict[int, float], k: int, exclude: int | None = None):
+        ids = self._slot_ids
+        best = heapq.nlargest(k, ((score, slot) for slot, score in scores.items()
+                                  if slot != exclude and ids[slot] is not None))
+        return array("I", [slot for _, slot in best]), array("f", [score for score, _ in best])
+
+    def _merge(self, batch: list[str]):
+        """Fold new documents into the memoized lists they now belong in."""
+        ids = self._slot_ids
+        for doc_id in batch:
+            slot = self._slots[doc_id]
+            for other, score in self._scores(*self._row(slot)).items():
+                top = self._top.get(ids[other]) if other != slot else None
+                if top is None:
+                    continue
+                slots, scores = top
+                if len(scores) >= RELATED_TOP_K and score <= scores[-1]:
+                    continue
+                i = 0
+                while i < len(scores) and scores[i] >= score:
+                    i += 1
+                slots.insert(i, slot)
+                scores.insert(i, score)
+                if len(scores) > RELATED_TOP_K:
+                    slots.pop()
+                    scores.pop()
+
+    def related(self, doc_id: str, k: int) -> list[tuple[str, float]] | None:
+        """The k most similar documents as (doc_id, cosine), best first, or
+        None when `doc_id` is not indexed."""
+        self._build()
+        slot = self._slots.get(doc_id)
+        if slot is None:
+            return None
+        ids = self._slot_ids
+        if k > RELATED_TOP_K:
+            slots, scores = self._best(self._scores(*self._row(slot)), k, exclude=slot)
+        else:
+            top = self._top.get(doc_id)
+            if top is None or any(ids[s] is None for s in top[0]):
+                top = self._top[doc_id] = self._best(self._scores(*self._row(slot)), RELATED_TOP_K, exclude=slot)
+            slots, scores = top
+        return [(ids[s], score) for s, score in zip(slots[:k], scores[:k]) if score > 0]
+
+    def similar_to(self, term_tfs, k: int) -> list[tuple[str, float]]:
+        """Neighbours of a document that is not indexed, from its (term, tfs) pairs."""
+        self._build()
+        weights = [(self._term_ids[term], w) for w, term in self.weigh(term_tfs, len(self._doc_terms))
+                   if term in self._term_ids]
+        slots, scores = self._best(self._scores([t for t, _ in weights], [w for _, w in weights]), k)
+        return [(self._slot_ids[s], score) for s, score in zip(slots, scores) if score > 0]
@@ -0,0 +1,115 @@
+import gzip
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import select
+
+import changelog
+from database import DBContent
+
+# Distinct `limit` values whose snapshot is kept; callers poll with one or two
+SNAPSHOT_CACHE_LIMITS = 8
+
+_INTERNAL_COLUMNS = (DBContent.id, DBContent.title, DBContent.body, DBContent.content_type)
+
+
+class InternalSnapshot:
+    """The encoded /content/internal payload as of one content version,
+    with its strong ETag and a pre-gzipped copy."""
+
+    __slots__ = ("version", "etag", "body", "gzipped")
+
+    def __init__(self, version: int, payload: dict):
+        self.version = version
+        self.body = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode()
+        self.etag = f'"{hashlib.sha256(self.body).hexdigest()[:32]}"'
+        # mtime=0 keeps the bytes identical across workers and rebuilds
+        self.gzipped = gzip.compress(self.body, compresslevel=6, mtime=0)
+
+
+_snapshots = OrderedDict()  # limit -> InternalSnapshot
+_snapshots_lock = threading.Lock()
+
+
+def _item(row) -> dict:
+    return {"id": row.id, "title": row.title, "body": row.body, "content_type": row.content_type}
+
+
+def internal_snapshot(db, limit: int) -> InternalSnapshot:
+    """The newest `limit` indexed items. Rebuilt only when the content
+    version has moved; otherwise this costs one change-log lookup."""
+    conn = db.connection()
+    _, version = changelog.version_range(conn)
+    with _snapshots_lock:
+        snapshot = _snapshots.get(limit)
+        if snapshot is not None and snapshot.version == version:
+            _snapshots.move_to_end(limit)
+            return snapshot
+    # Same transaction as the version read, so the rows match the version
+    rows = db.execute(
+        select(*_INTERNAL_COLUMNS).where(DBContent.is_indexed == 1)
+        .order_by(DBContent.created_at.desc(), DBContent.id.desc()).limit(limit)
+    ).all()
+    snapshot = InternalSnapshot(version, {
+        "content": [_item(row) for row in rows], "version": version, "delta": False, "deleted": [],
+    })
+    with _snapshots_lock:
+        _snapshots[limit] = snapshot
+        _snapshots.move_to_end(limit)
+        while len(_snapshots) > SNAPSHOT_CACHE_LIMITS:
+            _snapshots.popitem(last=False)
+    return snapshot
+
+
+def _newest_ids(db, limit: int) -> list[str]:
+    return db.execute(
+        select(DBContent.id).where(DBContent.is_indexed == 1)
+        .order_by(DBContent.created_at.desc(), DBContent.id.desc()).limit(limit)
+    ).scalars().all()
+
+
+def internal_delta(db, since: int, limit: int) -> dict | None:
+    """What turns the newest-`limit` window as of version `since` into the
+    current one, or None when the caller needs a full snapshot instead (the
+    changes it missed were pruned, or there are more than `limit` of them).
+
+    `content` holds the changed items still in the window and `deleted` the
+    ids no longer in it. The window also moves when other items come or go:
+    with n changes, an unchanged item can only have been pushed out if it now
+    ranks below `limit + n`, and only pulled in if it ranks in the window's
+    last d places for d removals. Those are sent too, so the caller's copy
+    never outgrows `limit`; resending an item it has, or deleting one it
+    lacks, is harmless."""
+    conn = db.connection()
+    oldest, version = changelog.version_range(conn)
+    if since > version or (since < version and since + 1 < oldest):
+        return None
+    ids = changelog.changed_ids(conn, since, limit) if since < version else []
+    if ids is None:
+        return None
+    if not ids:
+        return {"content": [], "version": version, "delta": True, "deleted": []}
+    ranked = _newest_ids(db, limit + len(ids))
+    window = set(ranked[:limit])
+    removed = [content_id for content_id in ids if content_id not in window]
+    wanted = [content_id for content_id in ids if content_id in window]
+    wanted += [content_id for content_id in ranked[limit - len(removed):limit] if content_id not in wanted]
+    rows = db.execute(
+        select(*_INTERNAL_COLUMNS).where(DBContent.id.in_(wanted), DBContent.is_indexed == 1)
+    ).all() if wanted else []
+    return {
+        "content": [_item(row) for row in rows],
+        "version": version,
+        "delta": True,
+        "deleted": removed + [content_id for content_id in ranked[limit:] if content_id not in ids],
+    }
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    # If-None-Match uses weak comparison, so a W/ prefix still matches
+    return "*" in candidates or any(tag.removeprefix("W/") == etag for tag in candidates)
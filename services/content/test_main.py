@@ -12,6 +12,7 @@ import tempfile
 import jwt
 import pytest
 from fastapi.testclient import TestClient
+from sqlalchemy import text
 
 # Point the DB at a temp file so tests don't touch production data
 _test_db = tempfile.NamedTemporaryFile(suffix=".db", delete=False)
@@ -19,6 +20,10 @@ TEST_DB_PATH = _test_db.name
 _test_db.close()
 
 os.environ["CONTENT_DB_PATH"] = TEST_DB_PATH
+# Check the change log on every read, so "other worker" writes show up immediately
+os.environ["CONTENT_CACHE_SYNC_SECONDS"] = "0"
+os.environ["CONTENT_SNAPSHOT_PATH"] = f"{TEST_DB_PATH}.index"
+os.environ["CONTENT_SNAPSHOT_KEY"] = "test-snapshot-key"
 
 from main import app  # noqa: E402 (must come after env override)
 import database  # noqa: E402
@@ -57,6 +62,17 @@ def _clean_db():
     yield
 
 
+@pytest.fixture
+def fts_backend(monkeypatch):
+    """Switch to the FTS5 backend, building its table as init_db() would."""
+    import fts_search
+
+    monkeypatch.setattr(database, "SEARCH_BACKEND", "fts5")
+    fts_search.init_fts(database.engine)
+    yield
+    fts_search.drop_fts(database.engine)
+
+
 # ── Bug 1: Content upload must persist to real DB ────────────
 
 class TestContentUploadPersistence:
@@ -115,6 +131,233 @@ class TestFileUploadInserts:
         assert _count_rows() == 1
 
 
+# ── Streaming bulk ingestion ─────────────────────────────────
+
+class TestStreamingIngest:
+    def _upload(self, raw: bytes, name="bulk.json"):
+        return client.post("/content/upload-file", files={"file": (name, raw, "application/json")},
+                           headers=_auth_header())
+
+    def test_array_is_inserted_in_chunks(self, monkeypatch):
+        import ingest
+
+        monkeypatch.setattr(ingest, "INGEST_CHUNK_ROWS", 2)
+        monkeypatch.setattr(ingest, "INGEST_READ_BYTES", 7)
+        items = [{"title": f"Bulk {i}", "body": "ünïcode body", "metadata": {"week": i}} for i in range(5)]
+        resp = self._upload(json.dumps(items).encode())
+        body = resp.json()
+        assert resp.status_code == 200
+        assert body["count"] == 5
+        assert body["chunks"] == 3
+        assert body["status"] == "indexed"
+        assert _count_rows() == 5
+
+    def test_ndjson_reports_bad_lines_and_keeps_going(self):
+        raw = b'{"title": "A", "body": "a"}\n{"title": oops}\n{"title": "No body"}\n{"title": "B", "body": "b"}\n'
+        body = self._upload(raw, "bulk.ndjson").json()
+        assert body["count"] == 2
+        assert body["status"] == "partial"
+        assert [e["index"] for e in body["errors"]] == [1, 2]
+        assert _count_rows() == 2
+
+    def test_truncated_array_keeps_committed_chunks(self, monkeypatch):
+        import ingest
+
+        monkeypatch.setattr(ingest, "INGEST_CHUNK_ROWS", 1)
+        body = self._upload(b'[{"title": "A", "body": "a"}, {"title": "B", "bo').json()
+        assert body["count"] == 1
+        assert body["status"] == "partial"
+        assert "stopped early" in body["message"]
+
+    def test_pretty_printed_object_larger_than_a_read(self):
+        from ingest import INGEST_READ_BYTES, JSONItemStream
+
+        lesson = {"title": "Long Lesson", "body": "line of text\n" * 8000, "metadata": {"week": 1}}
+        raw = json.dumps(lesson, indent=2).encode()
+        assert len(raw) > INGEST_READ_BYTES and raw.count(b"\n") > 1
+        parser = JSONItemStream()
+        items = []
+        for i in range(0, len(raw), 1000):
+            items += parser.feed(raw[i:i + 1000])
+        items += parser.feed(b"", final=True)
+        assert parser.error is None
+        assert items == [(0, lesson, None)]
+
+        body = self._upload(raw, "long.json").json()
+        assert body["count"] == 1 and body["status"] == "indexed" and body["failed"] == 0
+
+    def test_unparseable_multi_line_object_stops_the_stream(self):
+        resp = self._upload(b'{\n  "title": "A",\n  "body": oops\n}\n{"title": "B", "body": "b"}\n')
+        assert resp.status_code == 400
+        assert resp.json()["detail"].startswith("Invalid JSON file: Item 0:")
+        assert _count_rows() == 0
+
+    def test_read_failure_is_a_client_error(self, monkeypatch):
+        from starlette.datastructures import UploadFile
+
+        async def broken_read(self, size=-1):
+            raise OSError("connection reset")
+
+        monkeypatch.setattr(UploadFile, "read", broken_read)
+        resp = self._upload(b'[{"title": "A", "body": "a"}]')
+        assert resp.status_code == 400
+        assert resp.json()["detail"] == "Could not read file: connection reset"
+
+    def test_storage_failure_is_a_server_error(self, monkeypatch):
+        import ingest
+
+        def broken_session():
+            raise RuntimeError("database unavailable")
+
+        monkeypatch.setattr(ingest, "get_session", broken_session)
+        resp = self._upload(b'[{"title": "A", "body": "a"}]')
+        assert resp.status_code == 500
+        assert resp.json()["detail"] == "File upload failed: database unavailable"
+
+    def test_parser_handles_byte_at_a_time_feeds(self):
+        from ingest import JSONItemStream
+
+        raw = json.dumps([{"title": "é" * 3, "body": "x"}, [1, 2], "s"]).encode()
+        parser = JSONItemStream()
+        items = []
+        for i in range(len(raw)):
+            items += parser.feed(raw[i:i + 1])
+        items += parser.feed(b"", final=True)
+        assert parser.error is None
+        assert [item for _, item, _ in items] == [{"title": "ééé", "body": "x"}, [1, 2], "s"]
+
+
+# ── Content-hash deduplication ───────────────────────────────
+
+class TestDeduplication:
+    def _upload_file(self, items, mode="skip"):
+        return client.post("/content/upload-file", params={"on_duplicate": mode},
+                           files={"file": ("bulk.json", json.dumps(items).encode(), "application/json")},
+                           headers=_auth_header()).json()
+
+    def test_reupload_is_skipped_ignoring_case_and_whitespace(self):
+        first = client.post("/content/upload", json={"title": "Lesson One", "body": "Some  body"},
+                            headers=_auth_header()).json()
+        again = client.post("/content/upload", json={"title": "lesson one ", "body": "Some body\n"},
+                            headers=_auth_header()).json()
+        assert first["status"] == "indexed" and not first["deduplicated"]
+        assert again["status"] == "duplicate" and again["deduplicated"]
+        assert again["content_id"] == first["content_id"]
+        assert _count_rows() == 1
+
+    def test_upsert_overwrites_the_stored_item(self):
+        first = client.post("/content/upload", json={"title": "Lesson", "body": "b", "content_type": "lesson"},
+                            headers=_auth_header()).json()
+        resp = client.post("/content/upload", params={"on_duplicate": "upsert"},
+                           json={"title": "Lesson", "body": "b", "content_type": "exercise"},
+                           headers=_auth_header()).json()
+        assert resp["status"] == "updated" and resp["content_id"] == first["content_id"]
+        assert _count_rows() == 1
+        result = client.post("/content/search", json={"query": "lesson"}, headers=_auth_header()).json()
+        assert [r["content_type"] for r in result["results"]] == ["exercise"]
+
+    def test_bulk_import_dedups_with_one_lookup_per_chunk(self, monkeypatch):
+        import ingest
+        from sqlalchemy import event
+
+        monkeypatch.setattr(ingest, "INGEST_CHUNK_ROWS", 2)
+        client.post("/content/upload", json={"title": "Stored", "body": "b"}, headers=_auth_header())
+        items = [{"title": "Stored", "body": "b"}, {"title": "New", "body": "b"},
+                 {"title": "new", "body": "B"}, {"title": "Other", "body": "b"}, {"title": "New", "body": "b"}]
+
+        lookups = []
+
+        def count(conn, cursor, statement, *args):
+            if "content_hash IN" in statement:
+                lookups.append(statement)
+
+        event.listen(database.engine, "before_cursor_execute", count)
+        try:
+            body = self._upload_file(items)
+        finally:
+            event.remove(database.engine, "before_cursor_execute", count)
+
+        assert len(lookups) == body["chunks"] == 3
+        assert body["count"] == 2 and body["duplicates"] == 3 and body["updated"] == 0
+        assert [d["index"] for d in body["deduplicated"]] == [0, 2, 4]
+        assert {d["action"] for d in body["deduplicated"]} == {"skipped"}
+        assert _count_rows() == 3
+
+        rerun = self._upload_file([{"title": "Other", "body": "b", "metadata": {"week": 3}}], mode="upsert")
+        assert rerun["count"] == 0 and rerun["updated"] == 1
+        assert database.get_cached_content()[rerun["deduplicated"][0]["content_id"]]["metadata"] == {"week": 3}
+
+    def test_backfill_hashes_old_rows_and_leaves_old_duplicates(self):
+        for title in ("Old", "old", "Fresh"):
+            client.post("/content/upload", json={"title": title, "body": "x"}, headers=_auth_header())
+        db = database.get_session()
+        db.execute(text("UPDATE content SET content_hash = NULL"))
+        # Stand in for rows written before the unique index existed
+        db.execute(text("UPDATE content SET title = 'old' WHERE title = 'Fresh'"))
+        db.commit()
+        db.close()
+
+        database._backfill_content_hash()
+        db = database.get_session()
+        hashed = db.execute(text("SELECT count(*) FROM content WHERE content_hash IS NOT NULL")).scalar()
+        db.close()
+        assert hashed == 1
+
+
+class TestSeedLoader:
+    def _tree(self, tmp_path):
+        nested = tmp_path / "week1"
+        nested.mkdir()
+        (tmp_path / "lessons.json").write_text(json.dumps([
+            {"title": "Seeded Agents", "body": "agent loops", "metadata": {"week": 1}},
+            {"title": "Seeded Prompts", "body": "prompt basics"},
+        ]))
+        (nested / "more.ndjson").write_text("\n".join([
+            json.dumps({"title": "seeded agents ", "body": "agent  loops"}),  # same content hash
+            json.dumps({"title": "No body"}),
+            json.dumps({"title": "Seeded Evals", "body": "eval harness"}),
+        ]) + "\n")
+        (nested / "notes.txt").write_text("not seed data")
+        return tmp_path
+
+    def test_loads_tree_dedups_and_builds_index_once(self, tmp_path):
+        import seed_loader
+
+        report = seed_loader.load([str(self._tree(tmp_path))], workers=0, batch_rows=2)
+        assert report["files"] == 2 and report["items"] == 5
+        assert report["inserted"] == 3 and report["duplicates"] == 1 and report["failed"] == 1
+        assert report["errors"][0]["index"].endswith("more.ndjson[1]")
+        assert report["batches"] == 2
+        assert _count_rows() == 3
+
+        cache = database._content_cache
+        assert cache is not None and report["indexed"] == len(cache) == 3
+        hits = client.post("/content/search", json={"query": "agent"}, headers=_auth_header()).json()
+        assert [r["title"] for r in hits["results"]] == ["Seeded Agents"]
+
+        again = seed_loader.load([str(tmp_path)], workers=0)
+        assert again["inserted"] == 0 and again["duplicates"] == 4
+
+    def test_loads_pretty_printed_file_larger_than_a_read(self, tmp_path):
+        import seed_loader
+        from ingest import INGEST_READ_BYTES
+
+        lesson = {"title": "Long Seeded Lesson", "body": "paragraph\n" * 10000, "metadata": {"week": 2}}
+        path = tmp_path / "long.json"
+        path.write_text(json.dumps(lesson, indent=2))
+        assert path.stat().st_size > INGEST_READ_BYTES
+
+        report = seed_loader.load([str(path)], workers=0)
+        assert report["inserted"] == 1 and report["failed"] == 0 and report["errors"] == []
+        assert _count_rows() == 1
+
+    def test_parses_in_a_process_pool(self, tmp_path):
+        import seed_loader
+
+        report = seed_loader.load([str(self._tree(tmp_path))], workers=2)
+        assert report["inserted"] == 3 and report["duplicates"] == 1 and report["failed"] == 1
+
+
 # ── Bug 3: Cache must be invalidated after upload ────────────
 
 class TestCacheInvalidation:
@@ -213,8 +456,694 @@ class TestLRUCache:
         assert "Write Through" in titles
 
 
+# ── Cross-worker cache coherence ─────────────────────────────
+
+def _other_worker_write(fn):
+    """Write straight to the DB, bypassing this process's write-through cache."""
+    db = database.get_session()
+    fn(db)
+    db.commit()
+    db.close()
+
+
+class TestCacheCoherence:
+    def _titles(self, query):
+        resp = client.post("/content/search", json={"query": query}, headers=_auth_header())
+        return [r["title"] for r in resp.json()["results"]]
+
+    def test_other_workers_writes_are_applied_as_deltas(self):
+        cache = database.get_cached_content(force_refresh=True)
+        _other_worker_write(lambda db: db.add(database.DBContent(id="w2", title="Remote Lesson", body="sharded")))
+        assert self._titles("sharded") == ["Remote Lesson"]
+        assert database._content_cache is cache  # no full reload
+        assert cache.delta_syncs == 1
+
+        _other_worker_write(lambda db: db.query(database.DBContent).filter_by(id="w2").update({"title": "Renamed"}))
+        assert self._titles("sharded") == ["Renamed"]
+
+        _other_worker_write(lambda db: db.query(database.DBContent).filter_by(id="w2").delete())
+        assert self._titles("sharded") == []
+        assert "w2" not in cache.index
+
+    def test_own_writes_are_not_replayed(self, monkeypatch):
+        cache = database.get_cached_content(force_refresh=True)
+        adds = []
+        real_add = cache.index.add
+        monkeypatch.setattr(cache.index, "add", lambda doc: adds.append(doc.id) or real_add(doc))
+
+        client.post("/content/upload", json={"title": "Mine", "body": "local write"}, headers=_auth_header())
+        generation = cache.generation
+        assert self._titles("local") == ["Mine"]
+        assert cache.delta_syncs == 1  # the change log moved on...
+        assert len(adds) == 1 and cache.generation == generation  # ...but the upload was not re-indexed
+
+    def test_unchanged_version_skips_work(self):
+        cache = database.get_cached_content(force_refresh=True)
+        database.get_cached_content()
+        assert cache.delta_syncs == 0
+
+    def test_too_far_behind_reloads(self, monkeypatch):
+        monkeypatch.setattr(database, "MAX_CACHE_SIZE", 2)
+        cache = database.get_cached_content(force_refresh=True)
+        _other_worker_write(lambda db: db.add_all(
+            [database.DBContent(id=f"bulk{i}", title=f"Bulk {i}", body="b") for i in range(3)]
+        ))
+        assert database.get_cached_content() is not cache
+
+
+class TestIndexSnapshot:
+    def test_cold_start_loads_snapshot_and_replays_delta(self):
+        client.post("/content/upload", json={"title": "Before Restart", "body": "persisted lesson"},
+                    headers=_auth_header())
+        written = database.get_cached_content(force_refresh=True)
+        assert written.snapshot_version == written.version
+        _other_worker_write(lambda db: db.add(database.DBContent(id="w9", title="After Restart", body="lesson")))
+
+        database._content_cache = None  # as after a restart
+        cache = database.get_cached_content()
+        assert cache is not written
+        assert cache.snapshot_version == written.version and cache.delta_syncs == 1
+        assert set(cache) == {*written, "w9"}
+        hits = client.post("/content/search", json={"query": "persisted lesson"}, headers=_auth_header()).json()
+        assert [r["title"] for r in hits["results"]] == ["Before Restart", "After Restart"]
+        assert "<mark>persisted</mark>" in hits["results"][0]["snippet"]
+
+    def test_snapshot_from_another_history_is_rebuilt(self):
+        import index_snapshot
+
+        client.post("/content/upload", json={"title": "Real", "body": "row"}, headers=_auth_header())
+        cache = database.get_cached_content(force_refresh=True)
+        index_snapshot.save(cache, database.SNAPSHOT_PATH, {"version": cache.version, "last_change": "elsewhere",
+                                                           "documents": len(cache)}, database.SNAPSHOT_KEY)
+        database._content_cache = None
+        assert database._load_snapshot() is None
+        assert "Real" in [doc.title for doc in database.get_cached_content().values()]
+
+    def test_unreadable_snapshot_falls_back_to_the_database(self):
+        client.post("/content/upload", json={"title": "Real", "body": "row"}, headers=_auth_header())
+        database.get_cached_content(force_refresh=True)
+        with open(database.SNAPSHOT_PATH, "r+b") as f:
+            f.write(b"junk")
+        database._content_cache = None
+        assert [doc.title for doc in database.get_cached_content().values()] == ["Real"]
+
+    @pytest.mark.parametrize("data", [b"", b"CIDX", b"\x00" * 43, os.urandom(200),
+                                      b"CIDX\x03\x00\x00\x00\xff\xff\x00\x00" + b"\x00" * 40])
+    def test_short_or_garbage_snapshot_falls_back_to_the_database(self, data):
+        client.post("/content/upload", json={"title": "Real", "body": "row"}, headers=_auth_header())
+        database.get_cached_content(force_refresh=True)
+        with open(database.SNAPSHOT_PATH, "wb") as f:
+            f.write(data)
+        database._content_cache = None
+        assert database._load_snapshot() is None
+        hits = client.post("/content/search", json={"query": "row"}, headers=_auth_header()).json()
+        assert [r["title"] for r in hits["results"]] == ["Real"]
+
+    def test_snapshot_signed_with_another_key_is_never_unpickled(self, monkeypatch):
+        import index_snapshot
+
+        client.post("/content/upload", json={"title": "Real", "body": "row"}, headers=_auth_header())
+        cache = database.get_cached_content(force_refresh=True)
+        with index_snapshot.IndexSnapshot(database.SNAPSHOT_PATH, database.SNAPSHOT_KEY) as snapshot:
+            meta = snapshot.meta
+        index_snapshot.save(cache, database.SNAPSHOT_PATH, meta, b"attacker-key")
+
+        def refuse(data):
+            raise AssertionError("unauthenticated snapshot was unpickled")
+
+        monkeypatch.setattr(index_snapshot.pickle, "loads", refuse)
+        database._content_cache = None
+        assert database._load_snapshot() is None
+        assert [doc.title for doc in database.get_cached_content().values()] == ["Real"]
+
+
+# ── BM25 inverted index ──────────────────────────────────────
+
+class TestSearchIndex:
+    def test_title_match_outranks_body_match(self):
+        client.post("/content/upload", json={"title": "Notes", "body": "covers reward hacking briefly"}, headers=_auth_header())
+        client.post("/content/upload", json={"title": "Reward Hacking", "body": "an overview"}, headers=_auth_header())
+        client.post("/content/upload", json={"title": "Unrelated", "body": "nothing to see"}, headers=_auth_header())
+
+        resp = client.post("/content/search", json={"query": "reward hacking"}, headers=_auth_header())
+        body = resp.json()
+        assert body["total"] == 2
+        assert [r["title"] for r in body["results"]] == ["Reward Hacking", "Notes"]
+        assert body["results"][0]["score"] > body["results"][1]["score"]
+
+    def test_eviction_and_updates_keep_index_in_step(self, monkeypatch):
+        monkeypatch.setattr(database, "MAX_CACHE_SIZE", 2)
+        database.get_cached_content(force_refresh=True)
+        cache = database._content_cache
+
+        cache.put({"id": "a", "title": "alpha", "body": "shared", "metadata": {}})
+        cache.put({"id": "b", "title": "beta", "body": "shared", "metadata": {}})
+        cache.put({"id": "a", "title": "gamma", "body": "shared", "metadata": {}})
+        assert cache.index.search("alpha", 5) == ([], 0)
+        assert [d for d, _ in cache.index.search("gamma", 5)[0]] == ["a"]
+
+        cache.put({"id": "c", "title": "delta", "body": "shared", "metadata": {}})  # evicts "b"
+        assert "b" not in cache.index
+        assert cache.index.search("shared", 5)[1] == 2
+
+    def test_cache_entries_are_compact_and_share_index_keys(self):
+        from cached_doc import CachedDoc
+
+        database.get_cached_content(force_refresh=True)
+        cache = database._content_cache
+        cache.put({"id": "a", "title": "Shared Words", "body": "common body", "metadata": {"tags": ["x"]}})
+        cache.put({"id": "b", "title": "shared words", "body": "common", "metadata": {"tags": ["x"]}})
+
+        doc = cache["a"]
+        assert isinstance(doc, CachedDoc) and not hasattr(doc, "__dict__")
+        assert doc["title"] == doc.get("title") == "Shared Words"
+        assert doc.get("missing", 1) == 1
+        with pytest.raises(KeyError):
+            doc["missing"]
+        # Terms, tf tuples and facet keys are shared between documents, not copied per document
+        terms_a, terms_b = cache.index._doc_terms["a"], cache.index._doc_terms["b"]
+        assert all(x is y for x, y in zip(sorted(terms_a)[1:], sorted(terms_b)))
+        assert cache.index._postings["shared"]["a"] is cache.index._postings["shared"]["b"]
+        ordinals = cache.index._ordinals
+        assert cache.index.facets._values[ordinals["a"]][0] is cache.index.facets._values[ordinals["b"]][0]
+
+    def test_snippet_shows_the_matching_passage(self):
+        body = "Unrelated opening material. " * 20 + "Here reward hacking is defined. " + "Closing notes. " * 20
+        client.post("/content/upload", json={"title": "Reward Hacking", "body": body}, headers=_auth_header())
+
+        result = client.post("/content/search", json={"query": "hacking reward"}, headers=_auth_header()).json()["results"][0]
+        assert "<mark>reward</mark> <mark>hacking</mark> is defined" in result["snippet"]
+        assert result["snippet"].startswith("…") and result["snippet"].endswith("…")
+        snippet = result["snippet"]
+        assert [snippet[start:end] for start, end in result["highlights"]] == ["reward", "hacking"]
+        assert all(snippet[start - 6:start] == "<mark>" for start, _ in result["highlights"])
+        assert result["title_highlight"] == "<mark>Reward</mark> <mark>Hacking</mark>"
+        assert result["body"].startswith("Unrelated opening material.")
+
+    def test_title_only_match_has_no_snippet(self):
+        client.post("/content/upload", json={"title": "Reward", "body": "something else"}, headers=_auth_header())
+        result = client.post("/content/search", json={"query": "reward"}, headers=_auth_header()).json()["results"][0]
+        assert result["snippet"] is None and result["highlights"] is None
+        assert result["title_highlight"] == "<mark>Reward</mark>"
+
+    def test_threshold_search_matches_exhaustive_scoring(self, monkeypatch):
+        import search_index
+
+        docs = [
+            {"id": f"d{i}", "title": "agents" if i % 3 == 0 else "planning",
+             "body": " ".join(["agents"] * (i % 5) + ["memory tools"] * (i % 7)), "metadata": {"tags": ["agents"] * (i % 2)}}
+            for i in range(200)
+        ]
+        expected_index = search_index.SearchIndex()
+        for doc in docs:
+            expected_index.add(doc)
+        expected = expected_index.search("agents memory", 10)
+
+        monkeypatch.setattr(search_index, "IMPACT_LIST_MIN_DF", 1)
+        index = search_index.SearchIndex()
+        for doc in docs:
+            index.add(doc)
+        index.search("agents memory", 10)  # builds the impact lists...
+        index.remove("d0")
+        index.add(docs[0])  # ...which then have to be maintained incrementally
+        got = index.search("agents memory", 10)
+
+        assert got[1] == expected[1]
+        assert [round(s, 9) for _, s in got[0]] == [round(s, 9) for _, s in expected[0]]
+
+
+    def test_dense_and_sparse_impacts_follow_adds_and_removes(self, monkeypatch):
+        import search_index
+
+        def doc(i, prefix="d"):
+            return {"id": f"{prefix}{i}", "title": "agents" if i % 4 == 0 else "planning",
+                    "body": " ".join(["agents"] * (i % 5) + ["rare"] * (i % 10 == 5) + ["filler"] * (i % 9))}
+
+        def scores(index):
+            results, total = index.search("agents rare", 10)
+            return [round(s, 9) for _, s in results], total
+
+        # Every step below keeps the average field lengths unchanged, so the
+        # impact lists built by the first search stay exact
+        monkeypatch.setattr(search_index, "IMPACT_LIST_MIN_DF", 50)  # "agents" dense, "rare" sparse
+        index = search_index.SearchIndex()
+        for i in range(200):
+            index.add(doc(i))
+        scores(index)
+        removed = list(range(0, 200, 3))
+        for i in removed:
+            index.remove(f"d{i}")
+        for i in removed:  # freed ordinals are reused last-in first-out, so by other documents
+            index.add(doc(i, "r"))
+        for i in range(200):  # past the end of the impact arrays
+            index.add(doc(i, "c"))
+        got = scores(index)
+        assert isinstance(index._impacts["agents"][1], search_index.array)
+        assert isinstance(index._impacts["rare"][1], search_index._SparseImpacts)
+
+        monkeypatch.setattr(search_index, "IMPACT_LIST_MIN_DF", 10 ** 9)  # exhaustive scoring
+        expected = search_index.SearchIndex()
+        for i in range(200):
+            expected.add(doc(i, "r" if i % 3 == 0 else "d"))
+            expected.add(doc(i, "c"))
+        assert got == scores(expected)
+
+# ── Trigram index: suggest and typo tolerance ────────────────
+
+class TestSuggest:
+    def _upload_lessons(self):
+        client.post("/content/upload", json={"title": "Prompt Engineering Fundamentals", "body": "few shot prompting"}, headers=_auth_header())
+        client.post("/content/upload", json={"title": "Alignment Basics", "body": "outer and inner alignment"}, headers=_auth_header())
+
+    def test_suggest_completes_prefix_and_returns_titles(self):
+        self._upload_lessons()
+        resp = client.get("/content/suggest", params={"q": "prompt eng"}, headers=_auth_header())
+        assert resp.status_code == 200
+        body = resp.json()
+        assert body["suggestions"][0] == "prompt engineering"
+        assert body["titles"][0]["title"] == "Prompt Engineering Fundamentals"
+
+    def test_suggest_corrects_typos(self):
+        self._upload_lessons()
+        resp = client.get("/content/suggest", params={"q": "alignmnt"}, headers=_auth_header())
+        assert resp.json()["suggestions"] == ["alignment"]
+
+    def test_search_tolerates_misspellings(self):
+        self._upload_lessons()
+        resp = client.post("/content/search", json={"query": "alignmnt"}, headers=_auth_header())
+        assert [r["title"] for r in resp.json()["results"]] == ["Alignment Basics"]
+
+    def test_suggest_requires_user(self):
+        assert client.get("/content/suggest", params={"q": "a"}).status_code == 401
+
+    def test_vocabulary_follows_removals(self):
+        from trigram_index import bounded_levenshtein
+        from search_index import SearchIndex
+
+        index = SearchIndex()
+        index.add({"id": "a", "title": "interpretability", "body": "", "metadata": {}})
+        assert "interpretability" in index.terms
+        index.remove("a")
+        assert "interpretability" not in index.terms
+        assert index.suggest("interp", 5) == []
+        assert bounded_levenshtein("alignmnt", "alignment", 2) == 1
+        assert bounded_levenshtein("agents", "alignment", 2) is None
+
+
+# ── Related content ──────────────────────────────────────────
+
+class TestRelated:
+    def _upload(self, title, body):
+        return client.post("/content/upload", json={"title": title, "body": body},
+                           headers=_auth_header()).json()["content_id"]
+
+    def _related(self, content_id, **params):
+        resp = client.get(f"/content/{content_id}/related", params=params, headers=_auth_header())
+        assert resp.status_code == 200
+        return [r["title"] for r in resp.json()["results"]]
+
+    def test_ranks_by_shared_terms_and_follows_uploads(self):
+        agents = self._upload("Building Agents", "agents call tools in a loop and plan with tools")
+        self._upload("Tool Use", "tools let agents act")
+        self._upload("Red Teaming", "adversarial prompts probe model weaknesses")
+        assert self._related(agents) == ["Tool Use"]
+
+        # Merged into the memoized list rather than recomputed
+        self._upload("Agent Planning", "agents plan a loop of tools")
+        assert self._related(agents) == ["Agent Planning", "Tool Use"]
+        assert self._related(agents, limit=1) == ["Agent Planning"]
+
+    def test_updated_and_evicted_documents(self):
+        agents = self._upload("Building Agents", "agents call tools in a loop")
+        tools = self._upload("Tool Use", "tools let agents act")
+        assert self._related(agents) == ["Tool Use"]
+
+        def edit(body):
+            return lambda db: db.query(database.DBContent).filter_by(id=tools).update({"body": body})
+
+        _other_worker_write(edit("unrelated now"))
+        assert self._related(agents) == []
+
+        database.get_cached_content().discard(agents)  # as if evicted by newer content
+        _other_worker_write(edit("tools let agents act"))
+        assert self._related(agents) == ["Tool Use"]
+
+    def test_unknown_content_is_404(self):
+        resp = client.get("/content/missing/related", headers=_auth_header())
+        assert resp.status_code == 404
+
+    def test_neighbour_lists_match_brute_force(self):
+        import random
+        from search_index import SearchIndex
+        from similarity_index import RELATED_TOP_K
+
+        rng = random.Random(7)
+        words = [f"w{i}" for i in range(60)]
+        index = SearchIndex()
+        docs = {}
+        for i in range(120):
+            docs[f"d{i}"] = " ".join(rng.choices(words, k=12))
+            index.add({"id": f"d{i}", "title": "", "body": docs[f"d{i}"], "metadata": {}})
+        index.related("d0", 3)  # first batch build
+
+        for i in range(120, 140):  # small batches, merged into memoized lists
+            docs[f"d{i}"] = " ".join(rng.choices(words, k=12))
+            index.add({"id": f"d{i}", "title": "", "body": docs[f"d{i}"], "metadata": {}})
+            if i % 5 == 0:
+                index.remove(f"d{i - 60}")
+                del docs[f"d{i - 60}"]
+            index.related("d1", 3)
+
+        similar = index.similar
+        similar._build()
+        for doc_id in ("d0", "d1", "d130"):
+            memoized = [d for d, _ in index.related(doc_id, RELATED_TOP_K)]
+            similar._top.clear()
+            fresh = [d for d, _ in index.related(doc_id, RELATED_TOP_K)]
+            assert memoized == fresh
+
+
+# ── Facet bitmaps ────────────────────────────────────────────
+
+def _upload_faceted():
+    for title, ctype, meta in [
+        ("Agents Week 5", "lesson", {"week": 5, "module": "agents", "tags": ["agents", "tools"]}),
+        ("Agents Lab", "exercise", {"week": 5, "module": "agents", "tags": ["agents"]}),
+        ("Agents Recap", "lesson", {"week": 6, "module": "agents", "tags": ["agents", "tools"]}),
+        ("Prompting", "lesson", {"week": 2, "module": "prompt-engineering", "tags": ["prompts"]}),
+    ]:
+        client.post("/content/upload", json={"title": title, "body": "an overview", "content_type": ctype,
+                                             "metadata": meta}, headers=_auth_header())
+
+
+class TestFacets:
+    def test_search_filters_by_week_and_tag_with_counts(self):
+        _upload_faceted()
+        resp = client.post("/content/search", json={"query": "agents", "week": 5, "tags": ["tools"]}, headers=_auth_header())
+        body = resp.json()
+        assert [r["title"] for r in body["results"]] == ["Agents Week 5"]
+        assert body["total"] == 1
+        assert body["facets"]["content_type"] == {"lesson": 1}
+
+        resp = client.post("/content/search", json={"query": "agents"}, headers=_auth_header())
+        facets = resp.json()["facets"]
+        assert facets["week"] == {"5": 2, "6": 1}
+        assert facets["tags"] == {"agents": 3, "tools": 2}
+
+    def test_listing_filters_and_counts(self):
+        _upload_faceted()
+        resp = client.get("/content", params={"module": "agents", "content_type": "lesson"}, headers=_auth_header())
+        body = resp.json()
+        assert sorted(c["title"] for c in body["content"]) == ["Agents Recap", "Agents Week 5"]
+        assert body["facets"]["week"] == {"5": 1, "6": 1}
+
+        resp = client.get("/content", params=[("tags", "agents"), ("tags", "tools")], headers=_auth_header())
+        assert resp.json()["total"] == 2
+
+    def test_fts_backend_applies_filters(self, fts_backend):
+        _upload_faceted()
+        resp = client.post("/content/search", json={"query": "agents", "week": 5, "content_type": "exercise"},
+                           headers=_auth_header())
+        assert [r["title"] for r in resp.json()["results"]] == ["Agents Lab"]
+
+    def test_removed_documents_leave_the_bitmaps(self):
+        from search_index import SearchIndex
+
+        index = SearchIndex()
+        index.add({"id": "a", "title": "x", "body": "", "content_type": "lesson", "metadata": {"week": 1}})
+        index.add({"id": "b", "title": "x", "body": "", "content_type": "lesson", "metadata": {"week": 2}})
+        index.remove("a")
+        assert index.facet_counts() == {"content_type": {"lesson": 1}, "module": {}, "week": {"2": 1}, "tags": {}}
+
+
+# ── FTS5 search backend ──────────────────────────────────────
+
+class TestResultCache:
+    def _stats(self):
+        return client.get("/metrics").json()["search_cache"]
+
+    def test_repeated_and_equivalent_queries_hit(self):
+        import main
+
+        main._result_cache.clear()
+        client.post("/content/upload", json={"title": "Reward Hacking", "body": "an overview"}, headers=_auth_header())
+        before = self._stats()
+
+        first = client.post("/content/search", json={"query": "reward hacking"}, headers=_auth_header()).json()
+        again = client.post("/content/search", json={"query": "Hacking,  REWARD"}, headers=_auth_header()).json()
+        after = self._stats()
+
+        assert again["results"] == first["results"] and again["total"] == first["total"]
+        assert again["query"] == "Hacking,  REWARD"
+        assert after["misses"] == before["misses"] + 1
+        assert after["hits"] == before["hits"] + 1
+
+    def test_writes_invalidate_cached_results(self):
+        client.post("/content/upload", json={"title": "Reward Hacking", "body": "an overview"}, headers=_auth_header())
+        assert client.post("/content/search", json={"query": "reward"}, headers=_auth_header()).json()["total"] == 1
+
+        client.post("/content/upload", json={"title": "More Reward", "body": "models"}, headers=_auth_header())
+        resp = client.post("/content/search", json={"query": "reward"}, headers=_auth_header()).json()
+        assert resp["total"] == 2
+        assert self._stats()["invalidations"] >= 1
+
+    def test_limit_and_filters_are_part_of_the_key(self):
+        _upload_faceted()
+        unfiltered = client.post("/content/search", json={"query": "agents", "limit": 5}, headers=_auth_header()).json()
+        filtered = client.post("/content/search", json={"query": "agents", "limit": 5, "week": 5},
+                               headers=_auth_header()).json()
+        one = client.post("/content/search", json={"query": "agents", "limit": 1}, headers=_auth_header()).json()
+        assert filtered["total"] < unfiltered["total"]
+        assert len(one["results"]) == 1
+
+
+class TestFTSSearch:
+    @pytest.fixture(autouse=True)
+    def _fts_backend(self, fts_backend):
+        pass
+
+    def test_table_only_exists_for_the_fts5_backend(self, monkeypatch):
+        def fts_table():
+            with database.engine.connect() as conn:
+                return conn.exec_driver_sql("SELECT 1 FROM sqlite_master WHERE name = 'content_fts'").first()
+
+        monkeypatch.setattr(database, "SEARCH_BACKEND", "memory")
+        database.init_db(seed_defaults=False)
+        assert fts_table() is None
+        client.post("/content/upload", json={"title": "Written While Off", "body": "circuits"}, headers=_auth_header())
+
+        monkeypatch.setattr(database, "SEARCH_BACKEND", "fts5")
+        database.init_db(seed_defaults=False)  # first switch builds it from the content table
+        assert fts_table() is not None
+        resp = client.post("/content/search", json={"query": "circuits"}, headers=_auth_header()).json()
+        assert [r["title"] for r in resp["results"]] == ["Written While Off"]
+
+    def test_searches_beyond_cache_with_snippets(self, monkeypatch):
+        monkeypatch.setattr(database, "MAX_CACHE_SIZE", 1)
+        client.post("/content/upload", json={"title": "Old Lesson", "body": "interpretability of transformer circuits",
+                                             "metadata": {"tags": ["mechinterp"]}}, headers=_auth_header())
+        client.post("/content/upload", json={"title": "New Lesson", "body": "something else"}, headers=_auth_header())
+
+        resp = client.post("/content/search", json={"query": "circuits"}, headers=_auth_header())
+        body = resp.json()
+        assert body["source"] == "fts5"
+        assert body["total"] == 1
+        assert body["results"][0]["title"] == "Old Lesson"
+        assert "<mark>circuits</mark>" in body["results"][0]["snippet"]
+
+        resp = client.post("/content/search", json={"query": "mechinterp"}, headers=_auth_header())
+        assert [r["title"] for r in resp.json()["results"]] == ["Old Lesson"]
+
+    def test_triggers_follow_updates_and_deletes(self):
+        resp = client.post("/content/upload", json={"title": "Draft", "body": "red teaming"}, headers=_auth_header())
+        content_id = resp.json()["content_id"]
+
+        db = database.get_session()
+        db.query(database.DBContent).filter(database.DBContent.id == content_id).update({"body": "jailbreak taxonomy"})
+        db.commit()
+        db.close()
+        search = lambda q: client.post("/content/search", json={"query": q}, headers=_auth_header()).json()
+        assert search("teaming")["total"] == 0
+        assert search("taxonomy")["total"] == 1
+
+        db = database.get_session()
+        db.query(database.DBContent).filter(database.DBContent.id == content_id).delete()
+        db.commit()
+        db.close()
+        assert search("taxonomy")["total"] == 0
+
+    def test_rows_stay_linked_when_content_rowids_change(self):
+        import fts_search
+        search = lambda q: [r["title"] for r in client.post("/content/search", json={"query": q},
+                                                             headers=_auth_header()).json()["results"]]
+        ids = [client.post("/content/upload", json={"title": title, "body": body}, headers=_auth_header()).json()["content_id"]
+               for title, body in [("First", "alpha"), ("Second", "bravo"), ("Third", "charlie")]]
+        _other_worker_write(lambda db: db.query(database.DBContent).filter(database.DBContent.id == ids[0]).delete())
+        # VACUUM may renumber the implicit rowid of a table without an INTEGER
+        # PRIMARY KEY, without firing triggers; do the same by hand
+        with database.engine.begin() as conn:
+            for trigger in ("content_fts_insert", "content_fts_delete", "content_fts_update"):
+                conn.exec_driver_sql(f"DROP TRIGGER {trigger}")
+            low, high = conn.exec_driver_sql("SELECT min(rowid), max(rowid) FROM content").one()
+            conn.exec_driver_sql("UPDATE content SET rowid = -rowid")
+            conn.exec_driver_sql(f"UPDATE content SET rowid = {low + high} + rowid")  # reversed order
+        fts_search.init_fts(database.engine)
+
+        assert search("bravo") == ["Second"] and search("charlie") == ["Third"]
+        _other_worker_write(lambda db: db.query(database.DBContent).filter(database.DBContent.id == ids[2])
+                            .update({"body": "delta"}))
+        assert search("charlie") == [] and search("delta") == ["Third"] and search("bravo") == ["Second"]
+        _other_worker_write(lambda db: db.query(database.DBContent).filter(database.DBContent.id == ids[1]).delete())
+        assert search("bravo") == [] and search("delta") == ["Third"]
+
+    def test_table_linked_by_rowid_is_rebuilt(self):
+        import fts_search
+
+        client.post("/content/upload", json={"title": "Kept", "body": "echo"}, headers=_auth_header())
+        with database.engine.begin() as conn:  # as left by a version without the keys table
+            conn.exec_driver_sql(f"DROP TABLE {fts_search.FTS_KEYS_TABLE}")
+            conn.exec_driver_sql(f"DELETE FROM {fts_search.FTS_TABLE}")
+        fts_search.init_fts(database.engine)
+        resp = client.post("/content/search", json={"query": "echo"}, headers=_auth_header()).json()
+        assert [r["title"] for r in resp["results"]] == ["Kept"]
+
+    def test_query_syntax_is_escaped(self):
+        client.post("/content/upload", json={"title": "Agents", "body": "tool use"}, headers=_auth_header())
+        resp = client.post("/content/search", json={"query": 'agents" OR (NEAR -*'}, headers=_auth_header())
+        assert resp.status_code == 200
+        assert resp.json()["total"] == 1
+
+
+# ── Keyset-paginated, projected listing ──────────────────────
+
+class TestListing:
+    def _upload(self, n):
+        for i in range(n):
+            client.post("/content/upload", json={"title": f"Item {i}", "body": "x" * 250, "metadata": {"week": i}},
+                        headers=_auth_header())
+
+    def test_keyset_pages_cover_everything_once(self):
+        self._upload(5)
+        seen, cursor = [], None
+        while True:
+            params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+            body = client.get("/content", params=params, headers=_auth_header()).json()
+            seen += [c["title"] for c in body["content"]]
+            cursor = body["next_cursor"]
+            if cursor is None:
+                break
+        assert sorted(seen) == [f"Item {i}" for i in range(5)]
+        assert len(seen) == 5
+
+    def test_projection_and_sql_preview(self):
+        self._upload(1)
+        item = client.get("/content", params={"fields": "title,body"}, headers=_auth_header()).json()["content"][0]
+        assert set(item) == {"id", "title", "body"}
+        assert item["body"] == "x" * 200 + "..."
+
+    def test_stream_returns_ndjson(self):
+        self._upload(3)
+        resp = client.get("/content", params={"stream": "true", "fields": "title"}, headers=_auth_header())
+        assert resp.headers["content-type"].startswith("application/x-ndjson")
+        lines = [json.loads(line) for line in resp.text.splitlines()]
+        assert len(lines) == 3
+        assert set(lines[0]) == {"id", "title"}
+
+    def test_bad_cursor_and_fields_return_400(self):
+        assert client.get("/content", params={"cursor": "nope"}, headers=_auth_header()).status_code == 400
+        assert client.get("/content", params={"fields": "password"}, headers=_auth_header()).status_code == 400
+
+    def test_listing_uses_created_at_index(self):
+        db = database.get_session()
+        plan = db.execute(text(
+            "EXPLAIN QUERY PLAN SELECT id FROM content ORDER BY created_at DESC, id DESC LIMIT 10"
+        )).all()
+        db.close()
+        assert any("ix_content_created_at_id" in str(row) for row in plan)
+
+
 # ── Bug 4: No bare excepts — proper error responses ─────────
 
+class TestInternalSnapshot:
+    def test_etag_revalidation_and_gzip(self):
+        client.post("/content/upload", json={"title": "Lesson", "body": "body " * 100}, headers=_auth_header())
+
+        first = client.get("/content/internal", params={"limit": 5})
+        assert first.status_code == 200
+        assert first.headers["content-encoding"] == "gzip"
+        assert [item["title"] for item in first.json()["content"]] == ["Lesson"]
+        etag = first.headers["etag"]
+
+        again = client.get("/content/internal", params={"limit": 5}, headers={"If-None-Match": etag})
+        assert again.status_code == 304 and again.content == b""
+
+        client.post("/content/upload", json={"title": "Newer", "body": "b"}, headers=_auth_header())
+        changed = client.get("/content/internal", params={"limit": 5}, headers={"If-None-Match": etag})
+        assert changed.status_code == 200 and changed.headers["etag"] != etag
+        assert [item["title"] for item in changed.json()["content"]] == ["Newer", "Lesson"]
+
+    def test_since_returns_only_changes(self):
+        keep = client.post("/content/upload", json={"title": "Keep", "body": "b"}, headers=_auth_header()).json()
+        gone = client.post("/content/upload", json={"title": "Gone", "body": "b"}, headers=_auth_header()).json()
+        version = client.get("/content/internal").json()["version"]
+
+        unchanged = client.get("/content/internal", params={"since": version}).json()
+        assert unchanged == {"content": [], "version": version, "delta": True, "deleted": []}
+
+        client.post("/content/upload", json={"title": "Added", "body": "b"}, headers=_auth_header())
+        db = database.get_session()
+        db.query(database.DBContent).filter(database.DBContent.id == gone["content_id"]).delete()
+        db.commit()
+        db.close()
+
+        delta = client.get("/content/internal", params={"since": version}).json()
+        assert delta["delta"] is True and delta["version"] > version
+        assert [item["title"] for item in delta["content"]] == ["Added"]
+        assert delta["deleted"] == [gone["content_id"]]
+        assert keep["content_id"] not in delta["deleted"]
+
+    def test_applying_deltas_keeps_the_newest_limit_window(self):
+        import random
+
+        rng = random.Random(3)
+        limit = 4
+        uploaded = [client.post("/content/upload", json={"title": f"T{i}", "body": f"b{i}"},
+                                headers=_auth_header()).json()["content_id"] for i in range(8)]
+        first = client.get("/content/internal", params={"limit": limit}).json()
+        mirror = {item["id"]: item["title"] for item in first["content"]}  # what the chat service keeps
+        version = first["version"]
+        for step in range(12):
+            action = rng.choice(["add", "add", "delete", "edit"])
+            if action == "add":
+                uploaded.append(client.post("/content/upload", json={"title": f"N{step}", "body": f"n{step}"},
+                                            headers=_auth_header()).json()["content_id"])
+            elif len(uploaded) > 1:
+                target = rng.choice(uploaded)
+                if action == "delete":
+                    uploaded.remove(target)
+                    _other_worker_write(lambda db: db.query(database.DBContent)
+                                        .filter(database.DBContent.id == target).delete())
+                else:
+                    _other_worker_write(lambda db: db.query(database.DBContent)
+                                        .filter(database.DBContent.id == target).update({"title": f"E{step}"}))
+            delta = client.get("/content/internal", params={"limit": limit, "since": version}).json()
+            assert delta["delta"] is True
+            for content_id in delta["deleted"]:
+                mirror.pop(content_id, None)
+            mirror.update({item["id"]: item["title"] for item in delta["content"]})
+            version = delta["version"]
+
+            full = client.get("/content/internal", params={"limit": limit}).json()["content"]
+            assert mirror == {item["id"]: item["title"] for item in full}, action
+
+    def test_since_falls_back_to_full_snapshot(self):
+        client.post("/content/upload", json={"title": "Only", "body": "b"}, headers=_auth_header())
+        current = client.get("/content/internal").json()["version"]
+        full = client.get("/content/internal", params={"since": current + 100}).json()
+        assert full["delta"] is False
+        assert [item["title"] for item in full["content"]] == ["Only"]
+
+
 class TestErrorHandling:
     def test_missing_auth_returns_401(self):
         resp = client.post("/content/upload", json={"title": "x", "body": "y"})
@@ -0,0 +1,103 @@
+import bisect
+import heapq
+from collections import Counter, defaultdict
+
+
+def trigrams(term: str) -> set[str]:
+    """Trigrams of the padded term ("  ab " -> "  a", " ab", "ab "), so even
+    one- and two-letter terms have some and word starts weigh more."""
+    padded = f"  {term} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def max_edits(term: str) -> int:
+    """Typos tolerated for a term of this length."""
+    if len(term) <= 3:
+        return 0
+    return 1 if len(term) <= 6 else 2
+
+
+def bounded_levenshtein(a: str, b: str, limit: int) -> int | None:
+    """Edit distance between a and b, or None as soon as it must exceed limit."""
+    if abs(len(a) - len(b)) > limit:
+        return None
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > limit:
+            return None
+        previous = current
+    return previous[-1] if previous[-1] <= limit else None
+
+
+class TrigramIndex:
+    """Vocabulary index for as-you-type lookups.
+
+    A sorted term list answers prefix completion with one bisect and a range
+    scan; trigram postings narrow fuzzy lookups down to terms sharing enough
+    trigrams before any edit distance is computed. Ranking is left to the
+    caller through a `weight(term)` function (document frequency, typically),
+    so the vocabulary itself is all this needs to store."""
+
+    def __init__(self):
+        self._grams = defaultdict(set)  # trigram -> terms
+        self._sorted = []
+
+    def __len__(self):
+        return len(self._sorted)
+
+    def __contains__(self, term):
+        i = bisect.bisect_left(self._sorted, term)
+        return i < len(self._sorted) and self._sorted[i] == term
+
+    def add(self, term: str):
+        i = bisect.bisect_left(self._sorted, term)
+        if i < len(self._sorted) and self._sorted[i] == term:
+            return
+        self._sorted.insert(i, term)
+        for gram in trigrams(term):
+            self._grams[gram].add(term)
+
+    def remove(self, term: str):
+        i = bisect.bisect_left(self._sorted, term)
+        if i == len(self._sorted) or self._sorted[i] != term:
+            return
+        del self._sorted[i]
+        for gram in trigrams(term):
+            terms = self._grams[gram]
+            terms.discard(term)
+            if not terms:
+                del self._grams[gram]
+
+    def clear(self):
+        self._grams.clear()
+        self._sorted.clear()
+
+    def complete(self, prefix: str, limit: int, weight) -> list[str]:
+        """Highest-weight terms starting with prefix."""
+        if not prefix:
+            return []
+        start = bisect.bisect_left(self._sorted, prefix)
+        end = bisect.bisect_left(self._sorted, prefix + "￿", start)
+        return heapq.nlargest(limit, self._sorted[start:end], key=weight)
+
+    def fuzzy(self, term: str, limit: int, weight, max_distance: int | None = None) -> list[tuple[str, int]]:
+        """[(term, distance)] within max_distance edits, closest then heaviest first."""
+        if max_distance is None:
+            max_distance = max_edits(term)
+        grams = trigrams(term)
+        # Each edit destroys at most three of the query's trigrams
+        needed = max(len(grams) - 3 * max_distance, 1)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self._grams.get(gram, ()))
+        matches = []
+        for candidate, count in shared.items():
+            if count < needed:
+                continue
+            distance = bounded_levenshtein(term, candidate, max_distance)
+            if distance is not None:
+                matches.append((candidate, distance))
+        return heapq.nsmallest(limit, matches, key=lambda m: (m[1], -weight(m[0]), m[0]))
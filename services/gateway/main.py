@@ -4,7 +4,8 @@ import random
 import httpx
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
 
 from middleware import verify_token
 
@@ -39,21 +40,43 @@ async def proxy(request: Request, target_url: str, extra_headers: dict = None):
 
     body = await request.body()
 
+    client = httpx.AsyncClient(timeout=TIMEOUT)
     try:
-        async with httpx.AsyncClient(timeout=TIMEOUT) as client:
-            resp = await client.request(
+        resp = await client.send(
+            client.build_request(
                 method=request.method,
                 url=target_url,
                 headers=headers,
                 content=body,
-                params=dict(request.query_params),
-            )
-        return JSONResponse(content=resp.json(), status_code=resp.status_code)
+                # multi_items(): a dict would keep only one of repeated params like tags=a&tags=b
+                params=request.query_params.multi_items(),
+            ),
+            stream=True,
+        )
     except httpx.ConnectError:
+        await client.aclose()
         raise HTTPException(status_code=503, detail=f"Service unavailable ({target_url})")
     except httpx.TimeoutException:
+        await client.aclose()
         raise HTTPException(status_code=504, detail="Service timed out")
 
+    content_type = resp.headers.get("content-type", "")
+    if content_type.startswith("application/json"):
+        try:
+            await resp.aread()
+        finally:
+            await resp.aclose()
+            await client.aclose()
+        return JSONResponse(content=resp.json(), status_code=resp.status_code)
+
+    # Anything else (e.g. NDJSON from ?stream=true) is passed through chunk by chunk
+    async def close():
+        await resp.aclose()
+        await client.aclose()
+
+    return StreamingResponse(resp.aiter_bytes(), status_code=resp.status_code, media_type=content_type or None,
+                             background=BackgroundTask(close))
+
 
 @app.get("/")
 async def root():
@@ -132,6 +155,19 @@ async def search_content(request: Request):
     return await proxy(request, f"{CONTENT_SERVICE_URL}/content/search", extra_headers={"x-user-id": payload["user_id"]})
 
 
+@app.get("/content/suggest")
+async def suggest_content(request: Request):
+    payload = await verify_token(request)
+    return await proxy(request, f"{CONTENT_SERVICE_URL}/content/suggest", extra_headers={"x-user-id": payload["user_id"]})
+
+
+@app.get("/content/{content_id}/related")
+async def related_content(content_id: str, request: Request):
+    payload = await verify_token(request)
+    return await proxy(request, f"{CONTENT_SERVICE_URL}/content/{content_id}/related",
+                       extra_headers={"x-user-id": payload["user_id"]})
+
+
 @app.get("/content")
 async def list_content(request: Request):
     payload = await verify_token(request)